@@ -1,6 +1,10 @@
 import argparse
+import functools
 import logging
 import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from utils import (
     ltsa_parser,
@@ -114,6 +118,26 @@ def insert_status_into_etl_log_table(engine, status):
         raise e
 
 
+def get_last_successful_job_id(engine):
+    """
+    Get job_id of the most recent successful run from etl_log table.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+
+    Returns:
+        job_id (UUID): Job_id from etl_log table OR job_id (None): If no run has succeeded.
+    """
+    try:
+        select_sql = "SELECT job_id FROM etl_log WHERE status = 'Success' ORDER BY updated_at DESC LIMIT 1"
+        with engine.begin() as conn:
+            result = conn.execute(text(select_sql)).fetchone()
+        return result[0] if result else None
+
+    except Exception as e:
+        raise e
+
+
 def update_status_in_etl_log_table(engine, job_id, status, folder=None):
     """
     Update row in etl_log table with provided status.
@@ -145,6 +169,7 @@ def update_status_in_etl_log_table(engine, job_id, status, folder=None):
 def delete_rows_with_job_id(engine, table_column, job_id):
     """
     Delete rows in provided tables where job_id is a foreign key in the provided row.
+    Tables partitioned by that column have the partition of the job dropped instead.
 
     Args:
         engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
@@ -156,6 +181,10 @@ def delete_rows_with_job_id(engine, table_column, job_id):
     """
     try:
         for table_name, column_name in table_column.items():
+            if postgres_writer.is_partitioned_table(table_name, engine):
+                postgres_writer.drop_job_partition(table_name, engine, job_id)
+                continue
+
             delete_sql = f"""
                 DELETE FROM {table_name} WHERE {column_name} = '{job_id}';
             """
@@ -165,6 +194,84 @@ def delete_rows_with_job_id(engine, table_column, job_id):
         raise e
 
 
+class CancellableQueue(queue.Queue):
+    """
+    Bounded queue whose producer stops waiting for room once the consumer cancels it, so a failed writer does not
+    leave the parser blocked on a full queue.
+    """
+
+    def __init__(self, maxsize=0):
+        super().__init__(maxsize)
+        self.cancelled = threading.Event()
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Puts an item on the queue, waiting for room until the queue is cancelled.
+
+        Args:
+            item: The item to put on the queue.
+            block (bool): Ignored, put always waits for room.
+            timeout (float): Ignored, put waits until the queue is cancelled.
+
+        Returns:
+            None
+        """
+        while not self.cancelled.is_set():
+            try:
+                return super().put(item, timeout=0.1)
+            except queue.Full:
+                pass
+        raise RuntimeError("Parsing cancelled because writing to the db failed")
+
+
+def publish_parsed_tables(parse, table_queue):
+    """
+    Runs the parser, putting each parsed table on the queue, and closes the queue with None when the parser is done,
+    whether it succeeded or not. A cancelled queue is not closed, as nothing reads it anymore.
+
+    Args:
+        parse (callable): Runs the parser, given the queue to put parsed tables on as table_queue.
+        table_queue (CancellableQueue): Queue of (table name, dataframe) pairs.
+
+    Returns:
+        None
+    """
+    try:
+        parse(table_queue=table_queue)
+    finally:
+        if not table_queue.cancelled.is_set():
+            table_queue.put(None)
+
+
+def parse_and_write_concurrently(parse, write, queue_size=2):
+    """
+    Parses the LTSA files in a background thread and writes each table to the database as soon as it is parsed.
+    The queue between the two is bounded, so parsed tables waiting to be written do not pile up in memory. If the
+    writer fails, the parser is cancelled at its next table and the writer's error is raised.
+
+    Args:
+        parse (callable): Runs the parser, given the queue to put parsed tables on as table_queue.
+        write (callable): Runs the database writer, given the tables to write as dataframes.
+        queue_size (int): Number of parsed tables that can wait to be written. Default is 2.
+
+    Returns:
+        None
+    """
+    table_queue = CancellableQueue(maxsize=queue_size)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        parser_future = executor.submit(publish_parsed_tables, parse, table_queue)
+        try:
+            write(dataframes=iter(table_queue.get, None))
+        except Exception:
+            # The parser stops at its next table, and the executor waits for it before the error is raised
+            table_queue.cancelled.set()
+            raise
+
+        # A parser error ends the queue early, so it is raised even though the writer finished
+        parser_future.result()
+
+
 def main():
     """
     Sets parser arguments and runs modules for ETL job:
@@ -172,6 +279,7 @@ def main():
         - Process the downloaded SFTP files and write to the output folder
         - Write processed data to the PostgreSQL database
         - Expire PINs of cancelled titles
+        - Drop raw table partitions older than the retention period, if one is set
         - Send an email with the log file attachment regardless of success or error
 
     Returns:
@@ -211,6 +319,70 @@ def main():
         help="Local output folder for the processed csv files.",
         default="/data/output/",
     )
+    parser.add_argument(
+        "--processed_data_format",
+        type=str,
+        default="csv",
+        choices=["csv", "parquet", "arrow"],
+        help="Format of the processed files. parquet is zstd compressed, arrow is uncompressed Arrow IPC that is memory mapped when read.",
+    )
+    parser.add_argument(
+        "--in_process_pipeline",
+        action="store_true",
+        help="Hand the parsed dataframes straight to the database writer instead of writing and reading back the processed files.",
+    )
+    parser.add_argument(
+        "--parse_write_concurrently",
+        action="store_true",
+        help="Write each parsed table to the database while the remaining LTSA files are still being parsed. Implies --in_process_pipeline.",
+    )
+    parser.add_argument(
+        "--parse_queue_size",
+        type=int,
+        default=2,
+        help="Number of parsed tables that can wait to be written with --parse_write_concurrently.",
+    )
+    parser.add_argument(
+        "--profile_cleaning_rules",
+        action="store_true",
+        help="Time each data cleaning rule in its own pass instead of fusing the rules on each column.",
+    )
+    parser.add_argument(
+        "--cleaning_cache_path",
+        type=str,
+        default=None,
+        help="Local folder to keep a cache of cleaned active_pin values in, so only values not seen by an earlier run are cleaned.",
+    )
+    parser.add_argument(
+        "--cleaning_cache_max_entries",
+        type=int,
+        default=1000000,
+        help="Maximum number of cleaned values kept in the cache for each column. The least recently used are evicted first.",
+    )
+    parser.add_argument(
+        "--ltsa_csv_engine",
+        type=str,
+        default="c",
+        choices=["c", "pyarrow"],
+        help="Parser for the LTSA files. pyarrow parses them on multiple threads into Arrow-backed string columns.",
+    )
+    parser.add_argument(
+        "--ltsa_csv_read_threads",
+        type=int,
+        default=None,
+        help="Number of threads the pyarrow engine parses with. Set it to the pod's CPU limit.",
+    )
+    parser.add_argument(
+        "--ltsa_titleowner_chunk_size",
+        type=int,
+        default=None,
+        help="Stream 4_titleowner.csv in chunks of this many rows, keeping only the rows of titles in titleparcel_raw, so peak memory follows the filtered rows instead of the file size.",
+    )
+    parser.add_argument(
+        "--write_processed_files",
+        action="store_true",
+        help="Also write the processed files for audit when --in_process_pipeline or --parse_write_concurrently is set.",
+    )
     parser.add_argument("--db_host", type=str, help="Host name of the PostgresDB.")
     parser.add_argument(
         "--db_port", type=int, default=5432, help="Port number of the Postgres DB."
@@ -226,6 +398,101 @@ def main():
         default=1000,
         help="Number of records to be written to the db in one batch.",
     )
+    parser.add_argument(
+        "--db_target_batch_seconds",
+        type=float,
+        default=None,
+        help="Adapt the db write batch size of each table so batches take about this many seconds. Keeps --db_write_batch_size fixed if not set.",
+    )
+    parser.add_argument(
+        "--db_target_batch_bytes",
+        type=int,
+        default=None,
+        help="Size the db write batches of each table to hold about this many bytes.",
+    )
+    parser.add_argument(
+        "--db_rebuild_indexes",
+        action="store_true",
+        help="Build secondary indexes once a job partition, or a table in an atomic load, is loaded instead of updating them with every batch.",
+    )
+    parser.add_argument(
+        "--db_unlogged_load",
+        action="store_true",
+        help="Load raw table partitions unlogged and set them logged once they are loaded.",
+    )
+    parser.add_argument(
+        "--db_active_pin_load",
+        type=str,
+        default="append",
+        choices=["append", "merge"],
+        help="Load mode of active_pin. append inserts rows that do not exist yet, merge inserts, updates and deletes rows so active_pin matches the parsed data.",
+    )
+    parser.add_argument(
+        "--db_active_pin_shadow_swap",
+        action="store_true",
+        help="Load active_pin into a shadow copy and swap it in with a rename once it is loaded.",
+    )
+    parser.add_argument(
+        "--db_load_method",
+        type=str,
+        choices=["insert", "copy"],
+        default="insert",
+        help="Method used to write batches to the db: literal INSERT statements or COPY through a staging table.",
+    )
+    parser.add_argument(
+        "--db_write_workers",
+        type=int,
+        default=1,
+        help="Number of db connections each table is loaded over in parallel.",
+    )
+    parser.add_argument(
+        "--db_atomic_load",
+        action="store_true",
+        help="Write every table to the db in one transaction, so a failed run leaves nothing to undo.",
+    )
+    parser.add_argument(
+        "--db_batch_retries",
+        type=int,
+        default=0,
+        help="Number of times a batch that failed to write to the db is retried.",
+    )
+    parser.add_argument(
+        "--db_read_chunk_size",
+        type=int,
+        default=None,
+        help="Number of rows of each processed file to read and write to the db at a time. Reads whole files if not set.",
+    )
+    parser.add_argument(
+        "--db_conflict_key",
+        type=str,
+        choices=["columns", "row_hash"],
+        default="columns",
+        help="Key used to skip duplicate rows: every column, or a content hash stored in each table's row_hash column.",
+    )
+    parser.add_argument(
+        "--db_delta_snapshot_path",
+        type=str,
+        default=None,
+        help="Local folder to record raw table row hashes in. When set, only rows added or changed since the last successful run are written to the raw tables.",
+    )
+    parser.add_argument(
+        "--raw_storage",
+        type=str,
+        choices=["snapshot", "history"],
+        default="snapshot",
+        help="How raw LTSA data is stored: a full snapshot per run in the raw tables, or each distinct row once in <table>_history with first and last etl_log_id.",
+    )
+    parser.add_argument(
+        "--raw_retention_weeks",
+        type=int,
+        default=None,
+        help="Number of weeks of snapshots to keep in raw tables partitioned by etl_log_id. Older partitions are dropped after a successful run. Keeps every snapshot if not set.",
+    )
+    parser.add_argument(
+        "--raw_retention_detach_only",
+        action="store_true",
+        help="Detach expired raw table partitions instead of dropping them.",
+    )
     parser.add_argument(
         "--data_rules_url",
         type=str,
@@ -259,6 +526,32 @@ def main():
     )
 
     args = parser.parse_args()
+
+    # A parallel load stages every batch and inserts them in one statement, so batches are not timed or retried
+    if args.db_write_workers > 1 and (
+        args.db_target_batch_seconds or args.db_batch_retries
+    ):
+        parser.error(
+            "--db_target_batch_seconds and --db_batch_retries cannot be used with --db_write_workers above 1"
+        )
+
+    # History tables keep each distinct row once already, and are written without comparing against a snapshot
+    if args.raw_storage == "history" and args.db_delta_snapshot_path:
+        parser.error(
+            "--db_delta_snapshot_path cannot be used with --raw_storage history, which does not write delta snapshots"
+        )
+
+    # A delta run only writes changed rows, so unchanged rows live in the partitions of earlier runs
+    if args.raw_retention_weeks and args.db_delta_snapshot_path:
+        parser.error(
+            "--raw_retention_weeks cannot be used with --db_delta_snapshot_path, it would drop partitions holding rows of the current snapshot"
+        )
+    raw_tables_and_log_id_column = {
+        "title_raw": "etl_log_id",
+        "parcel_raw": "etl_log_id",
+        "titleparcel_raw": "etl_log_id",
+        "titleowner_raw": "etl_log_id",
+    }
     log_filename = f"etl_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
 
     try:
@@ -269,6 +562,7 @@ def main():
         # Create a connection to the PostgreSQL database
         conn_str = f"postgresql://{args.db_username}:{args.db_password}@{args.db_host}:{args.db_port}/{args.db_name}"
         engine = create_engine(conn_str)
+        previous_job_id = None
 
         # Add entry to etl_log table
         etl_log_start_time = time.time()
@@ -308,29 +602,28 @@ def main():
             # Update with latest folder name
             update_status_in_etl_log_table(engine, job_id, "In Progress", folder=folder)
 
-            # Step 2: Process the downloaded SFTP files and write to the output folder
-
-            parser_start_time = time.time()
-            print("------\nSTEP 2: PARSING LTSA FILES\n------")
-
-            ltsa_parser.run(
+            in_process = args.in_process_pipeline or args.parse_write_concurrently
+            parse = functools.partial(
+                ltsa_parser.run,
                 input_directory=args.sftp_local_path,
                 output_directory=args.processed_data_path,
                 data_rules_url=args.data_rules_url,
                 engine=engine,
+                write_files=not in_process or args.write_processed_files,
+                output_format=args.processed_data_format,
+                profile_cleaning=args.profile_cleaning_rules,
+                cleaning_cache_directory=args.cleaning_cache_path,
+                cleaning_cache_max_entries=args.cleaning_cache_max_entries,
+                csv_engine=args.ltsa_csv_engine,
+                csv_read_threads=args.ltsa_csv_read_threads,
+                titleowner_chunk_size=args.ltsa_titleowner_chunk_size,
             )
 
-            parser_elapsed_time = time.time() - parser_start_time
-            print(
-                f"------\nSTEP 2 COMPLETED: PARSED LTSA FILES. Elapsed Time: {parser_elapsed_time:.2f} seconds"
-            )
-
-            # Step 3: Write the above processed data to the PostgreSQL database
+            if args.db_delta_snapshot_path or args.raw_storage == "history":
+                previous_job_id = get_last_successful_job_id(engine)
 
-            writer_start_time = time.time()
-            print("------\nSTEP 3: WRITING PARSED FILES TO DATABASE\n------")
-
-            postgres_writer.run(
+            write = functools.partial(
+                postgres_writer.run,
                 input_directory=args.processed_data_path,
                 etl_job_id=job_id,
                 database_name=args.db_name,
@@ -339,12 +632,63 @@ def main():
                 port=args.db_port,
                 user=args.db_username,
                 password=args.db_password,
+                load_method=args.db_load_method,
+                workers=args.db_write_workers,
+                read_chunk_size=args.db_read_chunk_size,
+                conflict_key=args.db_conflict_key,
+                snapshot_directory=args.db_delta_snapshot_path,
+                previous_etl_job_id=previous_job_id,
+                raw_storage=args.raw_storage,
+                atomic=args.db_atomic_load,
+                batch_retries=args.db_batch_retries,
+                target_batch_seconds=args.db_target_batch_seconds,
+                target_batch_bytes=args.db_target_batch_bytes,
+                rebuild_indexes_after_load=args.db_rebuild_indexes,
+                unlogged_load=args.db_unlogged_load,
+                active_pin_load=args.db_active_pin_load,
+                shadow_swap=args.db_active_pin_shadow_swap,
+                input_format=args.processed_data_format,
             )
 
-            writer_elapsed_time = time.time() - writer_start_time
-            print(
-                f"------\nSTEP 3 COMPLETED: WROTE PARSED FILES TO DATABASE. Elapsed Time: {writer_elapsed_time:.2f} seconds"
-            )
+            if args.parse_write_concurrently:
+                # Steps 2 and 3: Parse the downloaded SFTP files and write each table to the database as it is parsed
+
+                parser_start_time = time.time()
+                print(
+                    "------\nSTEPS 2 AND 3: PARSING LTSA FILES AND WRITING THEM TO DATABASE\n------"
+                )
+
+                parse_and_write_concurrently(parse, write, args.parse_queue_size)
+
+                parser_elapsed_time = time.time() - parser_start_time
+                print(
+                    f"------\nSTEPS 2 AND 3 COMPLETED: PARSED LTSA FILES AND WROTE THEM TO DATABASE. Elapsed Time: {parser_elapsed_time:.2f} seconds"
+                )
+
+            else:
+                # Step 2: Process the downloaded SFTP files and write to the output folder
+
+                parser_start_time = time.time()
+                print("------\nSTEP 2: PARSING LTSA FILES\n------")
+
+                parsed_dataframes = parse()
+
+                parser_elapsed_time = time.time() - parser_start_time
+                print(
+                    f"------\nSTEP 2 COMPLETED: PARSED LTSA FILES. Elapsed Time: {parser_elapsed_time:.2f} seconds"
+                )
+
+                # Step 3: Write the above processed data to the PostgreSQL database
+
+                writer_start_time = time.time()
+                print("------\nSTEP 3: WRITING PARSED FILES TO DATABASE\n------")
+
+                write(dataframes=parsed_dataframes if in_process else None)
+
+                writer_elapsed_time = time.time() - writer_start_time
+                print(
+                    f"------\nSTEP 3 COMPLETED: WROTE PARSED FILES TO DATABASE. Elapsed Time: {writer_elapsed_time:.2f} seconds"
+                )
 
             # Step 4: Expire PINs of cancelled titles
 
@@ -367,6 +711,28 @@ def main():
                 f"------\nSTEP 4 COMPLETED: EXPIRED PINS. Elapsed Time: {expier_elapsed_time:.2f} seconds"
             )
 
+            # Step 5: Remove raw table snapshots older than the retention period
+
+            if args.raw_retention_weeks:
+                retention_start_time = time.time()
+                print("------\nSTEP 5: APPLYING RAW TABLE RETENTION\n------")
+
+                postgres_writer.apply_partition_retention(
+                    [
+                        table_name
+                        for table_name in raw_tables_and_log_id_column
+                        if postgres_writer.is_partitioned_table(table_name, engine)
+                    ],
+                    engine,
+                    args.raw_retention_weeks,
+                    detach_only=args.raw_retention_detach_only,
+                )
+
+                retention_elapsed_time = time.time() - retention_start_time
+                print(
+                    f"------\nSTEP 5 COMPLETED: APPLIED RAW TABLE RETENTION. Elapsed Time: {retention_elapsed_time:.2f} seconds"
+                )
+
             update_status_in_etl_log_table(engine, job_id, "Success")
 
             logger.info("------\nETL JOB COMPLETED SUCCESSFULLY\n------")
@@ -397,15 +763,21 @@ def main():
 
         try:
             if "job_id" in locals():
-                raw_tables_and_log_id_column = {
-                    "title_raw": "etl_log_id",
-                    "parcel_raw": "etl_log_id",
-                    "titleparcel_raw": "etl_log_id",
-                    "titleowner_raw": "etl_log_id",
-                }
                 update_status_in_etl_log_table(engine, job_id, "Failure")
                 delete_rows_with_job_id(engine, raw_tables_and_log_id_column, job_id)
 
+                # Each history table is rolled back on its own, so one that fails does not skip the others
+                if args.raw_storage == "history":
+                    for table_name in raw_tables_and_log_id_column:
+                        try:
+                            postgres_writer.rollback_history_table(
+                                table_name, engine, job_id, previous_job_id
+                            )
+                        except Exception as rollback_error:
+                            logger.error(
+                                f"Could not roll back {table_name}_history: {str(rollback_error)}"
+                            )
+
             else:
                 insert_status_into_etl_log_table(engine, "Failure")
 
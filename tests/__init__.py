@@ -1,4 +1,3 @@
-from utils.ltsa_parser import pid_parser
 from utils.ltsa_parser import parse_ltsa_files
 from utils.ltsa_parser import clean_active_pin_df
 from utils.ltsa_parser import run
@@ -7,4 +6,3 @@ from utils.ltsa_parser import load_data_cleaning_rules
 from utils.postgres_writer import write_dataframe_to_postgres
 from utils.postgres_writer import run
 from utils.postgres_writer import insert_postgres_table_if_rows_not_exist
-from utils.postgres_writer import get_row_count
@@ -6,7 +6,9 @@ from etl import (
     get_status_from_etl_log_table,
     insert_status_into_etl_log_table,
     update_status_in_etl_log_table,
+    get_last_successful_job_id,
     delete_rows_with_job_id,
+    parse_and_write_concurrently,
     main,
 )
 from sqlalchemy import create_engine
@@ -69,11 +71,70 @@ def test_update_status_in_etl_log_table_with_folder(connect_mock):
 
 
 @patch("sqlalchemy.engine.Engine.connect")
-def test_delete_rows_with_job_id(connect_mock):
+def test_get_last_successful_job_id(connect_mock):
+    get_last_successful_job_id(db)
+    assert connect_mock.called_once()
+
+
+@patch("utils.postgres_writer.is_partitioned_table", return_value=False)
+@patch("sqlalchemy.engine.Engine.connect")
+def test_delete_rows_with_job_id(connect_mock, partitioned_mock):
     delete_rows_with_job_id(db, tableColumn, 123)
     assert connect_mock.called_once()
 
 
+@patch("utils.postgres_writer.is_partitioned_table", return_value=True)
+@patch("utils.postgres_writer.drop_job_partition")
+@patch("sqlalchemy.engine.Engine.connect")
+def test_delete_rows_with_job_id_partitioned(connect_mock, drop_mock, partitioned_mock):
+    delete_rows_with_job_id(db, tableColumn, 123)
+    drop_mock.assert_called_once_with("table", db, 123)
+    assert not connect_mock.called
+
+
+def parse_tables(table_queue, fail=False):
+    table_queue.put(("parcel_raw", "parcel_df"))
+    if fail:
+        raise ValueError
+    table_queue.put(("active_pin", "active_pin_df"))
+
+
+def test_parse_and_write_concurrently():
+    written = []
+    parse_and_write_concurrently(
+        parse_tables, lambda dataframes: written.extend(dataframes), queue_size=1
+    )
+    assert written == [("parcel_raw", "parcel_df"), ("active_pin", "active_pin_df")]
+
+
+def test_parse_and_write_concurrently_parser_error():
+    written = []
+    with pytest.raises(ValueError):
+        parse_and_write_concurrently(
+            lambda table_queue: parse_tables(table_queue, fail=True),
+            lambda dataframes: written.extend(dataframes),
+        )
+    assert written == [("parcel_raw", "parcel_df")]
+
+
+def test_parse_and_write_concurrently_writer_error():
+    parsed = []
+
+    def parse(table_queue):
+        for table_number in range(10):
+            table_queue.put((f"table_{table_number}", "df"))
+            parsed.append(table_number)
+
+    def write(dataframes):
+        next(dataframes)
+        raise ConnectionError
+
+    # The parser stops once the writer fails instead of parsing every table
+    with pytest.raises(ConnectionError):
+        parse_and_write_concurrently(parse, write, queue_size=1)
+    assert len(parsed) < 10
+
+
 @patch(
     "argparse.ArgumentParser.parse_args",
     return_value=argparse.Namespace(
@@ -92,6 +153,33 @@ def test_delete_rows_with_job_id(connect_mock):
         processed_data_path="processed_data_path",
         data_rules_url="data_rules_url",
         db_write_batch_size=100,
+        db_target_batch_seconds=None,
+        db_target_batch_bytes=None,
+        db_rebuild_indexes=False,
+        db_unlogged_load=False,
+        db_active_pin_load="append",
+        db_active_pin_shadow_swap=False,
+        in_process_pipeline=False,
+        write_processed_files=False,
+        parse_write_concurrently=False,
+        parse_queue_size=2,
+        profile_cleaning_rules=False,
+        cleaning_cache_path=None,
+        cleaning_cache_max_entries=1000000,
+        ltsa_csv_engine="c",
+        ltsa_csv_read_threads=None,
+        ltsa_titleowner_chunk_size=None,
+        processed_data_format="csv",
+        db_load_method="insert",
+        db_write_workers=1,
+        db_atomic_load=False,
+        db_batch_retries=0,
+        db_read_chunk_size=None,
+        db_conflict_key="columns",
+        db_delta_snapshot_path=None,
+        raw_storage="snapshot",
+        raw_retention_weeks=None,
+        raw_retention_detach_only=False,
         expire_api_url="expire_api_url",
         vhers_api_key="vhers_api_key",
         api_key="api_key",
@@ -135,6 +223,33 @@ def test_main_run_status_success(
         processed_data_path="processed_data_path",
         data_rules_url="data_rules_url",
         db_write_batch_size=100,
+        db_target_batch_seconds=None,
+        db_target_batch_bytes=None,
+        db_rebuild_indexes=False,
+        db_unlogged_load=False,
+        db_active_pin_load="append",
+        db_active_pin_shadow_swap=False,
+        in_process_pipeline=False,
+        write_processed_files=False,
+        parse_write_concurrently=False,
+        parse_queue_size=2,
+        profile_cleaning_rules=False,
+        cleaning_cache_path=None,
+        cleaning_cache_max_entries=1000000,
+        ltsa_csv_engine="c",
+        ltsa_csv_read_threads=None,
+        ltsa_titleowner_chunk_size=None,
+        processed_data_format="csv",
+        db_load_method="insert",
+        db_write_workers=1,
+        db_atomic_load=False,
+        db_batch_retries=0,
+        db_read_chunk_size=None,
+        db_conflict_key="columns",
+        db_delta_snapshot_path=None,
+        raw_storage="snapshot",
+        raw_retention_weeks=None,
+        raw_retention_detach_only=False,
         expire_api_url="expire_api_url",
         vhers_api_key="vhers_api_key",
         api_key="api_key",
@@ -173,3 +288,267 @@ def test_main_run_status_none(
     assert ltsaParser_mock.called_once()
     assert postgresWriter_mock.called_once()
     assert pinExpirer_mock.called_once()
+
+
+@patch(
+    "argparse.ArgumentParser.parse_args",
+    return_value=argparse.Namespace(
+        log_folder="log_folder",
+        db_username="username",
+        db_password="password",
+        db_host="host",
+        db_port=1234,
+        db_name="name",
+        sftp_host="sftp_host",
+        sftp_port=1235,
+        sftp_username="sftp_username",
+        sftp_password="sftp_password",
+        sftp_remote_path="sftp_remote_path",
+        sftp_local_path="sftp_local_path",
+        processed_data_path="processed_data_path",
+        data_rules_url="data_rules_url",
+        db_write_batch_size=100,
+        db_target_batch_seconds=None,
+        db_target_batch_bytes=None,
+        db_rebuild_indexes=False,
+        db_unlogged_load=False,
+        db_active_pin_load="append",
+        db_active_pin_shadow_swap=False,
+        in_process_pipeline=False,
+        write_processed_files=False,
+        parse_write_concurrently=False,
+        parse_queue_size=2,
+        profile_cleaning_rules=False,
+        cleaning_cache_path=None,
+        cleaning_cache_max_entries=1000000,
+        ltsa_csv_engine="c",
+        ltsa_csv_read_threads=None,
+        ltsa_titleowner_chunk_size=None,
+        processed_data_format="csv",
+        db_load_method="insert",
+        db_write_workers=1,
+        db_atomic_load=False,
+        db_batch_retries=0,
+        db_read_chunk_size=None,
+        db_conflict_key="columns",
+        db_delta_snapshot_path="snapshot_path",
+        raw_storage="snapshot",
+        raw_retention_weeks=4,
+        raw_retention_detach_only=False,
+        expire_api_url="expire_api_url",
+        vhers_api_key="vhers_api_key",
+        api_key="api_key",
+        base_url="base_url",
+        email_address="emailAddress",
+        template_id="templateId",
+    ),
+)
+@patch("utils.sftp_downloader.run")
+def test_main_retention_with_delta_snapshot(sftpDownloader_mock, parser_mock):
+    with pytest.raises(SystemExit):
+        main()
+    sftpDownloader_mock.assert_not_called()
+
+
+@patch(
+    "argparse.ArgumentParser.parse_args",
+    return_value=argparse.Namespace(
+        log_folder="log_folder",
+        db_username="username",
+        db_password="password",
+        db_host="host",
+        db_port=1234,
+        db_name="name",
+        sftp_host="sftp_host",
+        sftp_port=1235,
+        sftp_username="sftp_username",
+        sftp_password="sftp_password",
+        sftp_remote_path="sftp_remote_path",
+        sftp_local_path="sftp_local_path",
+        processed_data_path="processed_data_path",
+        data_rules_url="data_rules_url",
+        db_write_batch_size=100,
+        db_target_batch_seconds=None,
+        db_target_batch_bytes=None,
+        db_rebuild_indexes=False,
+        db_unlogged_load=False,
+        db_active_pin_load="append",
+        db_active_pin_shadow_swap=False,
+        in_process_pipeline=False,
+        write_processed_files=False,
+        parse_write_concurrently=False,
+        parse_queue_size=2,
+        profile_cleaning_rules=False,
+        cleaning_cache_path=None,
+        cleaning_cache_max_entries=1000000,
+        ltsa_csv_engine="c",
+        ltsa_csv_read_threads=None,
+        ltsa_titleowner_chunk_size=None,
+        processed_data_format="csv",
+        db_load_method="insert",
+        db_write_workers=1,
+        db_atomic_load=False,
+        db_batch_retries=0,
+        db_read_chunk_size=None,
+        db_conflict_key="columns",
+        db_delta_snapshot_path=None,
+        raw_storage="history",
+        raw_retention_weeks=None,
+        raw_retention_detach_only=False,
+        expire_api_url="expire_api_url",
+        vhers_api_key="vhers_api_key",
+        api_key="api_key",
+        base_url="base_url",
+        email_address="emailAddress",
+        template_id="templateId",
+    ),
+)
+@patch("sqlalchemy.engine.Engine.connect")
+@patch("utils.logging_config.setup_logging")
+@patch("utils.sftp_downloader.run")
+@patch("etl.get_status_from_etl_log_table", return_value=None)
+@patch("utils.ltsa_parser.run", side_effect=ValueError("parse failed"))
+@patch("etl.delete_rows_with_job_id")
+@patch("etl.send_email_notification")
+@patch("utils.postgres_writer.rollback_history_table")
+def test_main_failure_rolls_back_every_history_table(
+    rollback_mock,
+    email_mock,
+    delete_mock,
+    ltsaParser_mock,
+    getStatus_mock,
+    sftpDownloader_mock,
+    loggingSetup_mock,
+    connect_mock,
+    parser_mock,
+):
+    # The first history table does not exist yet, the others are still rolled back
+    rollback_mock.side_effect = [ValueError("no title_raw_history"), None, None, None]
+    main()
+    assert [call.args[0] for call in rollback_mock.call_args_list] == [
+        "title_raw",
+        "parcel_raw",
+        "titleparcel_raw",
+        "titleowner_raw",
+    ]
+    assert email_mock.call_args.args[7] == "Failure"
+
+
+@patch(
+    "argparse.ArgumentParser.parse_args",
+    return_value=argparse.Namespace(
+        log_folder="log_folder",
+        db_username="username",
+        db_password="password",
+        db_host="host",
+        db_port=1234,
+        db_name="name",
+        sftp_host="sftp_host",
+        sftp_port=1235,
+        sftp_username="sftp_username",
+        sftp_password="sftp_password",
+        sftp_remote_path="sftp_remote_path",
+        sftp_local_path="sftp_local_path",
+        processed_data_path="processed_data_path",
+        data_rules_url="data_rules_url",
+        db_write_batch_size=100,
+        db_target_batch_seconds=None,
+        db_target_batch_bytes=None,
+        db_rebuild_indexes=False,
+        db_unlogged_load=False,
+        db_active_pin_load="append",
+        db_active_pin_shadow_swap=False,
+        in_process_pipeline=False,
+        write_processed_files=False,
+        parse_write_concurrently=False,
+        parse_queue_size=2,
+        profile_cleaning_rules=False,
+        cleaning_cache_path=None,
+        cleaning_cache_max_entries=1000000,
+        ltsa_csv_engine="c",
+        ltsa_csv_read_threads=None,
+        ltsa_titleowner_chunk_size=None,
+        processed_data_format="csv",
+        db_load_method="insert",
+        db_write_workers=4,
+        db_atomic_load=False,
+        db_batch_retries=2,
+        db_read_chunk_size=None,
+        db_conflict_key="columns",
+        db_delta_snapshot_path=None,
+        raw_storage="snapshot",
+        raw_retention_weeks=None,
+        raw_retention_detach_only=False,
+        expire_api_url="expire_api_url",
+        vhers_api_key="vhers_api_key",
+        api_key="api_key",
+        base_url="base_url",
+        email_address="emailAddress",
+        template_id="templateId",
+    ),
+)
+@patch("utils.sftp_downloader.run")
+def test_main_parallel_load_with_batch_retries(sftpDownloader_mock, parser_mock):
+    with pytest.raises(SystemExit):
+        main()
+    sftpDownloader_mock.assert_not_called()
+
+
+@patch(
+    "argparse.ArgumentParser.parse_args",
+    return_value=argparse.Namespace(
+        log_folder="log_folder",
+        db_username="username",
+        db_password="password",
+        db_host="host",
+        db_port=1234,
+        db_name="name",
+        sftp_host="sftp_host",
+        sftp_port=1235,
+        sftp_username="sftp_username",
+        sftp_password="sftp_password",
+        sftp_remote_path="sftp_remote_path",
+        sftp_local_path="sftp_local_path",
+        processed_data_path="processed_data_path",
+        data_rules_url="data_rules_url",
+        db_write_batch_size=100,
+        db_target_batch_seconds=None,
+        db_target_batch_bytes=None,
+        db_rebuild_indexes=False,
+        db_unlogged_load=False,
+        db_active_pin_load="append",
+        db_active_pin_shadow_swap=False,
+        in_process_pipeline=False,
+        write_processed_files=False,
+        parse_write_concurrently=False,
+        parse_queue_size=2,
+        profile_cleaning_rules=False,
+        cleaning_cache_path=None,
+        cleaning_cache_max_entries=1000000,
+        ltsa_csv_engine="c",
+        ltsa_csv_read_threads=None,
+        ltsa_titleowner_chunk_size=None,
+        processed_data_format="csv",
+        db_load_method="insert",
+        db_write_workers=1,
+        db_atomic_load=False,
+        db_batch_retries=0,
+        db_read_chunk_size=None,
+        db_conflict_key="columns",
+        db_delta_snapshot_path="snapshot_path",
+        raw_storage="history",
+        raw_retention_weeks=None,
+        raw_retention_detach_only=False,
+        expire_api_url="expire_api_url",
+        vhers_api_key="vhers_api_key",
+        api_key="api_key",
+        base_url="base_url",
+        email_address="emailAddress",
+        template_id="templateId",
+    ),
+)
+@patch("utils.sftp_downloader.run")
+def test_main_history_with_delta_snapshot(sftpDownloader_mock, parser_mock):
+    with pytest.raises(SystemExit):
+        main()
+    sftpDownloader_mock.assert_not_called()
@@ -1,23 +1,38 @@
 import csv
+import json
 import os
+import queue
+from concurrent.futures import Future
 from unittest.mock import patch
+import numpy as np
 import pandas as pd
 import pytest
 from sqlalchemy import create_engine
 from utils.ltsa_parser import (
-    pid_parser,
     parse_ltsa_files,
+    write_processed_file,
     run,
     load_data_cleaning_rules,
+    clean_active_pin_df,
+    compile_replace_exact_values,
+    compile_remove_characters,
+    compile_cleaning_plan,
+    apply_cleaning_plan,
+    apply_operations,
+    map_distinct_values,
+    load_cleaning_cache,
+    save_cleaning_cache,
+    normalize_ltsa_columns,
+    read_ltsa_file,
+    group_pids,
+    read_ltsa_file_chunks,
+    load_ltsa_file,
+    parse_pids,
+    isin_sorted_pids,
+    filter_valid_pids,
+    format_raw_pids,
 )
 
-pid_list_multiple_pids = ["123", "234", "345"]
-pid_list_multiple_pids_parsed = "000000123|000000234|000000345"
-pid_list_one_pid = ["123"]
-pid_list_one_pid_parsed = "000000123"
-pid_list_no_pid = []
-pid_list_no_pid_parsed = ""
-
 input_directory = ""
 output_directory = ""
 data_rules_url = (
@@ -168,12 +183,6 @@ def remove_csvs(listOfFiles):
         os.remove(file)
 
 
-def test_pid_parser():
-    assert pid_parser(pid_list_multiple_pids) == pid_list_multiple_pids_parsed
-    assert pid_parser(pid_list_one_pid) == pid_list_one_pid_parsed
-    assert pid_parser(pid_list_no_pid) == pid_list_no_pid_parsed
-
-
 @patch("pandas.read_sql_table", return_value=valid_pid_df)
 def test_parse_ltsa_files(read_sql_table_mock):
     create_csvs()
@@ -194,6 +203,296 @@ def test_parse_ltsa_files(read_sql_table_mock):
     )
 
 
+def test_normalize_ltsa_columns():
+    dataframe = pd.DataFrame(
+        {
+            "CLIENT_GVN_NM": [" O'NEIL ", "", None, "\tJOHN"],
+            "ADDRS_CITY": ["   ", "VICTORIA ", float("nan"), "D'ARCY"],
+        }
+    )
+    normalized_df = normalize_ltsa_columns(dataframe, "4_titleowner.csv", {"'": "`"})
+    assert normalized_df["CLIENT_GVN_NM"].tolist() == ["O`NEIL", None, None, "JOHN"]
+    assert normalized_df["ADDRS_CITY"].tolist() == [None, "VICTORIA", None, "D`ARCY"]
+
+
+def test_group_pids():
+    dataframe = pd.DataFrame(
+        {
+            "title_number": ["CA2", "CA1", "CA2", "CA2", "CA2"],
+            "land_title_district": ["VA", "VA", "VA", "KA", "VA"],
+            "pid": np.array([12, 3, 12, 4, 5], dtype=np.uint32),
+        }
+    )
+    grouped_df = group_pids(dataframe, ["title_number", "land_title_district"])
+    assert grouped_df.values.tolist() == [
+        ["CA1", "VA", "000000003"],
+        ["CA2", "KA", "000000004"],
+        ["CA2", "VA", "000000005|000000012"],
+    ]
+
+
+def test_parse_pids():
+    pids, is_parsed = parse_pids(
+        pd.Series(["12", "0034", None, "x", "5000000000", "1.5", "999999999"])
+    )
+    assert is_parsed.tolist() == [True, True, False, False, False, False, True]
+    assert pids[is_parsed].tolist() == [12, 34, 999999999]
+    assert pids.dtype == np.uint32
+
+
+def test_filter_valid_pids():
+    valid_pids = np.array([3, 12, 40], dtype=np.uint32)
+    assert isin_sorted_pids(np.array([1, 3, 41, 40]), valid_pids).tolist() == [
+        False,
+        True,
+        False,
+        True,
+    ]
+    assert not isin_sorted_pids(np.array([1]), valid_pids[:0]).any()
+
+    parcel_df = pd.DataFrame({"pid": ["12", "13", "x", "40"], "parcel_status": "A"})
+    filtered_df = filter_valid_pids(parcel_df, valid_pids)
+    assert filtered_df["pid"].tolist() == [12, 40]
+    assert filtered_df.index.tolist() == [0, 3]
+    assert format_raw_pids(filtered_df)["pid"].tolist() == ["12", "40"]
+
+
+@pytest.mark.parametrize("csv_engine", ["c", "pyarrow"])
+def test_read_ltsa_file(tmp_path, csv_engine):
+    file_path = str(tmp_path / "2_parcel.csv")
+    with open(file_path, "w") as parcel_file:
+        parcel_file.write(
+            "PRMNNT_PRCL_ID,PRCL_STTS_CD,EXTRA\n 012 ,A,x\n,NA,x\n345,  ,x\n"
+        )
+
+    dataframe = read_ltsa_file(
+        file_path,
+        usecols=["PRMNNT_PRCL_ID", "PRCL_STTS_CD"],
+        dtype={"PRMNNT_PRCL_ID": str, "PRCL_STTS_CD": str},
+        csv_engine=csv_engine,
+    )
+    assert list(dataframe.columns) == ["PRMNNT_PRCL_ID", "PRCL_STTS_CD"]
+    normalized_df = normalize_ltsa_columns(dataframe, "2_parcel.csv")
+    assert normalized_df["PRMNNT_PRCL_ID"].tolist()[::2] == ["012", "345"]
+    assert normalized_df["PRMNNT_PRCL_ID"].isna().tolist() == [False, True, False]
+    assert normalized_df["PRCL_STTS_CD"].isna().tolist() == [False, True, True]
+
+    with pytest.raises(ValueError):
+        read_ltsa_file(file_path, ["PRMNNT_PRCL_ID"], {}, csv_engine="python")
+
+
+@pytest.mark.parametrize("csv_engine", ["c", "pyarrow"])
+def test_load_ltsa_file_in_chunks(tmp_path, csv_engine):
+    file_path = str(tmp_path / "4_titleowner.csv")
+    with open(file_path, "w") as titleowner_file:
+        titleowner_file.write("TITLE_NMBR,LTB_DISTRICT_CD,CLIENT_GVN_NM\n")
+        for row in range(10):
+            titleowner_file.write(f"CA{row % 4}, VA ,O'NEIL{row}\n")
+
+    usecols = ["TITLE_NMBR", "LTB_DISTRICT_CD", "CLIENT_GVN_NM"]
+    dtype = {column: str for column in usecols}
+    chunks = list(read_ltsa_file_chunks(file_path, usecols, dtype, 4, csv_engine))
+    assert pd.concat(chunks).equals(
+        read_ltsa_file(file_path, usecols, dtype, csv_engine)
+    )
+
+    keys_future = Future()
+    keys_future.set_result(pd.MultiIndex.from_tuples([("CA1", "VA"), ("CA3", "VA")]))
+    streamed_df = load_ltsa_file(
+        file_path,
+        usecols,
+        dtype,
+        required_columns=usecols,
+        csv_engine=csv_engine,
+        replacements={"'": "`"},
+        chunk_size=4,
+        key_columns=["TITLE_NMBR", "LTB_DISTRICT_CD"],
+        keys_future=keys_future,
+    )
+    assert streamed_df.index.tolist() == [1, 3, 5, 7, 9]
+    assert streamed_df["CLIENT_GVN_NM"].tolist()[:2] == ["O`NEIL1", "O`NEIL3"]
+
+
+def test_write_processed_file(tmp_path):
+    processed_df = pd.DataFrame({"pids": ["000000012"], "title_status": [None]})
+    file_path = write_processed_file(
+        processed_df, str(tmp_path) + "/", "active_pin", "parquet"
+    )
+    assert file_path.endswith("active_pin.parquet")
+    assert pd.read_parquet(file_path).equals(processed_df)
+    with pytest.raises(ValueError):
+        write_processed_file(processed_df, str(tmp_path) + "/", "active_pin", "xml")
+
+
+with open("data_rules.json") as data_rules_file:
+    data_rules = json.load(data_rules_file)
+
+
+def test_compile_replace_exact_values():
+    value_map = compile_replace_exact_values(
+        {"VICTORIA": ["VICTOIRA", "VIC"], "GREATER VICTORIA": ["VICTORIA"]}
+    )
+    assert value_map == {
+        "VICTOIRA": "GREATER VICTORIA",
+        "VIC": "GREATER VICTORIA",
+        "VICTORIA": "GREATER VICTORIA",
+    }
+
+
+def test_compile_remove_characters():
+    operations = compile_remove_characters([",", "BC", "'"])
+    assert len(operations) == 4
+    assert apply_operations("B,C0001", operations) == "0001"
+    assert apply_operations("B'C0001", operations) == "BC0001"
+    assert apply_operations(" , ", operations) == " "
+    assert apply_operations(None, operations) is None
+
+
+def test_apply_cleaning_plan():
+    cleaning_plan = compile_cleaning_plan(data_rules)
+    city_step = next(step for step in cleaning_plan if step["column"] == "city")
+    assert city_step["rules"] == [
+        "replace_exact_values",
+        "trim_after_comma",
+        "remove_characters",
+        "to_uppercase",
+    ]
+    assert [
+        step["rules"] for step in cleaning_plan if step["column"] == "occupation"
+    ] == [
+        ["remove_characters"],
+        ["switch_column_value"],
+    ]
+
+    city_plan = [city_step]
+    dataframe = pd.DataFrame({"city": ["Victoria, BC", "Vic.", None]})
+    timings = apply_cleaning_plan(dataframe, city_plan)
+    assert list(timings) == [
+        ("city", "replace_exact_values+trim_after_comma+remove_characters+to_uppercase")
+    ]
+
+    profiled_dataframe = pd.DataFrame({"city": ["Victoria, BC", "Vic.", None]})
+    timings = apply_cleaning_plan(profiled_dataframe, city_plan, profile=True)
+    assert list(timings) == [("city", rule) for rule in city_step["rules"]]
+    assert profiled_dataframe.equals(dataframe)
+    assert dataframe["city"].tolist() == ["VICTORIA", "VIC", None]
+
+
+def test_map_distinct_values():
+    cleaned_values = []
+
+    def clean(value):
+        cleaned_values.append(value)
+        return value.upper()
+
+    series = pd.Series(["bc", None, "ab", "bc", "bc"], index=[5, 6, 7, 8, 9])
+    mapped_series = map_distinct_values(series, clean)
+    assert cleaned_values == ["bc", "ab"]
+    assert mapped_series.tolist() == ["BC", None, "AB", "BC", "BC"]
+    assert mapped_series.index.tolist() == [5, 6, 7, 8, 9]
+
+
+def test_cleaning_cache(tmp_path):
+    cache_directory = str(tmp_path)
+    open(os.path.join(cache_directory, "city_oldrules.arrow"), "w").close()
+
+    cache = load_cleaning_cache(cache_directory, "city", "newrules")
+    assert len(cache["raw"]) == 0
+    map_distinct_values(pd.Series(["a", "b", "c", None]), str.upper, cache)
+    cache["last_used"][:] = [3, 1, 2]
+    save_cleaning_cache(cache, cache_directory, "city", "newrules", max_entries=2)
+    assert os.listdir(cache_directory) == ["city_newrules.arrow"]
+
+    cache = load_cleaning_cache(cache_directory, "city", "newrules")
+    assert cache["raw"].tolist() == ["a", "c"]
+    assert cache["cleaned"].tolist() == ["A", "C"]
+
+    cleaned_values = []
+
+    def clean(value):
+        cleaned_values.append(value)
+        return value.upper()
+
+    mapped_series = map_distinct_values(pd.Series(["c", "d", "a", "c"]), clean, cache)
+    assert cleaned_values == ["d"]
+    assert mapped_series.tolist() == ["C", "D", "A", "C"]
+    assert cache["raw"].tolist() == ["a", "c", "d"]
+    assert load_cleaning_cache(cache_directory, "country", "newrules")["raw"].empty
+
+
+switch_column_rules = {
+    "column_rules": {
+        column: data_rules["column_rules"][column]
+        for column in ["occupation", "incorporation_number", "province_long"]
+    }
+}
+
+
+@patch("utils.ltsa_parser.load_data_cleaning_rules", return_value=switch_column_rules)
+def test_clean_active_pin_df_switch_column_value(rules_mock):
+    active_pin_df = pd.DataFrame(
+        {
+            "occupation": ["123456", "RETIRED", None, "", "12A"],
+            "incorporation_number": [None, None, "BC0000001", None, None],
+            "province_long": ["British Columbia", "ON", "Ontairo", "Alberta", None],
+            "province_abbreviation": [None, None, None, "AB", "WA"],
+            "parcel_status": ["A"] * 5,
+        }
+    )
+    cleaned_df = clean_active_pin_df(
+        active_pin_df, output_directory, data_rules_url, write_files=False
+    )
+    assert cleaned_df["incorporation_number"].tolist() == [
+        "123456",
+        None,
+        "0000001",
+        None,
+        None,
+    ]
+    assert cleaned_df["province_long"].tolist() == ["BC", "ON", "ON", "AB", None]
+    assert cleaned_df["province_abbreviation"].tolist() == [
+        "BC",
+        "ON",
+        "ON",
+        "AB",
+        "WA",
+    ]
+
+
+@patch("pandas.DataFrame.to_csv")
+@patch("utils.ltsa_parser.load_data_cleaning_rules", return_value=data_rules)
+@patch("pandas.read_sql_table", return_value=valid_pid_df)
+def test_parse_ltsa_files_without_csv(read_sql_table_mock, rules_mock, to_csv_mock):
+    create_csvs()
+    table_queue = queue.Queue()
+    dataframes = parse_ltsa_files(
+        input_directory,
+        output_directory,
+        data_rules_url,
+        db,
+        write_files=False,
+        table_queue=table_queue,
+    )
+    assert list(dataframes) == [
+        "title_raw",
+        "parcel_raw",
+        "titleparcel_raw",
+        "titleowner_raw",
+        "active_pin",
+    ]
+    assert "pids" in dataframes["active_pin"].columns
+    to_csv_mock.assert_not_called()
+    assert sorted(table_queue.get()[0] for _ in dataframes) == sorted(dataframes)
+    remove_csvs(
+        [
+            title_test_file,
+            parcel_test_file,
+            titleparcel_test_file,
+            titleowner_test_file,
+        ]
+    )
+
+
 @patch("utils.ltsa_parser.clean_active_pin_df", side_effect=ValueError)
 @patch("pandas.read_sql_table", return_value=valid_pid_df)
 def test_parse_ltsa_files_error(clean_mock, read_sql_table_mock):
@@ -216,6 +515,33 @@ def test_parse_ltsa_files_error(clean_mock, read_sql_table_mock):
     )
 
 
+@patch("pandas.read_sql_table", return_value=valid_pid_df)
+def test_parse_ltsa_files_read_error(read_sql_table_mock):
+    create_csvs()
+    os.remove(titleowner_test_file)
+    with pytest.raises(FileNotFoundError):
+        parse_ltsa_files(
+            input_directory, output_directory, data_rules_url, db, write_files=False
+        )
+    remove_csvs([title_test_file, parcel_test_file, titleparcel_test_file])
+
+
+@patch("pandas.read_sql_table", return_value=valid_pid_df)
+def test_parse_ltsa_files_streaming_read_error(read_sql_table_mock):
+    create_csvs()
+    os.remove(titleparcel_test_file)
+    with pytest.raises(FileNotFoundError):
+        parse_ltsa_files(
+            input_directory,
+            output_directory,
+            data_rules_url,
+            db,
+            write_files=False,
+            titleowner_chunk_size=1,
+        )
+    remove_csvs([title_test_file, parcel_test_file, titleowner_test_file])
+
+
 def test_load_data_cleaning_rules():
     dataCleaningRules = load_data_cleaning_rules(data_rules_url)
     assert type(dataCleaningRules) == dict
@@ -5,7 +5,26 @@ from utils.postgres_writer import (
     write_dataframe_to_postgres,
     run,
     insert_postgres_table_if_rows_not_exist,
-    get_row_count,
+    copy_postgres_table_if_rows_not_exist,
+    load_dataframe_in_parallel,
+    read_processed_file,
+    compute_row_hash,
+    filter_changed_rows,
+    read_snapshot_rows,
+    record_snapshot_delta,
+    is_partitioned_table,
+    get_job_partition_name,
+    drop_job_partition,
+    apply_partition_retention,
+    rebuild_indexes,
+    merge_dataframes_to_postgres,
+    write_dataframe_to_history,
+    rollback_history_table,
+    transaction,
+    get_adaptive_batch_size,
+    get_batch_size_for_target_bytes,
+    swap_shadow_table,
+    read_table_dataframes,
 )
 from sqlalchemy import create_engine
 import pytest
@@ -44,19 +63,46 @@ file_list = [
 db = create_engine("sqlite:///:memory:")
 
 
-@patch("utils.postgres_writer.insert_postgres_table_if_rows_not_exist")
-@patch("sqlalchemy.engine.Engine.connect")
-@patch("utils.postgres_writer.get_row_count", return_value=5)
-def test_write_dataframe_to_postgres(insert_mock, count_mock, connect_mock):
-    numberOfRowsInserted = write_dataframe_to_postgres(
+@patch("utils.postgres_writer.insert_postgres_table_if_rows_not_exist", return_value=1)
+def test_write_dataframe_to_postgres(insert_mock):
+    rowCounts = write_dataframe_to_postgres(
         dataframe, "tablename", db, "etlJobId", ["tablename"], 5
     )
     assert insert_mock.called_once()
-    assert count_mock.called_once()
-    assert connect_mock.called_once()
+    assert rowCounts == {
+        "Rows Inserted": 1,
+        "Rows Skipped": 0,
+        "Rows Failed": 0,
+        "Batch Size": 5,
+    }
+
+
+@patch("utils.postgres_writer.insert_postgres_table_if_rows_not_exist", return_value=2)
+def test_write_dataframe_to_postgres_skipped_rows(insert_mock):
+    rowCounts = write_dataframe_to_postgres(
+        pd.concat([dataframe] * 7), "tablename", db, "etlJobId", ["tablename"], 5
+    )
+    assert insert_mock.call_count == 2
+    assert rowCounts == {
+        "Rows Inserted": 4,
+        "Rows Skipped": 3,
+        "Rows Failed": 0,
+        "Batch Size": 5,
+    }
+
+
+@patch(
+    "utils.postgres_writer.insert_postgres_table_if_rows_not_exist",
+    side_effect=[5, sqlalchemy.exc.OperationalError("INSERT", {}, None)],
+)
+def test_write_dataframe_to_postgres_failed_rows(insert_mock, capsys):
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        write_dataframe_to_postgres(
+            pd.concat([dataframe] * 7), "tablename", db, "etlJobId", ["tablename"], 5
+        )
     assert (
-        numberOfRowsInserted == 0
-    )  # Number of rows before and after insert is the same
+        "Rows Inserted: 5, Rows Skipped: 0, Rows Failed: 2" in capsys.readouterr().out
+    )
 
 
 @patch(
@@ -89,13 +135,177 @@ def test_insert_postgres_table_if_rows_not_exist_error(insert_mock):
     assert insert_mock.called_once()
 
 
+@patch("utils.postgres_writer.copy_postgres_table_if_rows_not_exist", return_value=1)
+def test_write_dataframe_to_postgres_copy(copy_mock):
+    write_dataframe_to_postgres(
+        dataframe, "tablename", db, "etlJobId", ["tablename"], 5, load_method="copy"
+    )
+    assert copy_mock.call_count == 1
+
+
+@patch("utils.postgres_writer.insert_postgres_table_if_rows_not_exist", return_value=1)
+def test_write_dataframe_to_postgres_row_hash(insert_mock):
+    write_dataframe_to_postgres(
+        dataframe,
+        "tablename",
+        db,
+        "etlJobId",
+        ["tablename"],
+        5,
+        conflict_key="row_hash",
+    )
+    batch, _, _, unique_key_columns = insert_mock.call_args.args
+    assert unique_key_columns == ["row_hash"]
+    assert batch["row_hash"].tolist() == compute_row_hash(dataframe).tolist()
+
+
+def test_compute_row_hash():
+    rows = pd.DataFrame({"a": ["x", "x", "y"], "b": ["1", "1", "1"]})
+    row_hash = compute_row_hash(rows)
+    assert row_hash.str.fullmatch("[0-9a-f]{32}").all()
+    assert row_hash[0] == row_hash[1]
+    assert row_hash[0] != row_hash[2]
+    # Values are hashed as text, so the digest does not depend on dtypes
+    assert compute_row_hash(pd.DataFrame({"a": ["x"], "b": [1]}))[0] == row_hash[0]
+
+
+@patch(
+    "utils.postgres_writer.insert_postgres_table_if_rows_not_exist",
+    side_effect=[sqlalchemy.exc.OperationalError("INSERT", {}, None), 1],
+)
+def test_write_dataframe_to_postgres_batch_retries(insert_mock):
+    rowCounts = write_dataframe_to_postgres(
+        dataframe, "tablename", db, "etlJobId", ["tablename"], 5, batch_retries=1
+    )
+    assert insert_mock.call_count == 2
+    assert rowCounts == {
+        "Rows Inserted": 1,
+        "Rows Skipped": 0,
+        "Rows Failed": 0,
+        "Batch Size": 5,
+    }
+
+
+def test_get_adaptive_batch_size():
+    assert get_adaptive_batch_size(1000, 1.0, 1.0) == 1000
+    assert get_adaptive_batch_size(1000, 4.0, 1.0) == 500
+    assert get_adaptive_batch_size(1000, 0.0, 1.0) == 2000
+    assert get_adaptive_batch_size(150, 4.0, 1.0) == 100
+    assert get_adaptive_batch_size(90000, 0.1, 1.0) == 100000
+
+
+def test_get_batch_size_for_target_bytes():
+    narrow = get_batch_size_for_target_bytes(dataframe[["title_number"]], 100000)
+    wide = get_batch_size_for_target_bytes(dataframe, 100000)
+    assert narrow > wide >= 1
+
+
+@patch("utils.postgres_writer.get_adaptive_batch_size", side_effect=[4, 8, 16])
+@patch(
+    "utils.postgres_writer.insert_postgres_table_if_rows_not_exist",
+    side_effect=lambda batch, *args: len(batch),
+)
+def test_write_dataframe_to_postgres_adaptive_batch_size(
+    insert_mock, adaptive_mock, capsys
+):
+    rowCounts = write_dataframe_to_postgres(
+        pd.concat([dataframe] * 7),
+        "tablename",
+        db,
+        "etlJobId",
+        ["tablename"],
+        2,
+        target_batch_seconds=1.0,
+    )
+    assert [len(call.args[0]) for call in insert_mock.call_args_list] == [2, 4, 1]
+    assert rowCounts["Rows Inserted"] == 7
+    assert rowCounts["Batch Size"] == 16
+    assert "first 2, smallest 1, largest 4, last 1, over 3 batches" in (
+        capsys.readouterr().out
+    )
+
+
+def test_transaction():
+    with db.connect() as conn:
+        with conn.begin():
+            with transaction(conn) as savepoint_conn:
+                assert savepoint_conn is conn
+                assert conn.in_nested_transaction()
+    with transaction(db) as conn:
+        assert conn.in_transaction()
+
+
+def test_write_dataframe_to_postgres_unknown_load_method():
+    with pytest.raises(ValueError):
+        write_dataframe_to_postgres(
+            dataframe, "tablename", db, "etlJobId", ["tablename"], 5, "upsert"
+        )
+
+
+@patch("sqlalchemy.engine.Engine.connect")
+def test_copy_postgres_table_if_rows_not_exist(connect_mock):
+    copy_postgres_table_if_rows_not_exist(dataframe, "tablename", db, ["title_number"])
+    conn = connect_mock.return_value.__enter__.return_value
+    cursor = conn.connection.cursor.return_value
+    copy_sql, csv_buffer = cursor.copy_expert.call_args[0]
+    assert copy_sql.startswith("COPY tablename_staging (title_number,")
+    assert csv_buffer.getvalue().startswith('"AA123456E","AB","R","",')
+
+
+def test_copy_postgres_table_if_rows_not_exist_error():
+    # SQLite has no COPY support, so the staging table cannot be created
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        copy_postgres_table_if_rows_not_exist(
+            dataframe, "tablename", db, ["title_number"]
+        )
+
+
+@patch("utils.postgres_writer.load_dataframe_in_parallel", return_value=0)
+def test_write_dataframe_to_postgres_parallel(parallel_mock):
+    rowCounts = write_dataframe_to_postgres(
+        dataframe, "tablename", db, "etlJobId", ["tablename"], 5, workers=3
+    )
+    assert rowCounts["Rows Skipped"] == 1
+    assert parallel_mock.call_count == 1
+    assert parallel_mock.call_args.kwargs["workers"] == 3
+
+
+@patch("sqlalchemy.engine.Engine.connect")
+@patch("utils.postgres_writer.copy_shard_to_staging_table")
+def test_load_dataframe_in_parallel(shard_mock, connect_mock):
+    shards_dataframe = pd.concat([dataframe] * 5, ignore_index=True)
+    load_dataframe_in_parallel(
+        shards_dataframe, "tablename", db, ["title_number"], batch_size=1, workers=2
+    )
+    assert sorted(len(call.args[0]) for call in shard_mock.call_args_list) == [2, 3]
+
+
+@patch("sqlalchemy.engine.Engine.connect")
+@patch(
+    "utils.postgres_writer.copy_shard_to_staging_table",
+    side_effect=sqlalchemy.exc.OperationalError("COPY", {}, None),
+)
+def test_load_dataframe_in_parallel_error(shard_mock, connect_mock):
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        load_dataframe_in_parallel(
+            dataframe, "tablename", db, ["title_number"], workers=2
+        )
+    # Only the staging table is created and dropped, the target table is never written to
+    conn = connect_mock.return_value.__enter__.return_value
+    executed_sql = [str(call.args[0]) for call in conn.execute.call_args_list]
+    assert not any(sql.startswith("INSERT") for sql in executed_sql)
+    assert executed_sql[-1].startswith("DROP TABLE IF EXISTS tablename_staging_")
+
+
+@patch("utils.postgres_writer.is_partitioned_table", return_value=False)
 @patch("os.listdir", return_value=file_list)
 @patch("os.path.join")
 @patch("pandas.read_csv")
 @patch(
-    "utils.postgres_writer.write_dataframe_to_postgres"
+    "utils.postgres_writer.write_dataframe_to_postgres",
+    return_value={"Rows Inserted": 1, "Rows Skipped": 0, "Rows Failed": 0},
 )  # write_dataframe_to_postgres already tested
-def test_run(listdir_mock, pathjoin_mock, readcsv_mock, write_mock):
+def test_run(listdir_mock, pathjoin_mock, readcsv_mock, write_mock, partitioned_mock):
     run("", "etlJobId", "databaseName")
     assert listdir_mock.called_once()
     assert pathjoin_mock.called_once()
@@ -103,23 +313,582 @@ def test_run(listdir_mock, pathjoin_mock, readcsv_mock, write_mock):
     assert write_mock.called_once()
 
 
-@patch("utils.postgres_writer.run", side_effect=FileNotFoundError)
-def test_run_error(write_mock):
-    with pytest.raises(FileNotFoundError):
-        run("", "etlJobId", "databaseName")
-    assert write_mock.called_once()
+def test_read_processed_file_in_chunks(tmp_path):
+    file_path = tmp_path / "parcel_raw.csv"
+    pd.DataFrame({"pid": ["012", "34", "5"], "parcel_status": ["A", "", "C"]}).to_csv(
+        file_path, index=False
+    )
+    chunks = list(read_processed_file(str(file_path), read_chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert chunks[0]["pid"].tolist() == ["012", "34"]
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "arrow"])
+def test_read_processed_file_columnar(tmp_path, file_format):
+    file_path = str(tmp_path / f"active_pin.{file_format}")
+    processed_df = pd.DataFrame(
+        {"pids": ["000000012", "000000034", None], "title_status": ["R", "C", "R"]}
+    )
+    if file_format == "parquet":
+        processed_df.to_parquet(file_path, index=False)
+    else:
+        processed_df.to_feather(file_path)
+
+    (whole,) = read_processed_file(file_path)
+    assert whole["pids"].tolist() == ["000000012", "000000034", None]
+
+    chunks = list(read_processed_file(file_path, read_chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+
+
+@patch("utils.postgres_writer.is_partitioned_table", return_value=False)
+@patch("os.listdir", return_value=["parcel_raw.csv"])
+@patch("os.path.isfile", return_value=True)
+@patch(
+    "utils.postgres_writer.read_processed_file",
+    return_value=[dataframe, dataframe],
+)
+@patch(
+    "utils.postgres_writer.write_dataframe_to_postgres",
+    return_value={"Rows Inserted": 1, "Rows Skipped": 0, "Rows Failed": 0},
+)
+def test_run_in_chunks(
+    write_mock, read_mock, isfile_mock, listdir_mock, partitioned_mock, capsys
+):
+    run("", "etlJobId", "databaseName", read_chunk_size=1)
+    assert read_mock.call_args.args[1] == 1
+    assert write_mock.call_count == 2
+    assert "Table: parcel_raw, Rows Inserted: 2" in capsys.readouterr().out
+
+
+@patch("utils.postgres_writer.is_partitioned_table", return_value=False)
+@patch("os.listdir", return_value=["parcel_raw.csv"])
+@patch("os.path.isfile", return_value=True)
+@patch("utils.postgres_writer.read_processed_file", return_value=[dataframe])
+@patch(
+    "utils.postgres_writer.write_dataframe_to_postgres",
+    return_value={"Rows Inserted": 1, "Rows Skipped": 0, "Rows Failed": 0},
+)
+def test_run_row_hash(
+    write_mock, read_mock, isfile_mock, listdir_mock, partitioned_mock
+):
+    run("", "etlJobId", "databaseName", conflict_key="row_hash")
+    # Whole files are read as text so rows hash the same as in chunked reads
+    assert read_mock.call_args.args[2] is True
+    assert write_mock.call_args.kwargs["conflict_key"] == "row_hash"
+
+
+@patch("utils.postgres_writer.is_partitioned_table", return_value=False)
+@patch("os.listdir", return_value=["parcel_raw.csv"])
+@patch("os.path.isfile", return_value=True)
+@patch(
+    "utils.postgres_writer.read_processed_file",
+    return_value=[dataframe, dataframe],
+)
+@patch(
+    "utils.postgres_writer.write_dataframe_to_postgres",
+    return_value={
+        "Rows Inserted": 1,
+        "Rows Skipped": 0,
+        "Rows Failed": 0,
+        "Batch Size": 4000,
+    },
+)
+def test_run_in_chunks_adaptive_batch_size(
+    write_mock, read_mock, isfile_mock, listdir_mock, partitioned_mock
+):
+    run(
+        "",
+        "etlJobId",
+        "databaseName",
+        read_chunk_size=1,
+        target_batch_seconds=1.0,
+        target_batch_bytes=100000,
+    )
+    # The second chunk continues from the batch size the first adapted to
+    assert [call.kwargs["batch_size"] for call in write_mock.call_args_list] == [
+        1000,
+        4000,
+    ]
+    assert [
+        call.kwargs["target_batch_bytes"] for call in write_mock.call_args_list
+    ] == [100000, None]
+
+
+def test_filter_changed_rows():
+    rows = pd.DataFrame({"pid": ["1", "2", "3"], "parcel_status": ["A", "A", None]})
+    _, previous_snapshot = filter_changed_rows(rows[:2], None, ["pid"])
+    rows.loc[1, "parcel_status"] = "C"
+    changed_rows, snapshot = filter_changed_rows(
+        rows, previous_snapshot.set_index("row_hash"), ["pid"]
+    )
+    assert changed_rows["pid"].tolist() == ["2", "3"]
+    assert snapshot.columns.tolist() == ["pid", "row_hash"]
+    assert len(snapshot) == 3
+
+
+def test_filter_changed_rows_read_paths(tmp_path):
+    # Rows hash the same whether a file is read whole, in chunks or handed over in memory
+    rows = pd.DataFrame({"pid": ["012345678", "2"], "parcel_status": ["123", None]})
+    rows.to_csv(tmp_path / "parcel_raw.csv", index=False)
+    snapshots = [
+        pd.concat(
+            filter_changed_rows(df, None, ["pid"])[1]
+            for df in read_table_dataframes(table_source, read_chunk_size, as_text=True)
+        )["row_hash"].tolist()
+        for table_source in [str(tmp_path / "parcel_raw.csv"), rows]
+        for read_chunk_size in [None, 1]
+    ]
+    assert all(snapshot == snapshots[0] for snapshot in snapshots)
+
+
+@patch("utils.postgres_writer.insert_postgres_table_if_rows_not_exist", return_value=1)
+def test_write_dataframe_to_postgres_row_hash_read_paths(insert_mock, tmp_path):
+    # A number in a column with blanks hashes the same whether the file is read whole or in chunks
+    rows = pd.DataFrame({"pid": ["1", "2"], "parcel_status": ["123456", None]})
+    rows.to_csv(tmp_path / "parcel_raw.csv", index=False)
+    row_hashes = []
+    for read_chunk_size in [None, 1]:
+        insert_mock.reset_mock()
+        for df in read_table_dataframes(
+            str(tmp_path / "parcel_raw.csv"), read_chunk_size, as_text=True
+        ):
+            write_dataframe_to_postgres(
+                df, "parcel_raw", db, "etlJobId", [], 5, conflict_key="row_hash"
+            )
+        row_hashes.append(
+            [
+                row_hash
+                for call in insert_mock.call_args_list
+                for row_hash in call.args[0]["row_hash"]
+            ]
+        )
+    assert row_hashes[0] == row_hashes[1]
+
+
+def test_record_snapshot_delta(tmp_path):
+    previous_snapshot = pd.DataFrame(
+        {"pid": ["1", "2"]}, index=pd.Index(["a" * 32, "b" * 32], name="row_hash")
+    )
+    snapshot = pd.DataFrame({"pid": ["2", "3"], "row_hash": ["b" * 32, "c" * 32]})
+    rows_removed = record_snapshot_delta(
+        snapshot, previous_snapshot, str(tmp_path), "etlJobId", "parcel_raw"
+    )
+    assert rows_removed == 1
+    recorded_snapshot = read_snapshot_rows(str(tmp_path), "etlJobId", "parcel_raw")
+    assert recorded_snapshot.index.tolist() == ["b" * 32, "c" * 32]
+    assert recorded_snapshot["pid"].tolist() == ["2", "3"]
+    removed = pd.read_csv(tmp_path / "etlJobId" / "parcel_raw_removed.csv", dtype=str)
+    assert removed.to_dict("records") == [{"row_hash": "a" * 32, "pid": "1"}]
+    assert read_snapshot_rows(str(tmp_path), "otherJobId", "parcel_raw") is None
+
+
+@patch("utils.postgres_writer.is_partitioned_table", return_value=False)
+@patch("os.listdir", return_value=["title_raw.csv", "active_pin.csv"])
+@patch("os.path.isfile", return_value=True)
+@patch("utils.postgres_writer.read_processed_file", return_value=[dataframe])
+@patch("utils.postgres_writer.read_snapshot_rows")
+@patch("utils.postgres_writer.record_snapshot_delta", return_value=0)
+@patch("utils.postgres_writer.remove_old_snapshots")
+@patch(
+    "utils.postgres_writer.write_dataframe_to_postgres",
+    return_value={"Rows Inserted": 0, "Rows Skipped": 0, "Rows Failed": 0},
+)
+def test_run_delta(
+    write_mock,
+    remove_mock,
+    record_mock,
+    read_hashes_mock,
+    read_mock,
+    isfile_mock,
+    listdir_mock,
+    partitioned_mock,
+):
+    read_hashes_mock.return_value = filter_changed_rows(
+        dataframe, None, ["title_number"]
+    )[1].set_index("row_hash")
+    run(
+        "",
+        "etlJobId",
+        "databaseName",
+        snapshot_directory="snapshots",
+        previous_etl_job_id="previousJobId",
+    )
+    # Unchanged raw rows are not written, active_pin is never compared
+    assert len(write_mock.call_args_list[0].args[0]) == 0
+    assert len(write_mock.call_args_list[1].args[0]) == 1
+    assert record_mock.call_count == 1
+    assert record_mock.call_args.args[0].columns.tolist() == [
+        "title_number",
+        "land_title_district",
+        "row_hash",
+    ]
+    # Whole files are read as text for the raw tables compared in delta mode
+    assert read_mock.call_args_list[0].args[2] is True
+
+
+@patch("utils.postgres_writer.is_partitioned_table", return_value=True)
+@patch("utils.postgres_writer.create_job_partition")
+@patch("os.listdir", return_value=["parcel_raw.csv"])
+@patch("os.path.isfile", return_value=True)
+@patch("utils.postgres_writer.read_processed_file", return_value=[dataframe])
+@patch(
+    "utils.postgres_writer.write_dataframe_to_postgres",
+    return_value={"Rows Inserted": 1, "Rows Skipped": 0, "Rows Failed": 0},
+)
+def test_run_partitioned(
+    write_mock, read_mock, isfile_mock, listdir_mock, create_mock, partitioned_mock
+):
+    run("", "etlJobId", "databaseName")
+    assert create_mock.call_args.args[2] == "etlJobId"
+    assert write_mock.call_args.kwargs["partitioned"] is True
+
+
+@patch("utils.postgres_writer.insert_postgres_table_if_rows_not_exist", return_value=1)
+def test_write_dataframe_to_postgres_partitioned(insert_mock):
+    write_dataframe_to_postgres(
+        dataframe, "tablename", db, "etlJobId", ["tablename"], 5, partitioned=True
+    )
+    assert insert_mock.call_args.args[3][-1] == "etl_log_id"
+
+
+def test_get_job_partition_name():
+    assert (
+        get_job_partition_name("title_raw", "0a1b2c3d-0000-4000-8000-000000000000")
+        == "title_raw_0a1b2c3d000040008000000000000000"
+    )
 
 
 @patch("sqlalchemy.engine.Engine.connect")
-def test_get_row_count(connect_mock):
-    get_row_count("tablename", db)
-    assert connect_mock.called_once()
+def test_is_partitioned_table(connect_mock):
+    conn = connect_mock.return_value.__enter__.return_value
+    conn.execute.return_value.scalar.return_value = False
+    assert is_partitioned_table("title_raw", db) is False
+
+
+@patch("sqlalchemy.engine.Engine.connect")
+def test_drop_job_partition(connect_mock):
+    drop_job_partition(
+        "title_raw", db, "0a1b2c3d-0000-4000-8000-000000000000", detach_only=True
+    )
+    conn = connect_mock.return_value.__enter__.return_value
+    assert str(conn.execute.call_args.args[0]) == (
+        "ALTER TABLE title_raw DETACH PARTITION title_raw_0a1b2c3d000040008000000000000000;"
+    )
 
 
+@patch("utils.postgres_writer.drop_job_partition")
+@patch("sqlalchemy.engine.Engine.connect")
+def test_apply_partition_retention(connect_mock, drop_mock):
+    expired_job_id = "0a1b2c3d-0000-4000-8000-000000000000"
+    conn = connect_mock.return_value.__enter__.return_value
+    conn.execute.side_effect = [
+        [(expired_job_id,), ("ffffffff-0000-4000-8000-000000000000",)],
+        [("title_raw_0a1b2c3d000040008000000000000000",)],
+    ]
+    assert apply_partition_retention(["title_raw"], db, 4) == 1
+    drop_mock.assert_called_once_with("title_raw", db, expired_job_id, False)
+
+
+@patch("sqlalchemy.engine.Engine.connect")
+def test_rebuild_indexes(connect_mock):
+    rebuild_times = rebuild_indexes(
+        [
+            ("title_raw_idx", "CREATE INDEX title_raw_idx ON public.title_raw (a)"),
+            (
+                "parcel_raw_idx",
+                "CREATE INDEX parcel_raw_idx ON ONLY public.parcel_raw (a)",
+            ),
+        ],
+        db,
+    )
+    assert list(rebuild_times) == ["title_raw_idx", "parcel_raw_idx"]
+    conn = connect_mock.return_value.__enter__.return_value
+    executed = [str(call.args[0]) for call in conn.mock_calls if call.args]
+    assert "CREATE INDEX title_raw_idx ON public.title_raw (a)" in executed
+    assert "CREATE INDEX parcel_raw_idx ON public.parcel_raw (a)" in executed
+
+
+@patch("utils.postgres_writer.rebuild_indexes")
+@patch("utils.postgres_writer.drop_indexes")
 @patch(
-    "utils.postgres_writer.get_row_count", side_effect=sqlalchemy.exc.OperationalError
+    "utils.postgres_writer.get_secondary_indexes",
+    return_value=[("parcel_raw_idx", "CREATE INDEX parcel_raw_idx ON parcel_raw (a)")],
 )
-def test_get_row_count_error(count_mock):
-    with pytest.raises(sqlalchemy.exc.OperationalError):
-        get_row_count("tablename", db)
-    assert count_mock.called_once()
+@patch("sqlalchemy.engine.Engine.connect")
+@patch("utils.postgres_writer.is_partitioned_table", return_value=False)
+@patch("os.listdir", return_value=["parcel_raw.csv"])
+@patch("os.path.isfile", return_value=True)
+@patch("utils.postgres_writer.read_processed_file", return_value=[dataframe])
+@patch(
+    "utils.postgres_writer.write_dataframe_to_postgres",
+    return_value={"Rows Inserted": 1, "Rows Skipped": 0, "Rows Failed": 0},
+)
+def test_run_rebuild_indexes(
+    write_mock,
+    read_mock,
+    isfile_mock,
+    listdir_mock,
+    partitioned_mock,
+    connect_mock,
+    indexes_mock,
+    drop_mock,
+    rebuild_mock,
+):
+    # Indexes of a live table are kept outside an atomic load
+    run("", "etlJobId", "databaseName", rebuild_indexes_after_load=True)
+    drop_mock.assert_not_called()
+    rebuild_mock.assert_not_called()
+
+    run("", "etlJobId", "databaseName", rebuild_indexes_after_load=True, atomic=True)
+    assert drop_mock.call_args.args[0] == indexes_mock.return_value
+    assert rebuild_mock.call_args.args[0] == indexes_mock.return_value
+
+
+@patch("utils.postgres_writer.drop_indexes")
+@patch("sqlalchemy.engine.Engine.connect")
+@patch("os.listdir", return_value=["active_pin.csv"])
+@patch("os.path.isfile", return_value=True)
+@patch("utils.postgres_writer.read_processed_file", return_value=[dataframe])
+@patch(
+    "utils.postgres_writer.write_dataframe_to_postgres",
+    return_value={"Rows Inserted": 1, "Rows Skipped": 0, "Rows Failed": 0},
+)
+def test_run_rebuild_indexes_active_pin(
+    write_mock, read_mock, isfile_mock, listdir_mock, connect_mock, drop_mock
+):
+    # The indexes of active_pin serve lookups and are never dropped in an atomic load
+    run("", "etlJobId", "databaseName", rebuild_indexes_after_load=True, atomic=True)
+    drop_mock.assert_not_called()
+
+
+@patch("utils.postgres_writer.attach_job_partition")
+@patch("utils.postgres_writer.drop_indexes")
+@patch("utils.postgres_writer.create_job_partition")
+@patch("utils.postgres_writer.is_partitioned_table", return_value=True)
+@patch("os.listdir", return_value=["parcel_raw.csv"])
+@patch("os.path.isfile", return_value=True)
+@patch("utils.postgres_writer.read_processed_file", return_value=[dataframe])
+@patch(
+    "utils.postgres_writer.write_dataframe_to_postgres",
+    return_value={"Rows Inserted": 1, "Rows Skipped": 0, "Rows Failed": 0},
+)
+def test_run_rebuild_indexes_partitioned(
+    write_mock,
+    read_mock,
+    isfile_mock,
+    listdir_mock,
+    partitioned_mock,
+    create_mock,
+    drop_mock,
+    attach_mock,
+):
+    job_id = "0a1b2c3d-0000-4000-8000-000000000000"
+    run("", job_id, "databaseName", rebuild_indexes_after_load=True)
+    # The job partition is loaded detached and attached once loaded, the indexes of the table are never dropped
+    partition_name = "parcel_raw_0a1b2c3d000040008000000000000000"
+    assert create_mock.call_args.kwargs["detached"] is True
+    assert write_mock.call_args.args[1] == partition_name
+    assert partition_name in write_mock.call_args.args[4]
+    attach_mock.assert_called_once()
+    drop_mock.assert_not_called()
+
+
+@patch("utils.postgres_writer.copy_dataframe_to_table")
+@patch("sqlalchemy.engine.Engine.connect")
+def test_merge_dataframes_to_postgres(connect_mock, copy_mock):
+    conn = connect_mock.return_value.__enter__.return_value
+    conn.execute.return_value.rowcount = 1
+    conn.execute.return_value.scalar.side_effect = [True, 3]
+    rowCounts = merge_dataframes_to_postgres(
+        [dataframe], "active_pin", db, ["title_number", "land_title_district"]
+    )
+    assert rowCounts == {
+        "Rows Updated": 1,
+        "Rows Deleted": 1,
+        "Rows Inserted": 1,
+        "Rows Unchanged": 3,
+    }
+    executed = " ".join(str(call.args[0]) for call in conn.execute.call_args_list)
+    assert "SET title_status = i.title_status" in executed
+    assert "md5(ROW(title_number, land_title_district)::text)" in executed
+
+
+@patch("utils.postgres_writer.copy_dataframe_to_table")
+@patch("sqlalchemy.engine.Engine.connect")
+def test_merge_dataframes_to_postgres_empty(connect_mock, copy_mock):
+    conn = connect_mock.return_value.__enter__.return_value
+    conn.execute.return_value.scalar.return_value = False
+    with pytest.raises(ValueError):
+        merge_dataframes_to_postgres(
+            [dataframe[:0]], "active_pin", db, ["title_number"]
+        )
+
+
+@patch(
+    "utils.postgres_writer.merge_dataframes_to_postgres",
+    return_value={
+        "Rows Inserted": 1,
+        "Rows Updated": 0,
+        "Rows Deleted": 0,
+        "Rows Unchanged": 0,
+    },
+)
+@patch("os.listdir", return_value=["active_pin.csv"])
+@patch("os.path.isfile", return_value=True)
+@patch("utils.postgres_writer.read_processed_file", return_value=[dataframe])
+@patch("utils.postgres_writer.write_dataframe_to_postgres")
+def test_run_active_pin_merge(
+    write_mock, read_mock, isfile_mock, listdir_mock, merge_mock
+):
+    run("", "etlJobId", "databaseName", active_pin_load="merge")
+    assert merge_mock.call_args.args[1] == "active_pin"
+    assert "given_name" in merge_mock.call_args.args[3]
+    write_mock.assert_not_called()
+
+
+@patch("utils.postgres_writer.swap_shadow_table")
+@patch(
+    "utils.postgres_writer.create_shadow_table",
+    return_value=("active_pin_shadow", (1, 123)),
+)
+@patch("sqlalchemy.engine.Engine.connect")
+@patch("os.listdir", return_value=["active_pin.csv"])
+@patch("os.path.isfile", return_value=True)
+@patch("utils.postgres_writer.read_processed_file", return_value=[dataframe])
+@patch(
+    "utils.postgres_writer.write_dataframe_to_postgres",
+    return_value={"Rows Inserted": 1, "Rows Skipped": 0, "Rows Failed": 0},
+)
+def test_run_shadow_swap(
+    write_mock,
+    read_mock,
+    isfile_mock,
+    listdir_mock,
+    connect_mock,
+    create_mock,
+    swap_mock,
+):
+    run("", "etlJobId", "databaseName", shadow_swap=True)
+    conn = connect_mock.return_value.__enter__.return_value
+    assert write_mock.call_args.args[1] == "active_pin_shadow"
+    assert write_mock.call_args.args[2] is conn
+    swap_mock.assert_called_once_with("active_pin", conn, (1, 123))
+    executed = [str(call.args[0]) for call in conn.execute.call_args_list]
+    assert "ANALYZE active_pin_shadow;" in executed
+
+
+@patch("utils.postgres_writer.get_table_checksum", return_value=(2, 456))
+@patch("sqlalchemy.engine.Engine.connect")
+def test_swap_shadow_table_written_since_copy(connect_mock, checksum_mock):
+    conn = connect_mock.return_value.__enter__.return_value
+    with pytest.raises(ValueError):
+        swap_shadow_table("active_pin", conn, (1, 123))
+    executed = [str(call.args[0]) for call in conn.execute.call_args_list]
+    assert executed == ["LOCK TABLE active_pin IN SHARE ROW EXCLUSIVE MODE;"]
+
+
+@patch("os.listdir", return_value=["parcel_raw.csv"])
+def test_run_in_chunks_parallel_error(listdir_mock):
+    with pytest.raises(ValueError):
+        run("", "etlJobId", "databaseName", workers=2, read_chunk_size=1000)
+
+
+@patch("os.listdir", return_value=["active_pin.csv"])
+def test_run_shadow_swap_parallel_error(listdir_mock):
+    with pytest.raises(ValueError):
+        run("", "etlJobId", "databaseName", workers=2, shadow_swap=True)
+
+
+@patch("utils.postgres_writer.is_partitioned_table", return_value=False)
+@patch("os.listdir")
+@patch(
+    "utils.postgres_writer.write_dataframe_to_postgres",
+    return_value={"Rows Inserted": 1, "Rows Skipped": 0, "Rows Failed": 0},
+)
+def test_run_dataframes(write_mock, listdir_mock, partitioned_mock):
+    run(
+        "",
+        "etlJobId",
+        "databaseName",
+        read_chunk_size=1,
+        dataframes={"parcel_raw": pd.concat([dataframe] * 2)},
+    )
+    listdir_mock.assert_not_called()
+    assert write_mock.call_count == 2
+    assert write_mock.call_args.args[1] == "parcel_raw"
+
+
+@patch("utils.postgres_writer.create_history_table")
+@patch("utils.postgres_writer.copy_dataframe_to_table")
+@patch("sqlalchemy.engine.Engine.connect")
+def test_write_dataframe_to_history(connect_mock, copy_mock, create_mock):
+    conn = connect_mock.return_value.__enter__.return_value
+    conn.execute.return_value.rowcount = 1
+    rowCounts = write_dataframe_to_history(
+        pd.concat([dataframe] * 2), "tablename", db, "etlJobId", "previousJobId"
+    )
+    # Duplicate rows are staged once
+    assert len(copy_mock.call_args.args[0]) == 1
+    executed_sql = [str(call.args[0]) for call in conn.execute.call_args_list]
+    assert "AND h.last_etl_log_id = 'previousJobId'" in executed_sql[1]
+    assert rowCounts == {"Rows Inserted": 1, "Rows Skipped": 1, "Rows Failed": 0}
+
+
+@patch("sqlalchemy.engine.Engine.connect")
+def test_rollback_history_table(connect_mock):
+    rollback_history_table("tablename", db, "etlJobId", "previousJobId")
+    conn = connect_mock.return_value.__enter__.return_value
+    executed_sql = [str(call.args[0]) for call in conn.execute.call_args_list]
+    assert executed_sql == [
+        "SELECT to_regclass('tablename_history');",
+        "DELETE FROM tablename_history WHERE first_etl_log_id = 'etlJobId';",
+        "UPDATE tablename_history SET last_etl_log_id = 'previousJobId' WHERE last_etl_log_id = 'etlJobId';",
+    ]
+
+
+@patch("sqlalchemy.engine.Engine.connect")
+def test_rollback_history_table_missing(connect_mock):
+    conn = connect_mock.return_value.__enter__.return_value
+    conn.execute.return_value.scalar.return_value = None
+    rollback_history_table("tablename", db, "etlJobId", "previousJobId")
+    assert conn.execute.call_count == 1
+
+
+@patch("os.listdir", return_value=["parcel_raw.csv"])
+@patch("os.path.isfile", return_value=True)
+@patch("utils.postgres_writer.read_processed_file", return_value=[dataframe])
+@patch("utils.postgres_writer.count_closed_history_versions", return_value=0)
+@patch(
+    "utils.postgres_writer.write_dataframe_to_history",
+    return_value={"Rows Inserted": 1, "Rows Skipped": 0, "Rows Failed": 0},
+)
+@patch("utils.postgres_writer.write_dataframe_to_postgres")
+def test_run_history(
+    write_mock, history_mock, closed_mock, read_mock, isfile_mock, listdir_mock
+):
+    run(
+        "",
+        "etlJobId",
+        "databaseName",
+        previous_etl_job_id="previousJobId",
+        raw_storage="history",
+    )
+    assert history_mock.call_args.args[3:] == ("etlJobId", "previousJobId")
+    # Whole files are read as text so rows hash the same as in chunked reads
+    assert read_mock.call_args.args[2] is True
+    assert closed_mock.call_count == 1
+    assert not write_mock.called
+
+
+@patch("os.listdir", return_value=["parcel_raw.csv"])
+def test_run_atomic_parallel_error(listdir_mock):
+    with pytest.raises(ValueError):
+        run("", "etlJobId", "databaseName", workers=2, atomic=True)
+
+
+@patch("utils.postgres_writer.run", side_effect=FileNotFoundError)
+def test_run_error(write_mock):
+    with pytest.raises(FileNotFoundError):
+        run("", "etlJobId", "databaseName")
+    assert write_mock.called_once()
@@ -1,30 +1,126 @@
+import functools
+import hashlib
+import itertools
 import json
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
 import requests
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 import os
 
 
-def pid_parser(pids):
+def parse_pids(pids):
     """
-    Parses list of pids into string form and adds leading zeros such that each pid is 9 digits.
+    Parses pids into unsigned 32-bit integers. Every PID has at most 9 digits, so each one fits in four bytes.
 
     Parameters:
-    - pids (list): List of parcel ids.
+    - pids (pd.Series): PIDs as strings or numbers.
 
     Returns:
-    - pids (str): String of pids in cleaned form.
+    - parsed_pids (np.ndarray): The pids as np.uint32, 0 where a pid could not be parsed.
+    - is_parsed (np.ndarray): Boolean mask of the pids that are whole numbers in the uint32 range.
     """
-    formatted_pids = []
+    numbers = pd.to_numeric(pids, errors="coerce").to_numpy(
+        dtype=np.float64, na_value=np.nan
+    )
+    with np.errstate(invalid="ignore"):
+        is_parsed = (
+            (numbers >= 0)
+            & (numbers <= np.iinfo(np.uint32).max)
+            & (numbers == np.floor(numbers))
+        )
+
+    parsed_pids = np.zeros(len(numbers), dtype=np.uint32)
+    parsed_pids[is_parsed] = numbers[is_parsed]
+
+    return parsed_pids, is_parsed
+
+
+def isin_sorted_pids(pids, sorted_pids):
+    """
+    Tests each pid for membership in sorted_pids with a binary search.
+
+    Parameters:
+    - pids (np.ndarray): PIDs to look up.
+    - sorted_pids (np.ndarray): Sorted, unique PIDs.
+
+    Returns:
+    - np.ndarray: Boolean mask of the pids found in sorted_pids.
+    """
+    if len(sorted_pids) == 0:
+        return np.zeros(len(pids), dtype=bool)
+
+    positions = np.searchsorted(sorted_pids, pids).clip(max=len(sorted_pids) - 1)
+    return sorted_pids[positions] == pids
+
+
+def filter_valid_pids(dataframe, valid_pids):
+    """
+    Parses the pid column of dataframe into integers and keeps only the rows whose pid is in valid_pids.
+
+    Parameters:
+    - dataframe (pd.Dataframe): Dataframe with a pid column.
+    - valid_pids (np.ndarray): Sorted, unique valid PIDs from parse_pids.
+
+    Returns:
+    - pd.Dataframe: The rows with a valid pid, with pid as np.uint32.
+    """
+    pids, is_parsed = parse_pids(dataframe["pid"])
+    is_valid = is_parsed & isin_sorted_pids(pids, valid_pids)
+
+    dataframe = dataframe[is_valid].copy()
+    dataframe["pid"] = pids[is_valid]
+
+    return dataframe
+
+
+def format_raw_pids(dataframe):
+    """
+    Formats the integer pid column of a raw table back to text for output, as LTSA sends it.
+
+    Parameters:
+    - dataframe (pd.Dataframe): Dataframe with an integer pid column.
+
+    Returns:
+    - pd.Dataframe: A copy of dataframe with pid as strings.
+    """
+    return dataframe.assign(pid=dataframe["pid"].astype(str).astype(object))
+
+
+def group_pids(dataframe, keys):
+    """
+    Groups the integer pids of dataframe by keys into a string of unique, zero-padded pids per group. Rows are sorted
+    once and each group is sliced from the sorted pids, which are formatted together instead of one at a time.
+
+    Parameters:
+    - dataframe (pd.Dataframe): Dataframe with the keys columns and an integer pid column.
+    - keys (list): Columns to group by.
+
+    Returns:
+    - pd.Dataframe: One row per group, with the keys columns and a pids column of formatted pids.
+    """
+    sorted_df = (
+        dataframe[keys + ["pid"]]
+        .drop_duplicates()
+        .sort_values(keys + ["pid"], kind="stable")
+    )
+    group_codes = sorted_df.groupby(keys, sort=False).ngroup().to_numpy()
+    group_starts = np.flatnonzero(np.r_[True, group_codes[1:] != group_codes[:-1]])
+    group_ends = np.r_[group_starts[1:], len(sorted_df)]
 
     # Add leading zeros until each pid is 9 digits long
-    for pid in pids:
-        pid = pid.zfill(9)
-        formatted_pids.append(pid)
+    formatted_pids = np.char.zfill(sorted_df["pid"].to_numpy().astype(str), 9)
+    grouped_df = sorted_df.iloc[group_starts][keys].reset_index(drop=True)
+    grouped_df["pids"] = [
+        "|".join(formatted_pids[start:end])
+        for start, end in zip(group_starts, group_ends)
+    ]
 
-    # Combine and format PIDs as a string
-    return "|".join(sorted(set(map(str, formatted_pids))))
+    return grouped_df
 
 
 def load_data_cleaning_rules(data_rules_url):
@@ -46,7 +142,481 @@ def load_data_cleaning_rules(data_rules_url):
         raise Exception(f"Failed to fetch data cleaning rules from {data_rules_url}")
 
 
-def clean_active_pin_df(active_pin_df, output_directory, data_rules_url):
+def compile_replace_exact_values(replace_exact_values):
+    """
+    Compiles replace_exact_values rules into one mapping of original value to replacement. Replacements are resolved in
+    rule order, so a value replaced by one rule and matched by a later one maps straight to the later replacement.
+
+    Parameters:
+    - replace_exact_values (dict): Replacement mapped to the list of values it replaces.
+
+    Returns:
+    - value_map (dict): Dictionary of original value to replacement.
+    """
+    value_map = {}
+    for replacement, values in replace_exact_values.items():
+        values = set(values)
+        for value, mapped_value in value_map.items():
+            if mapped_value in values:
+                value_map[value] = replacement
+        for value in values:
+            value_map.setdefault(value, replacement)
+
+    return value_map
+
+
+def compile_remove_characters(characters):
+    """
+    Compiles remove_characters rules into string operations. Runs of single characters are removed with one
+    str.translate table, and longer strings are removed in rule order between them.
+
+    Parameters:
+    - characters (list): Characters and strings to remove.
+
+    Returns:
+    - operations (list): Functions that each take and return a value.
+    """
+    operations = []
+    translate_table = {}
+    for characters_to_remove in characters + [None]:
+        if characters_to_remove is not None and len(characters_to_remove) == 1:
+            translate_table[ord(characters_to_remove)] = None
+            continue
+
+        if translate_table:
+            operations.append(
+                lambda value, table=translate_table: (
+                    value.translate(table) if isinstance(value, str) else value
+                )
+            )
+            translate_table = {}
+        if characters_to_remove:
+            operations.append(
+                lambda value, old=characters_to_remove: (
+                    value.replace(old, "") if isinstance(value, str) else value
+                )
+            )
+
+    # Values left as two spaces become a single space, as the rule always has
+    operations.append(lambda value: " " if value == "  " else value)
+
+    return operations
+
+
+def compile_cleaning_plan(data_cleaning):
+    """
+    Compiles the rules from data_rules.json into an execution plan. Rules that change one value at a time are fused so
+    each column is traversed once, and switch_column_value rules run as one vectorized step after their column.
+
+    Each step in the plan is a dictionary with:
+    - column (str): The column the step applies to.
+    - rules (list): Names of the rules in the step, in the order they are applied.
+    - operations (list): (rule, function) pairs, where each function takes and returns a value, for fused steps.
+    - rules_hash (str): Hash of the column's rules in data_rules.json, for fused steps.
+    - switch_column_value (dict): The switch rule, for switch steps.
+
+    Parameters:
+    - data_cleaning (dict): Dictionary of rules read from data_rules.json.
+
+    Returns:
+    - cleaning_plan (list): List of steps, in the order they are applied.
+    """
+    cleaning_plan = []
+    for column, rule in data_cleaning["column_rules"].items():
+        rules = []
+        operations = []
+
+        if "replace_exact_values" in rule.keys():
+            value_map = compile_replace_exact_values(rule["replace_exact_values"])
+            rules.append("replace_exact_values")
+            operations.append(
+                (
+                    "replace_exact_values",
+                    lambda value, value_map=value_map: value_map.get(value, value),
+                )
+            )
+
+        if "trim_after_comma" in rule.keys():
+            rules.append("trim_after_comma")
+            operations.append(
+                (
+                    "trim_after_comma",
+                    lambda value: (
+                        value.split(",")[0] if isinstance(value, str) else value
+                    ),
+                )
+            )
+
+        if "remove_characters" in rule.keys():
+            rules.append("remove_characters")
+            operations.extend(
+                ("remove_characters", operation)
+                for operation in compile_remove_characters(rule["remove_characters"])
+            )
+
+        if "to_uppercase" in rule.keys():
+            rules.append("to_uppercase")
+            operations.append(
+                (
+                    "to_uppercase",
+                    lambda value: value.upper() if isinstance(value, str) else value,
+                )
+            )
+
+        switch_column_value = rule.get("switch_column_value")
+        if switch_column_value and "region_map" in switch_column_value:
+            value_map = {
+                value: replacement
+                for replacement, values in switch_column_value["region_map"].items()
+                for value in values
+            }
+            rules.append("region_map")
+            operations.append(
+                (
+                    "region_map",
+                    lambda value, value_map=value_map: value_map.get(value, value),
+                )
+            )
+
+        if operations:
+            cleaning_plan.append(
+                {
+                    "column": column,
+                    "rules": rules,
+                    "operations": operations,
+                    "rules_hash": hashlib.sha256(
+                        json.dumps(rule, sort_keys=True).encode()
+                    ).hexdigest()[:16],
+                }
+            )
+        if switch_column_value:
+            cleaning_plan.append(
+                {
+                    "column": column,
+                    "rules": ["switch_column_value"],
+                    "switch_column_value": switch_column_value,
+                }
+            )
+
+    return cleaning_plan
+
+
+def apply_switch_column_value(dataframe, switch_column_value):
+    """
+    Moves values matching a switch_column_value rule from its from_column to its to_column.
+
+    Parameters:
+    - dataframe (pd.Dataframe): The dataframe to be updated in place.
+    - switch_column_value (dict): The switch rule, with from_column, to_column and a datatype or region_map.
+    """
+    from_column = switch_column_value["from_column"]
+    to_column = switch_column_value["to_column"]
+
+    if switch_column_value.get("datatype") == "int":
+        is_switched = dataframe[from_column].str.isdigit().fillna(False).astype(bool)
+        dataframe[to_column] = dataframe[from_column].where(
+            is_switched, dataframe[to_column]
+        )
+
+    if "region_map" in switch_column_value:
+        is_switched = dataframe[from_column].isin(
+            switch_column_value["region_map"].keys()
+        )
+        dataframe[to_column] = dataframe[from_column].where(
+            is_switched, dataframe[to_column]
+        )
+
+
+def apply_operations(value, operations):
+    """
+    Applies compiled operations to a single value, in order.
+
+    Parameters:
+    - value: The value to be cleaned.
+    - operations (list): Functions that each take and return a value.
+
+    Returns:
+    - value: The cleaned value.
+    """
+    for operation in operations:
+        value = operation(value)
+    return value
+
+
+def map_distinct_values(series, function, cache=None):
+    """
+    Applies function once per distinct value in series and maps the results back to the rows through the codes from
+    pd.factorize. Null values are left as they are.
+
+    Parameters:
+    - series (pd.Series): The values to be mapped.
+    - function (callable): Function that takes and returns a value.
+    - cache (dict, optional): Normalization cache from load_cleaning_cache. Values found in it are not mapped again,
+      and the cache is updated in place with the values mapped and the time each value was last used.
+      Default is None.
+
+    Returns:
+    - pd.Series: The mapped values, with the index of series.
+    """
+    codes, distinct_values = pd.factorize(series)
+    if len(distinct_values) == 0:
+        return series
+
+    mapped_values = np.empty(len(distinct_values), dtype=object)
+    if cache is None:
+        mapped_values[:] = [function(value) for value in distinct_values]
+    else:
+        positions = cache["raw"].get_indexer(distinct_values)
+        is_cached = positions >= 0
+        mapped_values[is_cached] = cache["cleaned"][positions[is_cached]]
+        mapped_values[~is_cached] = [
+            function(value) for value in distinct_values[~is_cached]
+        ]
+
+        used_at = int(time.time())
+        cache["last_used"][positions[is_cached]] = used_at
+        cache["raw"] = cache["raw"].append(distinct_values[~is_cached])
+        cache["cleaned"] = np.concatenate([cache["cleaned"], mapped_values[~is_cached]])
+        cache["last_used"] = np.concatenate(
+            [
+                cache["last_used"],
+                np.full((~is_cached).sum(), used_at, dtype=np.int64),
+            ]
+        )
+
+    values = series.to_numpy(dtype=object, copy=True, na_value=None)
+    is_mapped = codes >= 0
+    values[is_mapped] = mapped_values[codes[is_mapped]]
+
+    return pd.Series(values, index=series.index, name=series.name)
+
+
+def get_cleaning_cache_path(cache_directory, column, rules_hash):
+    """
+    Gets the path of a column's normalization cache file.
+
+    Parameters:
+    - cache_directory (str): Directory the normalization caches are kept in.
+    - column (str): The column the cache is for.
+    - rules_hash (str): Hash of the column's rules, from compile_cleaning_plan.
+
+    Returns:
+    - str: Path of the Arrow IPC cache file.
+    """
+    return os.path.join(cache_directory, f"{column}_{rules_hash}.arrow")
+
+
+def load_cleaning_cache(cache_directory, column, rules_hash):
+    """
+    Loads a column's normalization cache of raw value to cleaned value. The cache file is memory mapped, and a cache
+    written for different rules is never loaded.
+
+    Parameters:
+    - cache_directory (str): Directory the normalization caches are kept in.
+    - column (str): The column the cache is for.
+    - rules_hash (str): Hash of the column's rules, from compile_cleaning_plan.
+
+    Returns:
+    - cache (dict): The raw values as a pd.Index, and arrays of their cleaned values and the unix time each was last
+      used. Empty if there is no cache for the column's current rules.
+    """
+    file_path = get_cleaning_cache_path(cache_directory, column, rules_hash)
+    if not os.path.isfile(file_path):
+        return {
+            "raw": pd.Index([], dtype=object),
+            "cleaned": np.empty(0, dtype=object),
+            "last_used": np.empty(0, dtype=np.int64),
+        }
+
+    with pa.memory_map(file_path) as source:
+        table = pa.ipc.open_file(source).read_all()
+
+    return {
+        "raw": pd.Index(
+            table.column("raw").to_numpy(zero_copy_only=False), dtype=object
+        ),
+        "cleaned": table.column("cleaned")
+        .to_numpy(zero_copy_only=False)
+        .astype(object),
+        "last_used": table.column("last_used").to_numpy().copy(),
+    }
+
+
+def save_cleaning_cache(cache, cache_directory, column, rules_hash, max_entries):
+    """
+    Saves a column's normalization cache, keeping only the max_entries most recently used values, and removes the
+    column's caches for other rules.
+
+    Parameters:
+    - cache (dict): Normalization cache from load_cleaning_cache.
+    - cache_directory (str): Directory the normalization caches are kept in.
+    - column (str): The column the cache is for.
+    - rules_hash (str): Hash of the column's rules, from compile_cleaning_plan.
+    - max_entries (int): Maximum number of values to keep.
+    """
+    os.makedirs(cache_directory, exist_ok=True)
+
+    # Only string values are kept, the cleaned value of anything else is worked out again
+    raw = cache["raw"].to_numpy()
+    cleaned = cache["cleaned"]
+    is_kept = np.array(
+        [
+            isinstance(raw_value, str)
+            and (cleaned_value is None or isinstance(cleaned_value, str))
+            for raw_value, cleaned_value in zip(raw, cleaned)
+        ],
+        dtype=bool,
+    )
+    kept_positions = np.flatnonzero(is_kept)
+    if len(kept_positions) > max_entries:
+        most_recent = np.argsort(-cache["last_used"][kept_positions], kind="stable")
+        kept_positions = np.sort(kept_positions[most_recent[:max_entries]])
+
+    table = pa.table(
+        {
+            "raw": pa.array(raw[kept_positions], type=pa.string()),
+            "cleaned": pa.array(cleaned[kept_positions], type=pa.string()),
+            "last_used": pa.array(cache["last_used"][kept_positions], type=pa.int64()),
+        }
+    )
+
+    # Write to a temporary file first so an interrupted run never leaves a partial cache behind
+    file_path = get_cleaning_cache_path(cache_directory, column, rules_hash)
+    with pa.OSFile(file_path + ".tmp", "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(file_path + ".tmp", file_path)
+
+    for file_name in os.listdir(cache_directory):
+        name, extension = os.path.splitext(file_name)
+        if (
+            extension == ".arrow"
+            and name.rsplit("_", 1)[0] == column
+            and file_name != os.path.basename(file_path)
+        ):
+            os.remove(os.path.join(cache_directory, file_name))
+
+
+def apply_cleaning_plan(
+    dataframe,
+    cleaning_plan,
+    profile=False,
+    cache_directory=None,
+    cache_max_entries=1000000,
+):
+    """
+    Applies a plan from compile_cleaning_plan to dataframe and times each step.
+
+    Parameters:
+    - dataframe (pd.Dataframe): The dataframe to be cleaned in place.
+    - cleaning_plan (list): Steps returned by compile_cleaning_plan.
+    - profile (bool, optional): Run each rule of a fused step as its own pass, so every rule is timed separately.
+      Default is False.
+    - cache_directory (str, optional): Directory to keep a normalization cache of each column's cleaned values in, so
+      only values not seen by an earlier run are cleaned. Not used when profiling. Default is None.
+    - cache_max_entries (int, optional): Maximum number of values kept in each column's cache, least recently used
+      values are evicted first. Default is 1000000.
+
+    Returns:
+    - timings (dict): Dictionary of (column, rule) to the seconds taken. Fused steps are keyed by their rules joined
+      with "+".
+    """
+    timings = {}
+    for step in cleaning_plan:
+        column = step["column"]
+
+        if "switch_column_value" in step:
+            step_start_time = time.time()
+            apply_switch_column_value(dataframe, step["switch_column_value"])
+            timings[(column, "switch_column_value")] = time.time() - step_start_time
+            continue
+
+        if profile:
+            # Give each rule its own pass over the column so it can be timed alone
+            passes = [
+                (
+                    rule,
+                    [
+                        operation
+                        for name, operation in step["operations"]
+                        if name == rule
+                    ],
+                )
+                for rule in step["rules"]
+            ]
+        else:
+            passes = [
+                (
+                    "+".join(step["rules"]),
+                    [operation for _, operation in step["operations"]],
+                )
+            ]
+
+        use_cache = cache_directory is not None and not profile
+        for rule, operations in passes:
+            step_start_time = time.time()
+            cache = (
+                load_cleaning_cache(cache_directory, column, step["rules_hash"])
+                if use_cache
+                else None
+            )
+            dataframe[column] = map_distinct_values(
+                dataframe[column],
+                functools.partial(apply_operations, operations=operations),
+                cache,
+            )
+            if use_cache:
+                save_cleaning_cache(
+                    cache,
+                    cache_directory,
+                    column,
+                    step["rules_hash"],
+                    cache_max_entries,
+                )
+            timings[(column, rule)] = time.time() - step_start_time
+
+    return timings
+
+
+def write_processed_file(dataframe, output_directory, table_name, output_format="csv"):
+    """
+    Writes a processed dataframe to output_directory as CSV, as zstd compressed Parquet, or as uncompressed Arrow IPC
+    that can be memory mapped without a copy when it is read back.
+
+    Parameters:
+    - dataframe (pd.Dataframe): The dataframe to be written.
+    - output_directory (str): Directory to write the file to.
+    - table_name (str): Name of the file, without extension.
+    - output_format (str, optional): "csv", "parquet" or "arrow". Default is "csv".
+
+    Returns:
+    - file_path (str): Path of the written file.
+    """
+    file_path = output_directory + table_name + "." + output_format
+    if output_format == "parquet":
+        dataframe.to_parquet(file_path, index=False, compression="zstd")
+    elif output_format == "arrow":
+        dataframe.reset_index(drop=True).to_feather(
+            file_path, compression="uncompressed"
+        )
+    elif output_format == "csv":
+        dataframe.to_csv(file_path, index=False)
+    else:
+        raise ValueError(f"Unknown output format: {output_format}")
+
+    return file_path
+
+
+def clean_active_pin_df(
+    active_pin_df,
+    output_directory,
+    data_rules_url,
+    write_files=True,
+    output_format="csv",
+    profile_cleaning=False,
+    cleaning_cache_directory=None,
+    cleaning_cache_max_entries=1000000,
+):
     """
     Applies cleaning rules from data_rules_url to active_pin_df.
 
@@ -54,9 +624,16 @@ def clean_active_pin_df(active_pin_df, output_directory, data_rules_url):
     - active_pin_df (pd.Dataframe): The dataframe to be cleaned.
     - output_directory (str): Directory to write active_pin.csv to.
     - data_rules_url (str): URL to data_rules.json file hosted on github.
+    - write_files (bool, optional): Write the cleaned dataframe to an active_pin file. Default is True.
+    - output_format (str, optional): "csv", "parquet" or "arrow", the format of the file. Default is "csv".
+    - profile_cleaning (bool, optional): Time each cleaning rule in its own pass instead of fusing the rules on a
+      column. Default is False.
+    - cleaning_cache_directory (str, optional): Directory to keep a normalization cache of each column's cleaned
+      values in, so values cleaned by an earlier run are not cleaned again. Default is None.
+    - cleaning_cache_max_entries (int, optional): Maximum number of values cached for each column. Default is 1000000.
 
     Returns:
-    - None
+    - active_pin_df (pd.Dataframe): The cleaned dataframe.
     """
     try:
         # Load data cleaning rules from the specified GitHub URL
@@ -64,184 +641,340 @@ def clean_active_pin_df(active_pin_df, output_directory, data_rules_url):
 
         data_cleaning = load_data_cleaning_rules(data_rules_url)
 
-        # Apply cleaning rules to each column
-        for column, rule in data_cleaning["column_rules"].items():
-            # Replace Exact Values - Looks for exact string match in column and replaces it with value
-            if "replace_exact_values" in rule.keys():
-                for replacement in rule["replace_exact_values"]:
-                    active_pin_df[column] = active_pin_df[column].replace(
-                        rule["replace_exact_values"][replacement], replacement
-                    )
-
-            # Trim after comma
-            if "trim_after_comma" in rule.keys():
-                active_pin_df[column] = active_pin_df[column].apply(
-                    lambda x: x.split(",")[0] if isinstance(x, str) else x
-                )
-
-            # Remove Characters - Looks for strings containing character in column and removes character
-            if "remove_characters" in rule.keys():
-                for replacement in rule["remove_characters"]:
-                    active_pin_df[column] = (
-                        active_pin_df[column]
-                        .str.replace(replacement, "")
-                        .replace("  ", " ")
-                    )
-
-            # To uppercase
-            if "to_uppercase" in rule.keys():
-                active_pin_df[column] = active_pin_df[column].apply(
-                    lambda x: x.upper() if isinstance(x, str) else x
-                )
-
-            # Switch value from one column, from_column, to another, to_column
-            if "switch_column_value" in rule.keys():
-                from_column = rule["switch_column_value"]["from_column"]
-                to_column = rule["switch_column_value"]["to_column"]
-
-                if "datatype" in rule["switch_column_value"]:
-                    datatype = rule["switch_column_value"]["datatype"]
-                    for value in active_pin_df[from_column]:
-                        if datatype == "int" and value and value.isdigit():
-                            active_pin_df[to_column] = np.where(
-                                (active_pin_df[from_column] == value),
-                                active_pin_df[from_column],
-                                active_pin_df[to_column],
-                            )
-
-                if "region_map" in rule["switch_column_value"]:
-                    region_map = rule["switch_column_value"]["region_map"]
-                    for replacement in region_map:
-                        active_pin_df[column] = active_pin_df[column].replace(
-                            region_map[replacement], replacement
-                        )
-
-                    for value in region_map.keys():
-                        active_pin_df[to_column] = np.where(
-                            (active_pin_df[from_column] == value),
-                            active_pin_df[from_column],
-                            active_pin_df[to_column],
-                        )
+        # Compile the rules once, then apply them to each column
+        cleaning_plan = compile_cleaning_plan(data_cleaning)
+        timings = apply_cleaning_plan(
+            active_pin_df,
+            cleaning_plan,
+            profile_cleaning,
+            cleaning_cache_directory,
+            cleaning_cache_max_entries,
+        )
+        for (column, rule), rule_elapsed_time in sorted(
+            timings.items(), key=lambda timing: timing[1], reverse=True
+        ):
+            print(
+                f"Applied cleaning rule '{rule}' to column '{column}'. Elapsed Time: {rule_elapsed_time:.2f} seconds"
+            )
 
         print(f"Cleaning rules applied to file: active_pin.csv")
 
         active_pin_df = active_pin_df.drop(columns=["occupation", "parcel_status"])
 
-        active_pin_df.to_csv(output_directory + "active_pin.csv", index=False)
+        if write_files:
+            file_path = write_processed_file(
+                active_pin_df, output_directory, "active_pin", output_format
+            )
 
-        data_cleaning_elapsed_time = time.time() - data_cleaning_start_time
-        print(
-            f"Wrote cleaned ltsa data to file: {output_directory+'active_pin.csv'}. Elapsed Time: {data_cleaning_elapsed_time:.2f} seconds"
-        )
+            data_cleaning_elapsed_time = time.time() - data_cleaning_start_time
+            print(
+                f"Wrote cleaned ltsa data to file: {file_path}. Elapsed Time: {data_cleaning_elapsed_time:.2f} seconds"
+            )
+        else:
+            data_cleaning_elapsed_time = time.time() - data_cleaning_start_time
+            print(
+                f"Cleaned ltsa data. Elapsed Time: {data_cleaning_elapsed_time:.2f} seconds"
+            )
+
+        return active_pin_df
 
     except Exception as e:
         raise e(f"Failed to clean active_pin dataframe")
 
 
-def parse_ltsa_files(input_directory, output_directory, data_rules_url, engine):
+# pandas' default na_values, so both CSV engines read the same values as null
+CSV_NULL_VALUES = [
+    "",
+    "#N/A",
+    "#N/A N/A",
+    "#NA",
+    "-1.#IND",
+    "-1.#QNAN",
+    "-NaN",
+    "-nan",
+    "1.#IND",
+    "1.#QNAN",
+    "<NA>",
+    "N/A",
+    "NA",
+    "NULL",
+    "NaN",
+    "None",
+    "n/a",
+    "nan",
+    "null",
+]
+
+
+def get_arrow_convert_options(usecols, dtype):
     """
-    Reads raw LTSA files to CSVs and writes them to output_directory. Writes processed and cleaned data to active_pin.csv.
+    Builds Arrow CSV convert options that read the same columns, types and null values as pd.read_csv.
 
     Parameters:
-    - input_directory (str): Directory to read LTSA CSV files from.
-    - output_directory (str): Directory to write CSV files to.
-    - data_rules_url (str): URL to data_rules.json file hosted on github.
-    - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+    - usecols (list): Columns to read.
+    - dtype (dict): Column types, by column name.
 
     Returns:
-    - None
+    - pv.ConvertOptions: Options for pyarrow.csv.
     """
-    try:
-        # Read, process, and write CSV files
-        read_files_start_time = time.time()
+    return pv.ConvertOptions(
+        include_columns=usecols,
+        column_types={
+            column: (
+                pa.string()
+                if column_type is str
+                else pa.from_numpy_dtype(np.dtype(column_type))
+            )
+            for column, column_type in dtype.items()
+        },
+        null_values=CSV_NULL_VALUES,
+        strings_can_be_null=True,
+    )
 
-        # Read valid_pid table from database and create dataframe
-        valid_pid_df = pd.read_sql_table("valid_pid", engine, columns=["pid"])
 
-        # Remove leading zeros from pid to match LTSA data
-        valid_pid_df["pid"] = valid_pid_df["pid"].astype(str)
-        print("Read table: valid_pid")
+def read_ltsa_file(file_path, usecols, dtype, csv_engine="c"):
+    """
+    Reads the usecols columns of a raw LTSA file. The "pyarrow" engine parses the file on Arrow's thread pool into
+    Arrow-backed columns, the "c" engine uses the single-threaded pandas C parser and object columns.
 
-        # Creating an index of valid PIDs
-        valid_pid_df_index = valid_pid_df.set_index(["pid"]).index
+    Parameters:
+    - file_path (str): Path of the LTSA CSV file.
+    - usecols (list): Columns to read.
+    - dtype (dict): Column types, by column name.
+    - csv_engine (str, optional): "c" or "pyarrow". Default is "c".
 
-        # 2_parcel.csv
-        parcel_df = (
-            pd.read_csv(
-                input_directory + "2_parcel.csv",
-                usecols=["PRMNNT_PRCL_ID", "PRCL_STTS_CD"],
-                dtype={"PRMNNT_PRCL_ID": str, "PRCL_STTS_CD": str},
-            )
-            .applymap(lambda x: x.strip() if isinstance(x, str) else x)
-            .replace("", None)
-            .replace(np.nan, None)
-            .dropna(subset=["PRMNNT_PRCL_ID", "PRCL_STTS_CD"])
+    Returns:
+    - pd.Dataframe: The columns read from the file.
+    """
+    if csv_engine == "c":
+        return pd.read_csv(file_path, usecols=usecols, dtype=dtype)
+
+    if csv_engine == "pyarrow":
+        table = pv.read_csv(
+            file_path,
+            read_options=pv.ReadOptions(use_threads=True),
+            convert_options=get_arrow_convert_options(usecols, dtype),
         )
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
 
-        print("Read file: 2_parcel.csv")
+    raise ValueError(f"Unknown CSV engine: {csv_engine}")
 
-        parcel_df = parcel_df.rename(
-            columns={"PRMNNT_PRCL_ID": "pid", "PRCL_STTS_CD": "parcel_status"}
-        )
 
-        # Filter parcel dataframe by valid_pid dataframe:
-        # Creating an index of PIDs inside parcel_df
-        parcel_df_index = parcel_df.set_index(["pid"]).index
+def read_ltsa_file_chunks(file_path, usecols, dtype, chunk_size, csv_engine="c"):
+    """
+    Reads the usecols columns of a raw LTSA file in chunks of about chunk_size rows, so the whole file is never held in
+    memory. Rows keep their position in the file as their index, as they do with read_ltsa_file.
 
-        # Updating parcel_df to only include rows with PIDs included in valid_pid_df
-        parcel_df = parcel_df[parcel_df_index.isin(valid_pid_df_index)]
+    Parameters:
+    - file_path (str): Path of the LTSA CSV file.
+    - usecols (list): Columns to read.
+    - dtype (dict): Column types, by column name.
+    - chunk_size (int): Number of rows in each chunk. The "pyarrow" engine yields whole record batches, so its chunks
+      can run over by up to one batch.
+    - csv_engine (str, optional): "c" or "pyarrow". Default is "c".
+
+    Yields:
+    - pd.Dataframe: The next chunk of the file.
+    """
+    if csv_engine == "c":
+        yield from pd.read_csv(
+            file_path, usecols=usecols, dtype=dtype, chunksize=chunk_size
+        )
+        return
 
-        print(f"Filtered data from 2_parcel.csv")
+    if csv_engine != "pyarrow":
+        raise ValueError(f"Unknown CSV engine: {csv_engine}")
 
-        parcel_df.to_csv(output_directory + "parcel_raw.csv", index=False)
-        print(f"Wrote raw LTSA data to file: {output_directory+'parcel_raw.csv'}")
+    reader = pv.open_csv(
+        file_path, convert_options=get_arrow_convert_options(usecols, dtype)
+    )
+    start_row = 0
+    batches = []
+    batch_rows = 0
+    # A final None flushes the batches left over at the end of the file
+    for batch in itertools.chain(reader, [None]):
+        if batch is not None:
+            batches.append(batch)
+            batch_rows += len(batch)
+            if batch_rows < chunk_size:
+                continue
+        if not batches:
+            break
+
+        chunk = pa.Table.from_batches(batches).to_pandas(types_mapper=pd.ArrowDtype)
+        chunk.index = pd.RangeIndex(start_row, start_row + len(chunk))
+        start_row += len(chunk)
+        batches = []
+        batch_rows = 0
+        yield chunk
+
+
+def load_ltsa_file(
+    file_path,
+    usecols,
+    dtype,
+    required_columns,
+    csv_engine="c",
+    replacements=None,
+    chunk_size=None,
+    key_columns=None,
+    keys_future=None,
+):
+    """
+    Reads and normalizes a raw LTSA file, and drops rows missing any of required_columns. With a chunk_size, the file
+    is streamed in chunks and each chunk is filtered against the keys from keys_future as soon as it is read, so only
+    the rows that survive are kept in memory.
 
-        # 3_titleparcel.csv
-        title_parcel_df = (
-            pd.read_csv(
-                input_directory + "3_titleparcel.csv",
-                usecols=["TITLE_NMBR", "LTB_DISTRICT_CD", "PRMNNT_PRCL_ID"],
-                dtype={
-                    "TITLE_NMBR": str,
-                    "LTB_DISTRICT_CD": str,
-                    "PRMNNT_PRCL_ID": str,
-                },
-            )
-            .applymap(lambda x: x.strip() if isinstance(x, str) else x)
-            .replace("", None)
-            .replace(np.nan, None)
-            .dropna(subset=["TITLE_NMBR", "LTB_DISTRICT_CD", "PRMNNT_PRCL_ID"])
-        )
-        print("Read file: 3_titleparcel.csv")
+    Parameters:
+    - file_path (str): Path of the LTSA CSV file.
+    - usecols (list): Columns to read.
+    - dtype (dict): Column types, by column name.
+    - required_columns (list): Columns a row must have a value in to be kept.
+    - csv_engine (str, optional): "c" or "pyarrow". Default is "c".
+    - replacements (dict, optional): Substrings to replace, mapped to their replacements. Default is None.
+    - chunk_size (int, optional): Number of rows to read at a time. Default is None, the whole file is read at once.
+    - key_columns (list, optional): Columns to match against the keys when streaming. Default is None.
+    - keys_future (concurrent.futures.Future, optional): Future of the pd.Index of keys a streamed row must match to be
+      kept. Default is None.
 
-        title_parcel_df = title_parcel_df.rename(
-            columns={
-                "TITLE_NMBR": "title_number",
-                "LTB_DISTRICT_CD": "land_title_district",
-                "PRMNNT_PRCL_ID": "pid",
-            }
+    Returns:
+    - pd.Dataframe: The normalized rows of the file.
+    """
+    file_name = os.path.basename(file_path)
+    if chunk_size is None:
+        dataframe = (
+            read_ltsa_file(file_path, usecols, dtype, csv_engine)
+            .pipe(normalize_ltsa_columns, file_name, replacements)
+            .dropna(subset=required_columns)
         )
+    else:
+        filtered_chunks = []
+        for chunk in read_ltsa_file_chunks(
+            file_path, usecols, dtype, chunk_size, csv_engine
+        ):
+            chunk = normalize_ltsa_columns(chunk, file_name, replacements).dropna(
+                subset=required_columns
+            )
+            chunk_index = chunk.set_index(key_columns).index
+            filtered_chunks.append(chunk[chunk_index.isin(keys_future.result())])
 
-        # Filter titleparcel dataframe by valid_pid dataframe:
-        # Creating list of columns in title_parcel_df
-        title_parcel_df_keys = list(title_parcel_df.columns.values)
+        if filtered_chunks:
+            dataframe = pd.concat(filtered_chunks)
+        else:
+            dataframe = pd.DataFrame(columns=usecols)
+    print(f"Read file: {file_name}")
 
-        # Creating index of PIDs inside of title_parcel_df
-        title_parcel_df_index = title_parcel_df.set_index(["pid"]).index
+    return dataframe
 
-        # Updating title_parcel_df to only include rows with PIDs included in valid_pid_df
-        title_parcel_df = title_parcel_df[
-            title_parcel_df_index.isin(valid_pid_df_index)
-        ]
 
-        print(f"Filtered data from 3_titleparcel.csv")
+def normalize_ltsa_columns(dataframe, file_name, replacements=None):
+    """
+    Trims whitespace from every value of a raw LTSA dataframe, applies character replacements, and converts empty
+    strings to null. Each column is normalized with Arrow compute kernels in one pass and replaced in place.
 
-        title_parcel_df.to_csv(output_directory + "titleparcel_raw.csv", index=False)
-        print(f"Wrote raw LTSA data to file: {output_directory+'titleparcel_raw.csv'}")
+    Parameters:
+    - dataframe (pd.Dataframe): The dataframe read from an LTSA file.
+    - file_name (str): Name of the LTSA file, for logging.
+    - replacements (dict, optional): Substrings to replace, mapped to their replacements. Default is None.
 
-        # 1_title.csv
-        title_df = (
-            pd.read_csv(
+    Returns:
+    - dataframe (pd.Dataframe): The normalized dataframe, with None for missing values. Arrow-backed columns stay
+      Arrow-backed.
+    """
+    normalize_start_time = time.time()
+
+    for column in dataframe.columns:
+        values = pa.array(dataframe[column], type=pa.string(), from_pandas=True)
+        values = pc.utf8_trim_whitespace(values)
+        for pattern, replacement in (replacements or {}).items():
+            values = pc.replace_substring(values, pattern, replacement)
+        values = pc.if_else(
+            pc.equal(values, ""), pa.scalar(None, type=pa.string()), values
+        )
+        if isinstance(dataframe[column].dtype, pd.ArrowDtype):
+            dataframe[column] = pd.arrays.ArrowExtensionArray(values)
+        else:
+            dataframe[column] = values.to_numpy(zero_copy_only=False)
+
+    normalize_elapsed_time = time.time() - normalize_start_time
+    print(
+        f"Normalized file: {file_name}. Elapsed Time: {normalize_elapsed_time:.2f} seconds"
+    )
+
+    return dataframe
+
+
+def parse_ltsa_files(
+    input_directory,
+    output_directory,
+    data_rules_url,
+    engine,
+    write_files=True,
+    output_format="csv",
+    table_queue=None,
+    profile_cleaning=False,
+    cleaning_cache_directory=None,
+    cleaning_cache_max_entries=1000000,
+    csv_engine="c",
+    titleowner_chunk_size=None,
+):
+    """
+    Reads raw LTSA files to CSVs and writes them to output_directory. Writes processed and cleaned data to active_pin.csv.
+
+    Parameters:
+    - input_directory (str): Directory to read LTSA CSV files from.
+    - output_directory (str): Directory to write CSV files to.
+    - data_rules_url (str): URL to data_rules.json file hosted on github.
+    - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+    - write_files (bool, optional): Write the parsed dataframes to files in output_directory. Default is True.
+    - output_format (str, optional): "csv", "parquet" or "arrow", the format of the files. Default is "csv".
+    - table_queue (queue.Queue, optional): Queue to put each (table name, dataframe) pair on as soon as the table is
+      parsed, so it can be written while parsing continues. Default is None.
+    - profile_cleaning (bool, optional): Time each cleaning rule in its own pass. Default is False.
+    - cleaning_cache_directory (str, optional): Directory to keep the normalization cache of cleaned active_pin values
+      in between runs. Default is None.
+    - cleaning_cache_max_entries (int, optional): Maximum number of values cached for each column. Default is 1000000.
+    - csv_engine (str, optional): "c" or "pyarrow", the parser used to read the LTSA files. Default is "c".
+    - titleowner_chunk_size (int, optional): Stream 4_titleowner.csv in chunks of this many rows, keeping only rows
+      whose title is in titleparcel_raw. Default is None, the whole file is read at once.
+
+    Returns:
+    - dict: Parsed dataframes by table name, for postgres_writer to write without reading the CSV files back.
+    """
+    read_executor = None
+    try:
+        # Read, process, and write CSV files
+        read_files_start_time = time.time()
+
+        # Read valid_pid table and the four LTSA files concurrently, each step below waits only for what it filters
+        read_executor = ThreadPoolExecutor(max_workers=5)
+        title_parcel_keys_future = Future()
+        valid_pid_future = read_executor.submit(
+            pd.read_sql_table, "valid_pid", engine, columns=["pid"]
+        )
+        ltsa_file_futures = {
+            "2_parcel.csv": read_executor.submit(
+                load_ltsa_file,
+                input_directory + "2_parcel.csv",
+                usecols=["PRMNNT_PRCL_ID", "PRCL_STTS_CD"],
+                dtype={"PRMNNT_PRCL_ID": str, "PRCL_STTS_CD": str},
+                required_columns=["PRMNNT_PRCL_ID", "PRCL_STTS_CD"],
+                csv_engine=csv_engine,
+            ),
+            "3_titleparcel.csv": read_executor.submit(
+                load_ltsa_file,
+                input_directory + "3_titleparcel.csv",
+                usecols=["TITLE_NMBR", "LTB_DISTRICT_CD", "PRMNNT_PRCL_ID"],
+                dtype={
+                    "TITLE_NMBR": str,
+                    "LTB_DISTRICT_CD": str,
+                    "PRMNNT_PRCL_ID": str,
+                },
+                required_columns=["TITLE_NMBR", "LTB_DISTRICT_CD", "PRMNNT_PRCL_ID"],
+                csv_engine=csv_engine,
+            ),
+            "1_title.csv": read_executor.submit(
+                load_ltsa_file,
                 input_directory + "1_title.csv",
                 usecols=[
                     "TITLE_NMBR",
@@ -257,51 +990,11 @@ def parse_ltsa_files(input_directory, output_directory, data_rules_url, engine):
                     "FRM_TTL_NMBR": str,
                     "FRM_LT_DISTRICT_CD": str,
                 },
-            )
-            .applymap(lambda x: x.strip() if isinstance(x, str) else x)
-            .replace("", None)
-            .replace(np.nan, None)
-            .dropna(subset=["TITLE_NMBR", "LTB_DISTRICT_CD", "TTL_STTS_CD"])
-        )
-        print("Read file: 1_title.csv")
-
-        title_df.rename(
-            columns={
-                "TITLE_NMBR": "title_number",
-                "LTB_DISTRICT_CD": "land_title_district",
-                "TTL_STTS_CD": "title_status",
-                "FRM_TTL_NMBR": "from_title_number",
-                "FRM_LT_DISTRICT_CD": "from_land_title_district",
-            },
-            inplace=True,
-        )
-
-        # Filter title dataframe by title_parcel dataframe:
-
-        title_parcel_df_keys.remove("pid")
-
-        # Creating multiIndex of title numbers and land title districts inside of title_df
-        title_df_index = title_df.set_index(title_parcel_df_keys).index
-
-        # Creating title_parcel_df without "pid" column
-        title_parcel_without_pid_df = title_parcel_df.drop(["pid"], axis=1)
-
-        # Creating multiIndex of valid title numbers and valid land title districts
-        title_parcel_df_without_pid_index = title_parcel_without_pid_df.set_index(
-            title_parcel_df_keys
-        ).index
-
-        # Updating title_df to only include rows with valid title numbers and valid land title districts included in title_parcel_df
-        title_df = title_df[title_df_index.isin(title_parcel_df_without_pid_index)]
-
-        print(f"Filtered data from 1_title.csv")
-
-        title_df.to_csv(output_directory + "title_raw.csv", index=False)
-        print(f"Wrote raw ltsa data to file: {output_directory+'title_raw.csv'}")
-
-        # 4_titleowner.csv
-        title_owner_df = (
-            pd.read_csv(
+                required_columns=["TITLE_NMBR", "LTB_DISTRICT_CD", "TTL_STTS_CD"],
+                csv_engine=csv_engine,
+            ),
+            "4_titleowner.csv": read_executor.submit(
+                load_ltsa_file,
                 input_directory + "4_titleowner.csv",
                 usecols=[
                     "TITLE_NMBR",
@@ -335,15 +1028,132 @@ def parse_ltsa_files(input_directory, output_directory, data_rules_url, engine):
                     "ADDRS_CNTRY": str,
                     "ADDRS_PSTL_CD": str,
                 },
+                required_columns=["TITLE_NMBR", "LTB_DISTRICT_CD"],
+                csv_engine=csv_engine,
+                replacements={"'": "`"},
+                chunk_size=titleowner_chunk_size,
+                key_columns=["TITLE_NMBR", "LTB_DISTRICT_CD"],
+                keys_future=title_parcel_keys_future,
+            ),
+        }
+
+        # Read valid_pid table from database and create dataframe
+        valid_pid_df = valid_pid_future.result()
+
+        # Parse PIDs once into a sorted array of integers to filter the LTSA files with
+        valid_pids, is_parsed = parse_pids(valid_pid_df["pid"])
+        valid_pids = np.unique(valid_pids[is_parsed])
+        print("Read table: valid_pid")
+
+        # 2_parcel.csv
+        parcel_df = ltsa_file_futures["2_parcel.csv"].result()
+
+        parcel_df = parcel_df.rename(
+            columns={"PRMNNT_PRCL_ID": "pid", "PRCL_STTS_CD": "parcel_status"}
+        )
+
+        # Updating parcel_df to only include rows with PIDs included in valid_pid_df
+        parcel_df = filter_valid_pids(parcel_df, valid_pids)
+
+        print(f"Filtered data from 2_parcel.csv")
+
+        # PIDs stay integers for the joins, and are formatted as text only for output
+        parcel_raw_df = format_raw_pids(parcel_df)
+
+        # Hand the table to the database writer while parsing continues
+        if table_queue is not None:
+            table_queue.put(("parcel_raw", parcel_raw_df))
+
+        if write_files:
+            file_path = write_processed_file(
+                parcel_raw_df, output_directory, "parcel_raw", output_format
+            )
+            print(f"Wrote raw LTSA data to file: {file_path}")
+
+        # 3_titleparcel.csv
+        title_parcel_df = ltsa_file_futures["3_titleparcel.csv"].result()
+
+        title_parcel_df = title_parcel_df.rename(
+            columns={
+                "TITLE_NMBR": "title_number",
+                "LTB_DISTRICT_CD": "land_title_district",
+                "PRMNNT_PRCL_ID": "pid",
+            }
+        )
+
+        # Filter titleparcel dataframe by valid_pid dataframe:
+        # Creating list of columns in title_parcel_df
+        title_parcel_df_keys = list(title_parcel_df.columns.values)
+
+        # Updating title_parcel_df to only include rows with PIDs included in valid_pid_df
+        title_parcel_df = filter_valid_pids(title_parcel_df, valid_pids)
+
+        print(f"Filtered data from 3_titleparcel.csv")
+
+        # Filter title dataframe by title_parcel dataframe:
+
+        title_parcel_df_keys.remove("pid")
+
+        # Creating multiIndex of valid title numbers and valid land title districts, handed to the streaming
+        # 4_titleowner.csv read before waiting on 1_title.csv, which it does not need
+        try:
+            title_parcel_df_without_pid_index = (
+                title_parcel_df.drop(["pid"], axis=1)
+                .set_index(title_parcel_df_keys)
+                .index
             )
-            .applymap(lambda x: x.strip() if isinstance(x, str) else x)
-            .applymap(lambda x: x.replace("'", "`") if isinstance(x, str) else x)
-            .replace("", None)
-            .replace(np.nan, None)
-            .dropna(subset=["TITLE_NMBR", "LTB_DISTRICT_CD"])
+        except Exception as keys_error:
+            title_parcel_keys_future.set_exception(keys_error)
+            raise
+        title_parcel_keys_future.set_result(title_parcel_df_without_pid_index)
+
+        title_parcel_raw_df = format_raw_pids(title_parcel_df)
+
+        if table_queue is not None:
+            table_queue.put(("titleparcel_raw", title_parcel_raw_df))
+
+        if write_files:
+            file_path = write_processed_file(
+                title_parcel_raw_df,
+                output_directory,
+                "titleparcel_raw",
+                output_format,
+            )
+            print(f"Wrote raw LTSA data to file: {file_path}")
+
+        # 1_title.csv
+        title_df = ltsa_file_futures["1_title.csv"].result()
+
+        title_df.rename(
+            columns={
+                "TITLE_NMBR": "title_number",
+                "LTB_DISTRICT_CD": "land_title_district",
+                "TTL_STTS_CD": "title_status",
+                "FRM_TTL_NMBR": "from_title_number",
+                "FRM_LT_DISTRICT_CD": "from_land_title_district",
+            },
+            inplace=True,
         )
 
-        print("Read file: 4_titleowner.csv")
+        # Creating multiIndex of title numbers and land title districts inside of title_df
+        title_df_index = title_df.set_index(title_parcel_df_keys).index
+
+        # Updating title_df to only include rows with valid title numbers and valid land title districts included in title_parcel_df
+        title_df = title_df[title_df_index.isin(title_parcel_df_without_pid_index)]
+
+        print(f"Filtered data from 1_title.csv")
+
+        if table_queue is not None:
+            table_queue.put(("title_raw", title_df))
+
+        if write_files:
+            file_path = write_processed_file(
+                title_df, output_directory, "title_raw", output_format
+            )
+            print(f"Wrote raw ltsa data to file: {file_path}")
+
+        # 4_titleowner.csv
+        title_owner_df = ltsa_file_futures["4_titleowner.csv"].result()
 
         print(f"Filtered data from 4_titleowner.csv")
 
@@ -375,11 +1185,22 @@ def parse_ltsa_files(input_directory, output_directory, data_rules_url, engine):
             title_owner_df_index.isin(title_parcel_df_without_pid_index)
         ]
 
-        title_owner_df.to_csv(output_directory + "titleowner_raw.csv", index=False)
-        read_files_elapsed_time = time.time() - read_files_start_time
-        print(
-            f"Wrote raw LTSA data to file: {output_directory+'titleowner_raw.csv'}. Elapsed Time: {read_files_elapsed_time:.2f} seconds"
-        )
+        if table_queue is not None:
+            table_queue.put(("titleowner_raw", title_owner_df))
+
+        if write_files:
+            file_path = write_processed_file(
+                title_owner_df, output_directory, "titleowner_raw", output_format
+            )
+            read_files_elapsed_time = time.time() - read_files_start_time
+            print(
+                f"Wrote raw LTSA data to file: {file_path}. Elapsed Time: {read_files_elapsed_time:.2f} seconds"
+            )
+        else:
+            read_files_elapsed_time = time.time() - read_files_start_time
+            print(
+                f"Read raw LTSA data. Elapsed Time: {read_files_elapsed_time:.2f} seconds"
+            )
 
         # Join dataframes
         parse_files_start_time = time.time()
@@ -403,16 +1224,11 @@ def parse_ltsa_files(input_directory, output_directory, data_rules_url, engine):
         print(f"Number of rows in active_pin_df: {len(active_pin_df)}")
 
         # Group by title number to get a list of active pids associated with each title
-        titlenumber_pids_df = (
-            active_pin_df.groupby(["title_number", "land_title_district"])["pid"]
-            .apply(list)
-            .reset_index(name="pids")
+        titlenumber_pids_df = group_pids(
+            active_pin_df, ["title_number", "land_title_district"]
         )
         print("Grouped dataframe created: titlenumber_pids_df")
 
-        # Format PIDs as strings
-        titlenumber_pids_df["pids"] = titlenumber_pids_df["pids"].apply(pid_parser)
-
         # Merge dataframes to add in PIDs column and drop duplicate rows
         active_pin_df = pd.merge(
             active_pin_df,
@@ -432,13 +1248,52 @@ def parse_ltsa_files(input_directory, output_directory, data_rules_url, engine):
             f"Data parsing complete. Elapsed Time: {parse_files_elapsed_time:.2f} seconds"
         )
 
-        clean_active_pin_df(active_pin_df, output_directory, data_rules_url)
+        active_pin_df = clean_active_pin_df(
+            active_pin_df,
+            output_directory,
+            data_rules_url,
+            write_files,
+            output_format,
+            profile_cleaning,
+            cleaning_cache_directory,
+            cleaning_cache_max_entries,
+        )
+        if table_queue is not None:
+            table_queue.put(("active_pin", active_pin_df))
+
+        return {
+            "title_raw": title_df,
+            "parcel_raw": parcel_raw_df,
+            "titleparcel_raw": title_parcel_raw_df,
+            "titleowner_raw": title_owner_df,
+            "active_pin": active_pin_df,
+        }
 
     except Exception as e:
         raise e
 
-
-def run(input_directory, output_directory, data_rules_url, engine):
+    finally:
+        if read_executor is not None:
+            # A streaming read still waiting for the title_parcel keys stops instead of waiting forever
+            title_parcel_keys_future.cancel()
+            read_executor.shutdown(cancel_futures=True)
+
+
+def run(
+    input_directory,
+    output_directory,
+    data_rules_url,
+    engine,
+    write_files=True,
+    output_format="csv",
+    table_queue=None,
+    profile_cleaning=False,
+    cleaning_cache_directory=None,
+    cleaning_cache_max_entries=1000000,
+    csv_engine="c",
+    csv_read_threads=None,
+    titleowner_chunk_size=None,
+):
     """
     Reads raw LTSA files to CSVs and writes them to output_directory. Writes processed and cleaned data to active_pin.csv.
 
@@ -447,18 +1302,47 @@ def run(input_directory, output_directory, data_rules_url, engine):
     - output_directory (str): Directory to write CSV files to.
     - data_rules_url (str): URL to data_rules.json file hosted on github.
     - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+    - write_files (bool, optional): Write the parsed dataframes to files in output_directory. Default is True.
+    - output_format (str, optional): "csv", "parquet" or "arrow", the format of the files. Default is "csv".
+    - table_queue (queue.Queue, optional): Queue to put each (table name, dataframe) pair on as soon as the table is
+      parsed, so it can be written while parsing continues. Default is None.
+    - profile_cleaning (bool, optional): Time each cleaning rule in its own pass. Default is False.
+    - cleaning_cache_directory (str, optional): Directory to keep the normalization cache of cleaned active_pin values
+      in between runs. Default is None.
+    - cleaning_cache_max_entries (int, optional): Maximum number of values cached for each column. Default is 1000000.
+    - csv_engine (str, optional): "c" or "pyarrow", the parser used to read the LTSA files. Default is "c".
+    - csv_read_threads (int, optional): Size of Arrow's thread pool for the "pyarrow" engine, such as the pod's CPU
+      limit. Default is None, Arrow's default of one thread per core.
+    - titleowner_chunk_size (int, optional): Stream 4_titleowner.csv in chunks of this many rows, keeping only rows
+      whose title is in titleparcel_raw. Default is None, the whole file is read at once.
 
     Returns:
-    - None
+    - dict: Parsed dataframes by table name.
     """
     try:
         start_time = time.time()
 
-        if not os.path.exists(output_directory):
+        if csv_read_threads:
+            pa.set_cpu_count(csv_read_threads)
+
+        if write_files and not os.path.exists(output_directory):
             os.makedirs(output_directory)
 
         # Parse the files
-        parse_ltsa_files(input_directory, output_directory, data_rules_url, engine)
+        dataframes = parse_ltsa_files(
+            input_directory,
+            output_directory,
+            data_rules_url,
+            engine,
+            write_files,
+            output_format,
+            table_queue,
+            profile_cleaning,
+            cleaning_cache_directory,
+            cleaning_cache_max_entries,
+            csv_engine,
+            titleowner_chunk_size,
+        )
 
         end_time = time.time()
         total_time = end_time - start_time
@@ -467,6 +1351,8 @@ def run(input_directory, output_directory, data_rules_url, engine):
             f"All files parsed and cleaned. Total time elapsed: {total_time:.2f} seconds"
         )
 
+        return dataframes
+
     except Exception as e:
         print(f"Error parsing LTSA data: {str(e)}")
         raise e
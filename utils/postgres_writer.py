@@ -1,11 +1,40 @@
+import csv
+import io
+import re
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 import numpy as np
 import pandas as pd
-from sqlalchemy import text, create_engine, func, select
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import text, create_engine
+from sqlalchemy.engine import Connection
 import time
 import psycopg2
 import os
 
 
+@contextmanager
+def transaction(engine):
+    """
+    Begins a transaction on an engine, or a savepoint when given a connection that is already inside a transaction.
+
+    Parameters:
+    - engine (sqlalchemy.engine.base.Engine or sqlalchemy.engine.base.Connection): Engine, or connection of an atomic load.
+
+    Yields:
+    - sqlalchemy.engine.base.Connection: Connection to execute statements on.
+    """
+    if isinstance(engine, Connection):
+        with engine.begin_nested():
+            yield engine
+    else:
+        with engine.begin() as conn:
+            yield conn
+
+
 def insert_postgres_table_if_rows_not_exist(
     dataframe, table_name, engine, unique_key_columns
 ):
@@ -19,7 +48,7 @@ def insert_postgres_table_if_rows_not_exist(
     - unique_key_columns (list): Columns that will prevent data insert on conflict.
 
     Returns:
-    - None (or Error)
+    - int: The number of rows inserted, excluding rows skipped on conflict.
     """
     try:
         # Create a list of column names as a comma-separated string
@@ -43,184 +72,1865 @@ def insert_postgres_table_if_rows_not_exist(
         insert_sql = f"INSERT INTO {table_name} ({column_names}) VALUES {data_to_insert} ON CONFLICT ({', '.join(unique_key_columns)}) DO NOTHING;"
 
         # Execute the SQL statement with parameter binding
-        with engine.begin() as conn:
-            conn.execute(text(insert_sql))
+        with transaction(engine) as conn:
+            result = conn.execute(text(insert_sql))
+
+        return result.rowcount
 
     except Exception as e:
         print(e)
         raise e
 
 
-def get_row_count(table_name, engine):
+def copy_postgres_table_if_rows_not_exist(
+    dataframe, table_name, engine, unique_key_columns
+):
     """
-    Counts number of rows in database table.
+    Inserts non-duplicate rows into PostgreSQL table by streaming them with COPY into a staging table.
 
     Parameters:
+    - dataframe (pd.DataFrame): The DataFrame to be written.
     - table_name (str): The name of the PostgreSQL table.
     - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+    - unique_key_columns (list): Columns that will prevent data insert on conflict.
 
     Returns:
-    - int:  The total number of rows in the table.
+    - int: The number of rows inserted, excluding rows skipped on conflict.
     """
     try:
-        query = select(func.count()).select_from(text(table_name))
-        conn = engine.connect()
-        totalCount = conn.execute(query).fetchone()[0]
-        return totalCount
+        # Create a list of column names as a comma-separated string
+        column_names = ", ".join(dataframe.columns)
+        staging_table_name = f"{table_name}_staging"
+
+        # Staging table only holds the loaded columns. It is dropped explicitly because a savepoint does not end the transaction
+        create_staging_sql = f"CREATE TEMP TABLE {staging_table_name} ON COMMIT DROP AS SELECT {column_names} FROM {table_name} WITH NO DATA;"
+        insert_sql = f"INSERT INTO {table_name} ({column_names}) SELECT {column_names} FROM {staging_table_name} ON CONFLICT ({', '.join(unique_key_columns)}) DO NOTHING;"
+
+        with transaction(engine) as conn:
+            conn.execute(text(create_staging_sql))
+            copy_dataframe_to_table(dataframe, staging_table_name, conn)
+            result = conn.execute(text(insert_sql))
+            conn.execute(text(f"DROP TABLE {staging_table_name};"))
+
+        return result.rowcount
 
     except Exception as e:
+        print(e)
         raise e
 
 
-def write_dataframe_to_postgres(
-    dataframe,
-    table_name,
-    engine,
-    etl_job_id,
-    tables_with_etl_log_foreign_key,
-    batch_size=1000,
+def copy_dataframe_to_table(dataframe, table_name, conn):
+    """
+    Streams a DataFrame into a PostgreSQL table with COPY FROM STDIN.
+
+    Parameters:
+    - dataframe (pd.DataFrame): The DataFrame to be written.
+    - table_name (str): The name of the PostgreSQL table.
+    - conn (sqlalchemy.engine.base.Connection): Open connection to run COPY on.
+
+    Returns:
+    - None (or Error)
+    """
+    try:
+        column_names = ", ".join(dataframe.columns)
+
+        # Serialize the DataFrame as CSV, quoting every value so empty strings are not loaded as NULL
+        csv_buffer = io.StringIO()
+        dataframe.to_csv(csv_buffer, index=False, header=False, quoting=csv.QUOTE_ALL)
+        csv_buffer.seek(0)
+
+        copy_sql = f"COPY {table_name} ({column_names}) FROM STDIN WITH (FORMAT csv)"
+        cursor = conn.connection.cursor()
+        cursor.copy_expert(copy_sql, csv_buffer)
+
+    except Exception as e:
+        raise e
+
+
+def copy_shard_to_staging_table(
+    shard, shard_number, staging_table_name, engine, batch_size
 ):
     """
-    Write a DataFrame to a PostgreSQL table in batches.
+    Copies one shard of a DataFrame into a shared staging table in batches, printing progress.
+
+    Parameters:
+    - shard (pd.DataFrame): The slice of the DataFrame to be written.
+    - shard_number (int): Number of the shard, used in progress messages.
+    - staging_table_name (str): The name of the PostgreSQL staging table.
+    - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+    - batch_size (int): Number of rows to write in each batch.
+
+    Returns:
+    - int: The number of rows copied into the staging table.
+    """
+    try:
+        rows_copied = 0
+        for i in range(0, len(shard), batch_size):
+            batch = shard[i : i + batch_size]
+            with engine.begin() as conn:
+                copy_dataframe_to_table(batch, staging_table_name, conn)
+            rows_copied += len(batch)
+            print(f"Shard {shard_number}: staged {rows_copied}/{len(shard)} rows")
+
+        return rows_copied
+
+    except Exception as e:
+        raise e
+
+
+def load_dataframe_in_parallel(
+    dataframe, table_name, engine, unique_key_columns, batch_size=1000, workers=4
+):
+    """
+    Loads a DataFrame into a PostgreSQL table by copying shards into an unlogged staging table over
+    several connections at once, then inserting non-duplicate rows in a single transaction.
+
+    The target table is only touched by the final INSERT ... SELECT, so either all rows of the table are
+    loaded or none are.
 
     Parameters:
     - dataframe (pd.DataFrame): The DataFrame to be written.
     - table_name (str): The name of the PostgreSQL table.
     - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+    - unique_key_columns (list): Columns that will prevent data insert on conflict.
     - batch_size (int, optional): Number of rows to write in each batch. Default is 1000.
+    - workers (int, optional): Number of shards loaded at the same time. Default is 4.
 
     Returns:
-    - int: The total number of rows inserted into the table.
+    - int: The number of rows inserted, excluding rows skipped on conflict.
     """
-    total_rows_inserted = 0  # Initialize the total count of rows inserted
+    column_names = ", ".join(dataframe.columns)
+    staging_table_name = f"{table_name}_staging_{uuid.uuid4().hex[:8]}"
+
     try:
-        # Print the table being updated
-        print(f"Updating table '{table_name}'...")
+        create_staging_sql = f"CREATE UNLOGGED TABLE {staging_table_name} AS SELECT {column_names} FROM {table_name} WITH NO DATA;"
+        with engine.begin() as conn:
+            conn.execute(text(create_staging_sql))
 
-        rows_before_insert = get_row_count(table_name, engine)
-        dataframe = dataframe.replace(np.nan, "")
-        unique_key_columns = dataframe.columns.tolist()
+        # Split the dataframe into one shard per worker
+        shard_size = -(-len(dataframe) // workers)
+        shards = [
+            dataframe[i : i + shard_size]
+            for i in range(0, len(dataframe), max(shard_size, 1))
+        ]
 
-        if table_name in tables_with_etl_log_foreign_key:
-            dataframe["etl_log_id"] = str(etl_job_id)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    copy_shard_to_staging_table,
+                    shard,
+                    shard_number,
+                    staging_table_name,
+                    engine,
+                    batch_size,
+                )
+                for shard_number, shard in enumerate(shards, start=1)
+            ]
+            # Raises the first shard error, if any, before the target table is touched
+            for future in futures:
+                future.result()
 
-        # Split the dataframe into batches
-        batches = [
-            dataframe[i : i + batch_size] for i in range(0, len(dataframe), batch_size)
-        ]
+        insert_sql = f"INSERT INTO {table_name} ({column_names}) SELECT {column_names} FROM {staging_table_name} ON CONFLICT ({', '.join(unique_key_columns)}) DO NOTHING;"
+        with engine.begin() as conn:
+            result = conn.execute(text(insert_sql))
 
-        # Define the columns that make up the unique key --all columns
+        return result.rowcount
 
-        for batch in batches:
-            update_response = insert_postgres_table_if_rows_not_exist(
-                batch, table_name, engine, unique_key_columns
-            )
-            if update_response:
-                print(update_response)
+    except Exception as e:
+        print(e)
+        raise e
 
-        print("Table updated")
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {staging_table_name};"))
+
+
+def compute_row_hash(dataframe):
+    """
+    Computes a 128-bit content hash of every row, used as a compact deduplication key.
+
+    Parameters:
+    - dataframe (pd.DataFrame): The DataFrame to be hashed.
+
+    Returns:
+    - pd.Series: 32 character hex digest of each row.
+    """
+    try:
+        # Hash the text form of each value, as read from text files, so the digest does not depend on dtypes
+        values = dataframe.fillna("").astype(str)
+
+        # Two independently keyed 64-bit hashes make up the 128-bit digest
+        digest = np.empty((len(values), 2), dtype=">u8")
+        digest[:, 0] = pd.util.hash_pandas_object(
+            values, index=False, hash_key="bcpvsetlrowhash1"
+        ).to_numpy()
+        digest[:, 1] = pd.util.hash_pandas_object(
+            values, index=False, hash_key="bcpvsetlrowhash2"
+        ).to_numpy()
 
-        rows_after_insert = get_row_count(table_name, engine)
-        total_rows_inserted = rows_after_insert - rows_before_insert
+        # Format the digest bytes as hex without a Python call per row
+        hex_digits = np.array([f"{byte:02x}" for byte in range(256)])
+        row_hash = hex_digits[digest.view(np.uint8)].view("<U32").ravel()
 
-        return total_rows_inserted  # Return the total count of rows inserted
+        return pd.Series(row_hash, index=dataframe.index, dtype=object)
 
     except Exception as e:
         raise e
 
 
-def run(
-    input_directory,
-    etl_job_id,
-    database_name,
-    batch_size=1000,
-    host="localhost",
-    port=5432,
-    user="your_username",
-    password="your_password",
+def is_partitioned_table(table_name, engine):
+    """
+    Checks whether a database table is partitioned.
+
+    Parameters:
+    - table_name (str): The name of the PostgreSQL table.
+    - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+
+    Returns:
+    - bool: True if the table is partitioned.
+    """
+    try:
+        select_sql = f"SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = '{table_name}')"
+        with transaction(engine) as conn:
+            return bool(conn.execute(text(select_sql)).scalar())
+
+    except Exception as e:
+        raise e
+
+
+def get_job_partition_name(table_name, etl_job_id):
+    """
+    Names the partition of a raw table holding the rows of one ETL job.
+
+    Parameters:
+    - table_name (str): The name of the partitioned PostgreSQL table.
+    - etl_job_id (UUID): Job_id from etl_log table.
+
+    Returns:
+    - str: The name of the partition.
+    """
+    return f"{table_name}_{uuid.UUID(str(etl_job_id)).hex}"
+
+
+def create_job_partition(
+    table_name, engine, etl_job_id, unlogged=False, detached=False
 ):
     """
-    Process files in a directory and write them to a PostgreSQL database.
+    Creates the partition of a raw table, partitioned by list of etl_log_id, that holds the rows of one ETL job.
 
     Parameters:
-    - input_directory (str): The path to the directory containing input files.
-    - database_name (str): The name of the PostgreSQL database.
-    - batch_size (int, optional): Number of rows to write in each batch. Default is 1000.
-    - host (str, optional): The database host. Default is "localhost".
-    - port (int, optional): The database port. Default is 5432.
-    - user (str, optional): The database username. Default is "your_username".
-    - password (str, optional): The database password. Default is "your_password".
+    - table_name (str): The name of the partitioned PostgreSQL table.
+    - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+    - etl_job_id (UUID): Job_id from etl_log table.
+    - unlogged (bool, optional): Create the partition unlogged, to be loaded without write-ahead logging and set
+      logged with set_table_logged afterwards. Default is False.
+    - detached (bool, optional): Create the partition as a standalone table with only the unique indexes of the table,
+      to be loaded and then attached with attach_job_partition. Default is False.
 
     Returns:
     - None
     """
     try:
-        # Create a connection to the PostgreSQL database
-        conn_str = f"postgresql://{user}:{password}@{host}:{port}/{database_name}"
-        engine = create_engine(conn_str)
+        partition_name = get_job_partition_name(table_name, etl_job_id)
+        create_sql = f"CREATE {'UNLOGGED ' if unlogged else ''}TABLE IF NOT EXISTS {partition_name} PARTITION OF {table_name} FOR VALUES IN ('{etl_job_id}');"
+        if detached:
+            create_sql = f"CREATE {'UNLOGGED ' if unlogged else ''}TABLE {partition_name} (LIKE {table_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);"
+        with transaction(engine) as conn:
+            if (
+                detached
+                and conn.execute(
+                    text(f"SELECT to_regclass('{partition_name}');")
+                ).scalar()
+            ):
+                return
+            conn.execute(text(create_sql))
+            # ON CONFLICT needs the unique indexes while the partition is loaded
+            if detached:
+                copy_table_indexes(table_name, partition_name, conn, unique=True)
 
-        # List all files in the input directory
-        file_list = [
-            f
-            for f in os.listdir(input_directory)
-            if (os.path.isfile(os.path.join(input_directory, f)) and f.endswith("csv"))
-        ]
+    except Exception as e:
+        raise e
 
-        table_statistics = []  # List to store table-wise statistics
 
-        start_time = time.time()  # Start measuring time
+def attach_job_partition(table_name, engine, etl_job_id):
+    """
+    Attaches a job partition created detached once it is loaded. Attaching builds the indexes of the table the
+    partition is missing, and checks its rows against the partition bound and foreign keys.
+
+    Parameters:
+    - table_name (str): The name of the partitioned PostgreSQL table.
+    - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+    - etl_job_id (UUID): Job_id from etl_log table.
+
+    Returns:
+    - None
+    """
+    try:
+        partition_name = get_job_partition_name(table_name, etl_job_id)
+        start_time = time.time()
+        with transaction(engine) as conn:
+            conn.execute(
+                text(
+                    f"ALTER TABLE {table_name} ATTACH PARTITION {partition_name} FOR VALUES IN ('{etl_job_id}');"
+                )
+            )
+        print(
+            f"Attached and indexed partition '{partition_name}' in {time.time() - start_time:.2f} seconds"
+        )
+
+    except Exception as e:
+        raise e
+
+
+def drop_job_partition(table_name, engine, etl_job_id, detach_only=False):
+    """
+    Removes the partition holding the rows of one ETL job from a raw table, in constant time.
+
+    Parameters:
+    - table_name (str): The name of the partitioned PostgreSQL table.
+    - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+    - etl_job_id (UUID): Job_id from etl_log table.
+    - detach_only (bool, optional): Keep the detached partition as a standalone table instead of dropping it. Default is False.
 
-        for file_name in file_list:
-            file_path = os.path.join(input_directory, file_name)
-            # Adjust for different file formats (e.g., pd.read_csv for CSV files)
-            if file_name == "active_pin.csv":
-                df = pd.read_csv(
-                    file_path,
-                    encoding="unicode_escape",
-                    low_memory=False,
-                    converters={"pids": str},
+    Returns:
+    - None
+    """
+    try:
+        partition_name = get_job_partition_name(table_name, etl_job_id)
+        with engine.begin() as conn:
+            if detach_only:
+                conn.execute(
+                    text(f"ALTER TABLE {table_name} DETACH PARTITION {partition_name};")
                 )
             else:
-                df = pd.read_csv(file_path, encoding="unicode_escape", low_memory=False)
-            # Use file name without extension as table name
-            table_name = os.path.splitext(file_name)[0]
-            tables_with_etl_log_foreign_key = [
-                "title_raw",
-                "parcel_raw",
-                "titleparcel_raw",
-                "titleowner_raw",
-            ]
+                conn.execute(text(f"DROP TABLE IF EXISTS {partition_name};"))
 
-            rows_inserted = write_dataframe_to_postgres(
-                df,
-                table_name,
-                engine,
-                etl_job_id,
-                tables_with_etl_log_foreign_key,
-                batch_size=batch_size,
-            )
-
-            elapsed_time = time.time() - start_time
-            table_statistics.append(
-                {
-                    "Table Name": table_name,
-                    "Rows Inserted": rows_inserted,
-                    "Elapsed Time (s)": elapsed_time,
-                }
+    except Exception as e:
+        raise e
+
+
+def apply_partition_retention(table_names, engine, retention_weeks, detach_only=False):
+    """
+    Detaches or drops raw table partitions of ETL jobs older than the retention period. The partitions of the most
+    recent successful job are always kept.
+
+    Parameters:
+    - table_names (list): Names of the partitioned PostgreSQL tables.
+    - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+    - retention_weeks (int): Number of weeks of snapshots to keep.
+    - detach_only (bool, optional): Keep detached partitions as standalone tables instead of dropping them. Default is False.
+
+    Returns:
+    - int: The number of partitions removed.
+    """
+    try:
+        expired_jobs_sql = f"""
+            SELECT job_id FROM etl_log
+            WHERE updated_at < now() - interval '{int(retention_weeks)} weeks'
+            AND job_id <> ALL (
+                SELECT job_id FROM etl_log WHERE status = 'Success' ORDER BY updated_at DESC LIMIT 1
+            )
+        """
+        with engine.connect() as conn:
+            expired_job_ids = [row[0] for row in conn.execute(text(expired_jobs_sql))]
+
+        partitions_removed = 0
+        for table_name in table_names:
+            partitions_sql = f"SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = '{table_name}'"
+            with engine.connect() as conn:
+                partition_names = {row[0] for row in conn.execute(text(partitions_sql))}
+
+            for job_id in expired_job_ids:
+                if get_job_partition_name(table_name, job_id) in partition_names:
+                    drop_job_partition(table_name, engine, job_id, detach_only)
+                    partitions_removed += 1
+
+        print(
+            f"{'Detached' if detach_only else 'Dropped'} {partitions_removed} raw table partitions older than {retention_weeks} weeks"
+        )
+        return partitions_removed
+
+    except Exception as e:
+        raise e
+
+
+def get_secondary_indexes(table_name, engine):
+    """
+    Finds the indexes of a table that are not needed while loading it: every index except the primary key and the
+    unique and exclusion indexes that ON CONFLICT relies on.
+
+    Parameters:
+    - table_name (str): The name of the PostgreSQL table.
+    - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+
+    Returns:
+    - list: (index name, index definition) tuples.
+    """
+    try:
+        select_sql = f"""
+            SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = '{table_name}'::regclass
+            AND NOT i.indisprimary AND NOT i.indisunique AND NOT i.indisexclusion
+            AND NOT EXISTS (SELECT 1 FROM pg_constraint k WHERE k.conindid = i.indexrelid)
+            ORDER BY c.relname
+        """
+        with transaction(engine) as conn:
+            return [tuple(row) for row in conn.execute(text(select_sql))]
+
+    except Exception as e:
+        raise e
+
+
+def drop_indexes(indexes, engine):
+    """
+    Drops indexes so a bulk load does not have to maintain them row by row.
+
+    Parameters:
+    - indexes (list): (index name, index definition) tuples, as returned by get_secondary_indexes.
+    - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+
+    Returns:
+    - None
+    """
+    try:
+        with transaction(engine) as conn:
+            for index_name, _ in indexes:
+                conn.execute(text(f"DROP INDEX IF EXISTS {index_name};"))
+
+    except Exception as e:
+        raise e
+
+
+def rebuild_indexes(indexes, engine):
+    """
+    Rebuilds indexes dropped for a bulk load, each in a transaction, or a savepoint inside an atomic load. An index
+    of a partitioned table is rebuilt on all of its partitions.
+
+    Parameters:
+    - indexes (list): (index name, index definition) tuples, as returned by get_secondary_indexes.
+    - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+
+    Returns:
+    - dict: Time each index took to rebuild, in seconds, by index name.
+    """
+    try:
+        rebuild_times = {}
+        for index_name, index_definition in indexes:
+            # The definition of a partitioned index only covers the parent table
+            create_sql = index_definition.replace(" ON ONLY ", " ON ", 1)
+
+            start_time = time.time()
+            with transaction(engine) as conn:
+                conn.execute(text(create_sql))
+            rebuild_times[index_name] = time.time() - start_time
+
+            print(
+                f"Rebuilt index '{index_name}' in {rebuild_times[index_name]:.2f} seconds"
             )
 
+        return rebuild_times
+
+    except Exception as e:
+        raise e
+
+
+def set_table_logged(table_name, engine):
+    """
+    Makes an unlogged table crash-safe once it is loaded, writing its contents to the write-ahead log in one pass.
+
+    Parameters:
+    - table_name (str): The name of the PostgreSQL table.
+    - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+
+    Returns:
+    - None
+    """
+    try:
+        with transaction(engine) as conn:
+            conn.execute(text(f"ALTER TABLE {table_name} SET LOGGED;"))
+
+    except Exception as e:
+        raise e
+
+
+def create_history_table(table_name, engine, columns):
+    """
+    Creates the history table of a raw table if it does not exist. Each distinct raw row is stored once, with the
+    etl_log_id of the first and last ETL job it was seen in.
+
+    Parameters:
+    - table_name (str): The name of the raw PostgreSQL table.
+    - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+    - columns (list): Columns of the raw table to keep history of.
+
+    Returns:
+    - None
+    """
+    try:
+        history_table_name = f"{table_name}_history"
+        create_sql = f"CREATE TABLE IF NOT EXISTS {history_table_name} AS SELECT {', '.join(columns)} FROM {table_name} WITH NO DATA;"
+        alter_sql = f"""
+            ALTER TABLE {history_table_name}
+            ADD COLUMN IF NOT EXISTS row_hash varchar(32),
+            ADD COLUMN IF NOT EXISTS first_etl_log_id uuid,
+            ADD COLUMN IF NOT EXISTS last_etl_log_id uuid;
+        """
+        index_sql = f"CREATE INDEX IF NOT EXISTS {history_table_name}_last_etl_log_id_row_hash_idx ON {history_table_name} (last_etl_log_id, row_hash);"
+        with transaction(engine) as conn:
+            conn.execute(text(create_sql))
+            conn.execute(text(alter_sql))
+            conn.execute(text(index_sql))
+
+    except Exception as e:
+        raise e
+
+
+def write_dataframe_to_history(
+    dataframe, table_name, engine, etl_job_id, previous_etl_job_id=None
+):
+    """
+    Writes a snapshot of a raw table to its history table. Rows seen by the previous ETL job have their validity
+    extended to this job, other rows are stored as new versions. Versions not seen again stay closed at the job
+    that last saw them.
+
+    Parameters:
+    - dataframe (pd.DataFrame): The DataFrame to be written.
+    - table_name (str): The name of the raw PostgreSQL table.
+    - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+    - etl_job_id (UUID): Job_id from etl_log table.
+    - previous_etl_job_id (UUID, optional): Job_id of the last successful ETL job. Default is None, which stores every row as a new version.
+
+    Returns:
+    - dict: Versions opened as "Rows Inserted" and versions extended as "Rows Skipped".
+    """
+    try:
+        print(f"Updating history of table '{table_name}'...")
+
+        dataframe = dataframe.replace(np.nan, "")
+        columns = dataframe.columns.tolist()
+        dataframe["row_hash"] = compute_row_hash(dataframe)
+        dataframe = dataframe.drop_duplicates(subset=["row_hash"])
+
+        column_names = ", ".join(columns + ["row_hash"])
+        history_table_name = f"{table_name}_history"
+        staging_table_name = f"{history_table_name}_staging"
+
+        create_history_table(table_name, engine, columns)
+
+        create_staging_sql = f"CREATE TEMP TABLE {staging_table_name} ON COMMIT DROP AS SELECT {column_names} FROM {history_table_name} WITH NO DATA;"
+        extend_sql = f"""
+            UPDATE {history_table_name} h SET last_etl_log_id = '{etl_job_id}'
+            FROM {staging_table_name} s
+            WHERE h.row_hash = s.row_hash AND h.last_etl_log_id = '{previous_etl_job_id}';
+        """
+        open_sql = f"""
+            INSERT INTO {history_table_name} ({column_names}, first_etl_log_id, last_etl_log_id)
+            SELECT {column_names}, '{etl_job_id}', '{etl_job_id}' FROM {staging_table_name} s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {history_table_name} h
+                WHERE h.row_hash = s.row_hash AND h.last_etl_log_id = '{etl_job_id}'
+            );
+        """
+
+        with transaction(engine) as conn:
+            conn.execute(text(create_staging_sql))
+            copy_dataframe_to_table(dataframe, staging_table_name, conn)
+            versions_extended = 0
+            if previous_etl_job_id:
+                versions_extended = conn.execute(text(extend_sql)).rowcount
+            versions_opened = conn.execute(text(open_sql)).rowcount
+            conn.execute(text(f"DROP TABLE {staging_table_name};"))
+
+        print(
+            f"History updated. Versions opened: {versions_opened}, Versions extended: {versions_extended}"
+        )
+
+        return {
+            "Rows Inserted": versions_opened,
+            "Rows Skipped": versions_extended,
+            "Rows Failed": 0,
+        }
+
+    except Exception as e:
+        raise e
+
+
+def count_closed_history_versions(table_name, engine, previous_etl_job_id):
+    """
+    Counts the versions in a history table that were last seen by the previous ETL job, and so were closed by this one.
+
+    Parameters:
+    - table_name (str): The name of the raw PostgreSQL table.
+    - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+    - previous_etl_job_id (UUID): Job_id of the last successful ETL job.
+
+    Returns:
+    - int: The number of closed versions.
+    """
+    try:
+        select_sql = f"SELECT count(*) FROM {table_name}_history WHERE last_etl_log_id = '{previous_etl_job_id}'"
+        with transaction(engine) as conn:
+            return conn.execute(text(select_sql)).scalar()
+
+    except Exception as e:
+        raise e
+
+
+def rollback_history_table(table_name, engine, etl_job_id, previous_etl_job_id=None):
+    """
+    Undoes the changes an ETL job made to a history table. A job that failed before the history table was created
+    has nothing to undo.
+
+    Parameters:
+    - table_name (str): The name of the raw PostgreSQL table.
+    - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+    - etl_job_id (UUID): Job_id of the ETL job to undo.
+    - previous_etl_job_id (UUID, optional): Job_id of the last successful ETL job before it. Default is None.
+
+    Returns:
+    - None
+    """
+    try:
+        history_table_name = f"{table_name}_history"
+        delete_sql = (
+            f"DELETE FROM {history_table_name} WHERE first_etl_log_id = '{etl_job_id}';"
+        )
+        restore_sql = f"UPDATE {history_table_name} SET last_etl_log_id = '{previous_etl_job_id}' WHERE last_etl_log_id = '{etl_job_id}';"
+        with engine.begin() as conn:
+            if (
+                conn.execute(
+                    text(f"SELECT to_regclass('{history_table_name}');")
+                ).scalar()
+                is None
+            ):
+                return
+            conn.execute(text(delete_sql))
+            if previous_etl_job_id:
+                conn.execute(text(restore_sql))
+
+    except Exception as e:
+        raise e
+
+
+def read_history_snapshot(table_name, engine, etl_job_id):
+    """
+    Rebuilds a raw table's snapshot as it was written by an ETL job from its history table.
+
+    Parameters:
+    - table_name (str): The name of the raw PostgreSQL table.
+    - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+    - etl_job_id (UUID): Job_id of the ETL job.
+
+    Returns:
+    - pd.DataFrame: Rows of the snapshot, with their row_hash and first and last etl_log_id.
+    """
+    try:
+        # A version belongs to the snapshot if the job ran between the first and last job that saw it
+        select_sql = f"""
+            SELECT h.* FROM {table_name}_history h
+            JOIN etl_log f ON f.job_id = h.first_etl_log_id
+            JOIN etl_log l ON l.job_id = h.last_etl_log_id
+            JOIN etl_log x ON x.job_id = '{etl_job_id}'
+            WHERE f.updated_at <= x.updated_at AND l.updated_at >= x.updated_at
+        """
+        return pd.read_sql(text(select_sql), engine)
+
+    except Exception as e:
+        raise e
+
+
+def get_batch_size_for_target_bytes(dataframe, target_batch_bytes):
+    """
+    Estimates how many rows of a DataFrame make up a batch of the target size, from the width of a sample of rows.
+
+    Parameters:
+    - dataframe (pd.DataFrame): The DataFrame to be written.
+    - target_batch_bytes (int): Target size of each batch in bytes.
+
+    Returns:
+    - int: Number of rows to write in each batch.
+    """
+    sample = dataframe.head(1000)
+    if len(sample) == 0:
+        return 1
+    row_bytes = sample.memory_usage(deep=True, index=False).sum() / len(sample)
+    return max(int(target_batch_bytes / row_bytes), 1)
+
+
+def get_adaptive_batch_size(
+    batch_size,
+    elapsed_time,
+    target_batch_seconds,
+    min_batch_size=100,
+    max_batch_size=100000,
+):
+    """
+    Scales the batch size towards the target batch duration from the duration of the last batch. The size changes by
+    at most a factor of two per batch, so a single slow or fast batch does not swing it.
+
+    Parameters:
+    - batch_size (int): Number of rows in the last batch.
+    - elapsed_time (float): Time the last batch took, in seconds.
+    - target_batch_seconds (float): Target duration of each batch, in seconds.
+    - min_batch_size (int, optional): Smallest batch size to choose. Default is 100.
+    - max_batch_size (int, optional): Largest batch size to choose. Default is 100000.
+
+    Returns:
+    - int: Number of rows to write in the next batch.
+    """
+    scale = min(max(target_batch_seconds / max(elapsed_time, 0.001), 0.5), 2.0)
+    return int(min(max(batch_size * scale, min_batch_size), max_batch_size))
+
+
+def write_dataframe_to_postgres(
+    dataframe,
+    table_name,
+    engine,
+    etl_job_id,
+    tables_with_etl_log_foreign_key,
+    batch_size=1000,
+    load_method="insert",
+    workers=1,
+    conflict_key="columns",
+    partitioned=False,
+    batch_retries=0,
+    target_batch_seconds=None,
+    target_batch_bytes=None,
+):
+    """
+    Write a DataFrame to a PostgreSQL table in batches.
+
+    Parameters:
+    - dataframe (pd.DataFrame): The DataFrame to be written.
+    - table_name (str): The name of the PostgreSQL table.
+    - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+    - batch_size (int, optional): Number of rows to write in each batch. Default is 1000.
+    - load_method (str, optional): "insert" for literal INSERT statements or "copy" for COPY through a staging table. Default is "insert".
+    - workers (int, optional): Number of connections to load the table over in parallel. Default is 1.
+    - conflict_key (str, optional): "columns" to skip rows duplicating every column, or "row_hash" to skip rows by
+      their content hash, stored in the table's row_hash column. Default is "columns".
+    - partitioned (bool, optional): The table is partitioned by etl_log_id, so etl_log_id is part of the unique key.
+      Default is False.
+    - batch_retries (int, optional): Number of times a failed batch is retried. Each batch runs in its own transaction,
+      or savepoint during an atomic load, so a failed attempt leaves nothing behind. Default is 0.
+    - target_batch_seconds (float, optional): Adjust the batch size after every batch so batches take about this long.
+      Default is None, which keeps the batch size fixed.
+    - target_batch_bytes (int, optional): Choose the starting batch size so batches hold about this many bytes.
+      Default is None, which starts from batch_size.
+
+    Workers above 1 copy every batch into a staging table, sized by batch_size or target_batch_bytes, and insert them
+    in one statement, so target_batch_seconds and batch_retries do not apply.
+
+    Returns:
+    - dict: Rows inserted, rows skipped as duplicates and rows failed for the table, and the batch size to continue
+      with, adapted to target_batch_seconds.
+    """
+    row_counts = {"Rows Inserted": 0, "Rows Skipped": 0, "Rows Failed": 0}
+    try:
+        load_methods = {
+            "insert": insert_postgres_table_if_rows_not_exist,
+            "copy": copy_postgres_table_if_rows_not_exist,
+        }
+        if load_method not in load_methods:
+            raise ValueError(f"Unknown load method: {load_method}")
+
+        # Print the table being updated
+        print(f"Updating table '{table_name}'...")
+
+        dataframe = dataframe.replace(np.nan, "")
+
+        # Define the columns that make up the unique key
+        if conflict_key == "row_hash":
+            dataframe["row_hash"] = compute_row_hash(dataframe)
+            unique_key_columns = ["row_hash"]
+        elif conflict_key == "columns":
+            unique_key_columns = dataframe.columns.tolist()
+        else:
+            raise ValueError(f"Unknown conflict key: {conflict_key}")
+
+        if table_name in tables_with_etl_log_foreign_key:
+            dataframe["etl_log_id"] = str(etl_job_id)
+
+            # Unique indexes of a partitioned table have to include the partition key
+            if partitioned:
+                unique_key_columns = unique_key_columns + ["etl_log_id"]
+
+        if target_batch_bytes:
+            batch_size = get_batch_size_for_target_bytes(dataframe, target_batch_bytes)
+
+        if workers > 1:
+            try:
+                rows_inserted = load_dataframe_in_parallel(
+                    dataframe,
+                    table_name,
+                    engine,
+                    unique_key_columns,
+                    batch_size=batch_size,
+                    workers=workers,
+                )
+            except Exception:
+                row_counts["Rows Failed"] += len(dataframe)
+                raise
+            row_counts["Rows Inserted"] += rows_inserted
+            row_counts["Rows Skipped"] += len(dataframe) - rows_inserted
+        else:
+            # Write the dataframe in batches, adjusting the batch size as batches complete
+            batch_sizes = []
+            batch_start = 0
+            while batch_start < len(dataframe):
+                batch = dataframe[batch_start : batch_start + batch_size]
+                batch_number = len(batch_sizes) + 1
+                batch_start_time = time.time()
+
+                for attempt in range(batch_retries + 1):
+                    try:
+                        rows_inserted = load_methods[load_method](
+                            batch, table_name, engine, unique_key_columns
+                        )
+                        break
+                    except Exception:
+                        if attempt == batch_retries:
+                            row_counts["Rows Failed"] += len(batch)
+                            print(f"Batch {batch_number}: {len(batch)} rows failed")
+                            raise
+                        print(
+                            f"Batch {batch_number}: attempt {attempt + 1} failed, retrying"
+                        )
+                row_counts["Rows Inserted"] += rows_inserted
+                row_counts["Rows Skipped"] += len(batch) - rows_inserted
+                print(
+                    f"Batch {batch_number}: {rows_inserted} inserted, {len(batch) - rows_inserted} skipped as duplicate"
+                )
+
+                batch_start += len(batch)
+                batch_sizes.append(len(batch))
+                if target_batch_seconds:
+                    batch_size = get_adaptive_batch_size(
+                        len(batch), time.time() - batch_start_time, target_batch_seconds
+                    )
+
+            if (target_batch_seconds or target_batch_bytes) and batch_sizes:
+                print(
+                    f"Batch sizes chosen for '{table_name}': first {batch_sizes[0]}, smallest {min(batch_sizes)}, largest {max(batch_sizes)}, last {batch_sizes[-1]}, over {len(batch_sizes)} batches"
+                )
+
+        print("Table updated")
+
+        row_counts["Batch Size"] = batch_size
+        return row_counts  # Return the row counts for the table
+
+    except Exception as e:
+        print(
+            f"Table '{table_name}' not fully updated. Rows Inserted: {row_counts['Rows Inserted']}, Rows Skipped: {row_counts['Rows Skipped']}, Rows Failed: {row_counts['Rows Failed']}"
+        )
+        raise e
+
+
+def merge_dataframes_to_postgres(
+    dataframes, table_name, engine, key_columns, id_column="live_pin_id"
+):
+    """
+    Merges the full contents of a table into it with set-based statements. Rows are matched on their key columns and
+    compared on a hash of their other columns, so only rows that are new, changed or gone are inserted, updated or
+    deleted. Rows sharing a key are paired with unchanged rows first, then with each other in content hash order.
+
+    Parameters:
+    - dataframes (iterable): DataFrames that together hold every row the table should contain.
+    - table_name (str): The name of the PostgreSQL table.
+    - engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine for database connection.
+    - key_columns (list): Columns identifying a row, such as a title and one of its owners.
+    - id_column (str, optional): Primary key column of the table, kept for updated rows. Default is "live_pin_id".
+
+    Returns:
+    - dict: Rows inserted, updated, deleted and left unchanged.
+    """
+    try:
+        staging_table_name = f"{table_name}_merge_staging"
+        incoming_table_name = f"{table_name}_merge_incoming"
+        current_table_name = f"{table_name}_merge_current"
+        pairs_table_name = f"{table_name}_merge_pairs"
+
+        with transaction(engine) as conn:
+            column_names = None
+            for dataframe in dataframes:
+                dataframe = dataframe.replace(np.nan, "")
+                if column_names is None:
+                    column_names = ", ".join(dataframe.columns)
+                    content_columns = [
+                        column
+                        for column in dataframe.columns
+                        if column not in key_columns
+                    ]
+                    conn.execute(
+                        text(
+                            f"CREATE TEMP TABLE {staging_table_name} ON COMMIT DROP AS SELECT {column_names} FROM {table_name} WITH NO DATA;"
+                        )
+                    )
+                copy_dataframe_to_table(dataframe, staging_table_name, conn)
+
+            # An empty file would otherwise delete every row of the table
+            if (
+                column_names is None
+                or not conn.execute(
+                    text(f"SELECT EXISTS (SELECT 1 FROM {staging_table_name})")
+                ).scalar()
+            ):
+                raise ValueError(f"No rows to merge into '{table_name}'")
+
+            # Key and content hashes compare NULL and empty values safely and join on a single column
+            key_hash = f"md5(ROW({', '.join(key_columns)})::text)"
+            content_hash = f"md5(ROW({', '.join(content_columns)})::text)"
+            conn.execute(text(f"""
+                    CREATE TEMP TABLE {incoming_table_name} ON COMMIT DROP AS
+                    SELECT {column_names}, row_number() OVER () AS merge_row_id,
+                        {key_hash} AS key_hash, {content_hash} AS content_hash
+                    FROM {staging_table_name};
+                    CREATE TEMP TABLE {current_table_name} ON COMMIT DROP AS
+                    SELECT {id_column}, {key_hash} AS key_hash, {content_hash} AS content_hash
+                    FROM {table_name};
+                    """))
+
+            # Pair current rows with identical incoming rows, then the remaining rows of each key with each other
+            conn.execute(text(f"""
+                    CREATE TEMP TABLE {pairs_table_name} ON COMMIT DROP AS
+                    SELECT c.{id_column}, i.merge_row_id, false AS changed
+                    FROM (SELECT *, row_number() OVER (PARTITION BY key_hash, content_hash) AS r FROM {current_table_name}) c
+                    JOIN (SELECT *, row_number() OVER (PARTITION BY key_hash, content_hash) AS r FROM {incoming_table_name}) i
+                    USING (key_hash, content_hash, r);
+                    INSERT INTO {pairs_table_name}
+                    SELECT c.{id_column}, i.merge_row_id, true
+                    FROM (
+                        SELECT c.*, row_number() OVER (PARTITION BY key_hash ORDER BY content_hash) AS r
+                        FROM {current_table_name} c LEFT JOIN {pairs_table_name} p USING ({id_column})
+                        WHERE p.{id_column} IS NULL
+                    ) c
+                    JOIN (
+                        SELECT i.*, row_number() OVER (PARTITION BY key_hash ORDER BY content_hash) AS r
+                        FROM {incoming_table_name} i LEFT JOIN {pairs_table_name} p USING (merge_row_id)
+                        WHERE p.merge_row_id IS NULL
+                    ) i
+                    USING (key_hash, r);
+                    """))
+
+            update_sql = f"""
+                UPDATE {table_name} t SET {', '.join(f'{column} = i.{column}' for column in content_columns)}
+                FROM {pairs_table_name} p JOIN {incoming_table_name} i USING (merge_row_id)
+                WHERE p.changed AND t.{id_column} = p.{id_column};
+            """
+            delete_sql = f"""
+                DELETE FROM {table_name} t USING {current_table_name} c
+                LEFT JOIN {pairs_table_name} p USING ({id_column})
+                WHERE p.{id_column} IS NULL AND t.{id_column} = c.{id_column};
+            """
+            insert_sql = f"""
+                INSERT INTO {table_name} ({column_names})
+                SELECT {', '.join(f'i.{column}' for column in dataframe.columns)}
+                FROM {incoming_table_name} i LEFT JOIN {pairs_table_name} p USING (merge_row_id)
+                WHERE p.merge_row_id IS NULL;
+            """
+            row_counts = {
+                "Rows Updated": conn.execute(text(update_sql)).rowcount,
+                "Rows Deleted": conn.execute(text(delete_sql)).rowcount,
+                "Rows Inserted": conn.execute(text(insert_sql)).rowcount,
+                "Rows Unchanged": conn.execute(
+                    text(f"SELECT count(*) FROM {pairs_table_name} WHERE NOT changed")
+                ).scalar(),
+            }
+
+            # Temporary tables are dropped explicitly because a savepoint does not end the transaction
+            for merge_table_name in [
+                staging_table_name,
+                incoming_table_name,
+                current_table_name,
+                pairs_table_name,
+            ]:
+                conn.execute(text(f"DROP TABLE {merge_table_name};"))
+
+        print(
+            f"Merged '{table_name}': {row_counts['Rows Inserted']} inserted, {row_counts['Rows Updated']} updated, {row_counts['Rows Deleted']} deleted, {row_counts['Rows Unchanged']} unchanged"
+        )
+        return row_counts
+
+    except Exception as e:
+        print(e)
+        raise e
+
+
+def get_table_checksum(table_name, conn):
+    """
+    Counts the rows of a table and sums a hash of each, to tell whether the table was written to since it was copied.
+
+    Parameters:
+    - table_name (str): The name of the PostgreSQL table.
+    - conn (sqlalchemy.engine.base.Connection): Connection to read the table on.
+
+    Returns:
+    - tuple: The number of rows, and the sum of their hashes.
+    """
+    try:
+        checksum_sql = f"SELECT count(*), coalesce(sum(hashtextextended(t::text, 0)::numeric), 0) FROM {table_name} t;"
+        return tuple(conn.execute(text(checksum_sql)).fetchone())
+
+    except Exception as e:
+        raise e
+
+
+def copy_table_indexes(table_name, target_table_name, conn, unique):
+    """
+    Builds the indexes of a table on a copy of it. Primary key, unique and exclusion constraints are added as
+    constraints, other indexes are created unnamed and take their names when the copy is swapped in.
+
+    Parameters:
+    - table_name (str): The name of the PostgreSQL table whose indexes are copied.
+    - target_table_name (str): The name of the table to build the indexes on.
+    - conn (sqlalchemy.engine.base.Connection): Connection to build the indexes on.
+    - unique (bool): True to build the unique and exclusion indexes ON CONFLICT relies on, False to build the others.
+
+    Returns:
+    - None
+    """
+    try:
+        indexes_sql = f"""
+            SELECT i.indisunique, regexp_replace(pg_get_indexdef(i.indexrelid), '^.* USING ', ''),
+                pg_get_constraintdef(k.oid)
+            FROM pg_index i
+            LEFT JOIN pg_constraint k ON k.conindid = i.indexrelid AND k.conrelid = i.indrelid AND k.contype IN ('p', 'u', 'x')
+            WHERE i.indrelid = '{table_name}'::regclass
+            AND (i.indisunique OR i.indisexclusion OR k.oid IS NOT NULL) = {unique}
+            ORDER BY i.indexrelid
+        """
+        for is_unique, index_definition, constraint_definition in conn.execute(
+            text(indexes_sql)
+        ).fetchall():
+            if constraint_definition:
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {target_table_name} ADD {constraint_definition};"
+                    )
+                )
+            else:
+                conn.execute(
+                    text(
+                        f"CREATE {'UNIQUE ' if is_unique else ''}INDEX ON {target_table_name} USING {index_definition};"
+                    )
+                )
+
+    except Exception as e:
+        raise e
+
+
+def copy_table_foreign_keys(table_name, target_table_name, conn):
+    """
+    Adds the foreign keys of a table to a copy of it, each checked against the rows of the copy in one pass.
+
+    Parameters:
+    - table_name (str): The name of the PostgreSQL table whose foreign keys are copied.
+    - target_table_name (str): The name of the table to add the foreign keys to.
+    - conn (sqlalchemy.engine.base.Connection): Connection to add the foreign keys on.
+
+    Returns:
+    - None
+    """
+    try:
+        foreign_keys_sql = f"""
+            SELECT quote_ident(conname), pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE conrelid = '{table_name}'::regclass AND contype = 'f' ORDER BY oid
+        """
+        for constraint_name, constraint_definition in conn.execute(
+            text(foreign_keys_sql)
+        ).fetchall():
+            conn.execute(
+                text(
+                    f"ALTER TABLE {target_table_name} ADD CONSTRAINT {constraint_name} {constraint_definition};"
+                )
+            )
+
+    except Exception as e:
+        raise e
+
+
+def create_shadow_table(table_name, conn):
+    """
+    Creates a shadow copy of a table, with its rows, defaults, check and not-null constraints, comments, triggers,
+    owner, grants and row level security policies, to be loaded and then swapped in with swap_shadow_table. The rows
+    are copied before any index is built, and only the unique indexes the load relies on are built here; the other
+    indexes and the foreign keys are added by copy_table_foreign_keys once the shadow is loaded. Tables referenced by
+    foreign keys or views cannot be swapped, as those would stay attached to the old table.
+
+    Parameters:
+    - table_name (str): The name of the PostgreSQL table.
+    - conn (sqlalchemy.engine.base.Connection): Connection to create the shadow table on.
+
+    Returns:
+    - tuple: The name of the shadow table, and the checksum of the copied rows, as returned by get_table_checksum.
+    """
+    try:
+        shadow_table_name = f"{table_name}_shadow"
+
+        dependents_sql = f"""
+            SELECT conrelid::regclass::text FROM pg_constraint WHERE confrelid = '{table_name}'::regclass
+            UNION
+            SELECT r.ev_class::regclass::text FROM pg_depend d JOIN pg_rewrite r ON r.oid = d.objid
+            WHERE d.refobjid = '{table_name}'::regclass AND r.ev_class <> '{table_name}'::regclass
+        """
+        dependents = [row[0] for row in conn.execute(text(dependents_sql))]
+        if dependents:
+            raise ValueError(
+                f"'{table_name}' cannot be swapped, it is referenced by {', '.join(dependents)}"
+            )
+
+        conn.execute(text(f"DROP TABLE IF EXISTS {shadow_table_name};"))
+        conn.execute(
+            text(
+                f"CREATE TABLE {shadow_table_name} (LIKE {table_name} INCLUDING ALL EXCLUDING INDEXES);"
+            )
+        )
+
+        # The checksum is taken in the same statement as the copy, so it covers exactly the copied rows
+        copy_sql = f"""
+            WITH copied AS (INSERT INTO {shadow_table_name} SELECT * FROM {table_name} RETURNING *)
+            SELECT count(*), coalesce(sum(hashtextextended(copied::text, 0)::numeric), 0) FROM copied;
+        """
+        checksum = tuple(conn.execute(text(copy_sql)).fetchone())
+        copy_table_indexes(table_name, shadow_table_name, conn, unique=True)
+
+        # Triggers are created after the rows are copied, so only rows changed by the load fire them
+        triggers_sql = f"SELECT pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = '{table_name}'::regclass AND NOT tgisinternal"
+        for (trigger_definition,) in conn.execute(text(triggers_sql)).fetchall():
+            conn.execute(
+                text(
+                    re.sub(
+                        rf" ON (\w+\.)?{table_name} ",
+                        f" ON {shadow_table_name} ",
+                        trigger_definition,
+                        count=1,
+                    )
+                )
+            )
+
+        grants_sql = f"""
+            SELECT privilege_type, CASE WHEN grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(grantee)) END
+            FROM pg_class, aclexplode(relacl) WHERE oid = '{table_name}'::regclass
+        """
+        for privilege, grantee in conn.execute(text(grants_sql)).fetchall():
+            conn.execute(
+                text(f"GRANT {privilege} ON {shadow_table_name} TO {grantee};")
+            )
+
+        # The owner, table comment and row level security are not copied by LIKE
+        table_sql = f"""
+            SELECT quote_ident(pg_get_userbyid(relowner)), quote_literal(obj_description(oid, 'pg_class')),
+                relrowsecurity, relforcerowsecurity
+            FROM pg_class WHERE oid = '{table_name}'::regclass
+        """
+        owner, comment, row_security, force_row_security = conn.execute(
+            text(table_sql)
+        ).fetchone()
+        conn.execute(text(f"ALTER TABLE {shadow_table_name} OWNER TO {owner};"))
+        if comment:
+            conn.execute(text(f"COMMENT ON TABLE {shadow_table_name} IS {comment};"))
+        if row_security:
+            conn.execute(
+                text(f"ALTER TABLE {shadow_table_name} ENABLE ROW LEVEL SECURITY;")
+            )
+        if force_row_security:
+            conn.execute(
+                text(f"ALTER TABLE {shadow_table_name} FORCE ROW LEVEL SECURITY;")
+            )
+
+        policies_sql = f"""
+            SELECT quote_ident(policyname), permissive, cmd,
+                (SELECT string_agg(CASE WHEN r = 'public' THEN r ELSE quote_ident(r) END, ', ') FROM unnest(roles) r),
+                qual, with_check
+            FROM pg_policies WHERE schemaname = current_schema() AND tablename = '{table_name}'
+        """
+        for policy_name, permissive, command, roles, using, with_check in conn.execute(
+            text(policies_sql)
+        ).fetchall():
+            conn.execute(
+                text(
+                    f"CREATE POLICY {policy_name} ON {shadow_table_name} AS {permissive} FOR {command} TO {roles}"
+                    + (f" USING ({using})" if using else "")
+                    + (f" WITH CHECK ({with_check})" if with_check else "")
+                    + ";"
+                )
+            )
+
+        return shadow_table_name, checksum
+
+    except Exception as e:
+        raise e
+
+
+def swap_shadow_table(table_name, conn, checksum):
+    """
+    Swaps a loaded shadow table in for the table it was copied from. Writes to the table are locked out while it is
+    compared against the rows copied into the shadow, and the swap is refused if it was written to since; reads
+    carry on until the old table is dropped and the shadow takes over its name, index names and sequences, the only
+    statements run under an exclusive lock.
+
+    Parameters:
+    - table_name (str): The name of the PostgreSQL table.
+    - conn (sqlalchemy.engine.base.Connection): Connection whose transaction is committed right after the swap.
+    - checksum (tuple): Checksum of the rows copied into the shadow, as returned by create_shadow_table.
+
+    Returns:
+    - None
+    """
+    try:
+        shadow_table_name = f"{table_name}_shadow"
+        conn.execute(text(f"LOCK TABLE {table_name} IN SHARE ROW EXCLUSIVE MODE;"))
+
+        # Rows written since the copy would be lost with the old table
+        if get_table_checksum(table_name, conn) != checksum:
+            raise ValueError(
+                f"'{table_name}' was written to while its shadow table was loaded, not swapping it in"
+            )
+
+        # Indexes are matched by their definition without the index and table names
+        indexes_sql = """
+            SELECT c.relname, i.indisunique, regexp_replace(pg_get_indexdef(i.indexrelid), '^.* USING ', '')
+            FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE i.indrelid = '{}'::regclass
+        """
+        index_names = {
+            tuple(row[1:]): row[0]
+            for row in conn.execute(text(indexes_sql.format(table_name)))
+        }
+        shadow_index_names = {
+            tuple(row[1:]): row[0]
+            for row in conn.execute(text(indexes_sql.format(shadow_table_name)))
+        }
+
+        # Serial columns of the shadow use the sequences of the old table, which would be dropped with it
+        sequences_sql = f"""
+            SELECT s.oid::regclass::text, a.attname FROM pg_depend d
+            JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+            JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+            WHERE d.refobjid = '{table_name}'::regclass AND d.deptype = 'a'
+        """
+        for sequence_name, column_name in conn.execute(text(sequences_sql)).fetchall():
+            conn.execute(
+                text(
+                    f"ALTER SEQUENCE {sequence_name} OWNED BY {shadow_table_name}.{column_name};"
+                )
+            )
+
+        conn.execute(text(f"LOCK TABLE {table_name} IN ACCESS EXCLUSIVE MODE;"))
+        conn.execute(text(f"DROP TABLE {table_name};"))
+        conn.execute(text(f"ALTER TABLE {shadow_table_name} RENAME TO {table_name};"))
+        for index_definition, shadow_index_name in shadow_index_names.items():
+            if index_definition in index_names:
+                conn.execute(
+                    text(
+                        f"ALTER INDEX {shadow_index_name} RENAME TO {index_names[index_definition]};"
+                    )
+                )
+
+        print(f"Swapped shadow table into '{table_name}'")
+
+    except Exception as e:
+        raise e
+
+
+@contextmanager
+def shadow_table(table_name, engine):
+    """
+    Builds a table in a shadow copy and swaps it in once the copy is loaded, so no reader sees a half-loaded table.
+    The table is not locked while the shadow is copied, loaded, indexed and analyzed, each in its own transaction.
+    The swap locks out writers while it checks the table was not written to since it was copied, and only locks out
+    readers for the drop and rename. Inside an atomic load the locks are held until the load commits.
+
+    Parameters:
+    - table_name (str): The name of the PostgreSQL table.
+    - engine (sqlalchemy.engine.base.Engine or sqlalchemy.engine.base.Connection): Engine, or connection of an atomic load.
+
+    Yields:
+    - tuple: The name of the shadow table, and the connection to load it on.
+    """
+    with transaction(engine) as conn:
+        shadow_table_name, checksum = create_shadow_table(table_name, conn)
+    try:
+        with transaction(engine) as conn:
+            yield shadow_table_name, conn
+            copy_table_indexes(table_name, shadow_table_name, conn, unique=False)
+            copy_table_foreign_keys(table_name, shadow_table_name, conn)
+            conn.execute(text(f"ANALYZE {shadow_table_name};"))
+        with transaction(engine) as conn:
+            swap_shadow_table(table_name, conn, checksum)
+    except Exception:
+        # An atomic load drops the shadow table when it rolls back
+        if not isinstance(engine, Connection):
+            with transaction(engine) as conn:
+                conn.execute(text(f"DROP TABLE IF EXISTS {shadow_table_name};"))
+        raise
+
+
+def read_processed_file(file_path, read_chunk_size=None, as_text=False):
+    """
+    Reads a processed file into DataFrames, either whole or in chunks of bounded size. Parquet and Arrow IPC files are
+    memory mapped rather than read into a buffer first.
+
+    Parameters:
+    - file_path (str): The path to the processed CSV, Parquet or Arrow IPC file.
+    - read_chunk_size (int, optional): Number of rows to read at a time. Default is None, which reads the whole file.
+    - as_text (bool, optional): Read every column of a whole CSV file as text, as chunks always are, instead of
+      inferring dtypes. Default is False.
+
+    Returns:
+    - iterable: DataFrames to be written, one per chunk.
+    """
+    try:
+        file_extension = os.path.splitext(file_path)[1]
+        if file_extension == ".parquet":
+            parquet_file = pq.ParquetFile(file_path, memory_map=True)
+            if read_chunk_size:
+                return (
+                    batch.to_pandas()
+                    for batch in parquet_file.iter_batches(batch_size=read_chunk_size)
+                )
+            return [parquet_file.read().to_pandas()]
+
+        if file_extension == ".arrow":
+            table = pa.ipc.open_file(pa.memory_map(file_path)).read_all()
+            if read_chunk_size:
+                return (
+                    batch.to_pandas()
+                    for batch in table.to_batches(max_chunksize=read_chunk_size)
+                )
+            return [table.to_pandas()]
+
+        read_csv_kwargs = {"encoding": "unicode_escape"}
+        if read_chunk_size:
+            # Read every column as text so values are written the same way whichever chunk they land in
+            return pd.read_csv(
+                file_path, dtype=str, chunksize=read_chunk_size, **read_csv_kwargs
+            )
+
+        if as_text:
+            return [pd.read_csv(file_path, dtype=str, **read_csv_kwargs)]
+        if os.path.basename(file_path) == "active_pin.csv":
+            read_csv_kwargs["converters"] = {"pids": str}
+        return [pd.read_csv(file_path, low_memory=False, **read_csv_kwargs)]
+
+    except Exception as e:
+        raise e
+
+
+def read_table_dataframes(table_source, read_chunk_size=None, as_text=False):
+    """
+    Reads the DataFrames of a table from its processed file, or splits a DataFrame handed over by ltsa_parser, either
+    whole or in chunks of bounded size.
+
+    Parameters:
+    - table_source (str or pd.DataFrame): The path to the processed CSV file, or the parsed DataFrame.
+    - read_chunk_size (int, optional): Number of rows to write at a time. Default is None, which writes the whole table.
+    - as_text (bool, optional): Read every column of a whole CSV file as text. Default is False.
+
+    Returns:
+    - iterable: DataFrames to be written, one per chunk.
+    """
+    if not isinstance(table_source, pd.DataFrame):
+        return read_processed_file(table_source, read_chunk_size, as_text)
+
+    if not read_chunk_size:
+        return [table_source]
+    return (
+        table_source[i : i + read_chunk_size]
+        for i in range(0, len(table_source), read_chunk_size)
+    )
+
+
+def read_snapshot_rows(snapshot_directory, etl_job_id, table_name):
+    """
+    Reads the row hashes and key columns of a table's snapshot recorded by an ETL job.
+
+    Parameters:
+    - snapshot_directory (str): Directory the snapshots are recorded in.
+    - etl_job_id (UUID): Job_id of the ETL job that recorded the snapshot.
+    - table_name (str): The name of the PostgreSQL table.
+
+    Returns:
+    - pd.DataFrame: Key columns of each row of the snapshot, indexed by row hash, or None if the job did not record one.
+    """
+    try:
+        file_path = os.path.join(
+            snapshot_directory, str(etl_job_id), f"{table_name}.parquet"
+        )
+        if not os.path.isfile(file_path):
+            return None
+
+        return pd.read_parquet(file_path).set_index("row_hash")
+
+    except Exception as e:
+        raise e
+
+
+def filter_changed_rows(dataframe, previous_snapshot, key_columns):
+    """
+    Anti-joins a DataFrame against the row hashes of the previous snapshot, keeping added or changed rows. Rows are
+    hashed in their text form, so a row hashes the same whether it was read whole, in chunks or handed over in memory.
+
+    Parameters:
+    - dataframe (pd.DataFrame): The DataFrame to be written.
+    - previous_snapshot (pd.DataFrame): Rows of the previous snapshot, as returned by read_snapshot_rows, or None to
+      keep every row.
+    - key_columns (list): Columns recorded with each row hash to identify the row.
+
+    Returns:
+    - pd.DataFrame: Rows that are not in the previous snapshot.
+    - pd.DataFrame: Row hash and key columns of every row in dataframe.
+    """
+    try:
+        text_values = dataframe.fillna("").astype(str)
+        snapshot = text_values[key_columns].assign(
+            row_hash=compute_row_hash(text_values)
+        )
+        if previous_snapshot is None:
+            return dataframe, snapshot
+
+        return (
+            dataframe[~snapshot["row_hash"].isin(previous_snapshot.index)],
+            snapshot,
+        )
+
+    except Exception as e:
+        raise e
+
+
+def record_snapshot_delta(
+    snapshot, previous_snapshot, snapshot_directory, etl_job_id, table_name
+):
+    """
+    Records the row hashes and key columns of a table's new snapshot, and the rows that disappeared since the previous
+    one.
+
+    Parameters:
+    - snapshot (pd.DataFrame): Row hash and key columns of each row of the new snapshot.
+    - previous_snapshot (pd.DataFrame): Rows of the previous snapshot, as returned by read_snapshot_rows, or None if
+      there is none.
+    - snapshot_directory (str): Directory the snapshots are recorded in.
+    - etl_job_id (UUID): Job_id of the ETL job recording the snapshot.
+    - table_name (str): The name of the PostgreSQL table.
+
+    Returns:
+    - int: The number of rows removed since the previous snapshot.
+    """
+    try:
+        job_directory = os.path.join(snapshot_directory, str(etl_job_id))
+        os.makedirs(job_directory, exist_ok=True)
+
+        snapshot.to_parquet(
+            os.path.join(job_directory, f"{table_name}.parquet"), index=False
+        )
+
+        removed_rows = snapshot.iloc[:0]
+        if previous_snapshot is not None:
+            removed_rows = previous_snapshot[
+                ~previous_snapshot.index.isin(snapshot["row_hash"])
+            ].reset_index()
+        removed_rows.to_csv(
+            os.path.join(job_directory, f"{table_name}_removed.csv"), index=False
+        )
+
+        return len(removed_rows)
+
+    except Exception as e:
+        raise e
+
+
+def remove_old_snapshots(snapshot_directory, keep_etl_job_ids):
+    """
+    Deletes recorded snapshot row hashes of every ETL job except the provided ones.
+
+    Parameters:
+    - snapshot_directory (str): Directory the snapshot row hashes are recorded in.
+    - keep_etl_job_ids (list): Job_ids of the ETL jobs whose snapshots are kept.
+
+    Returns:
+    - None
+    """
+    try:
+        keep_directories = [str(job_id) for job_id in keep_etl_job_ids if job_id]
+        for directory in os.listdir(snapshot_directory):
+            if directory not in keep_directories:
+                shutil.rmtree(os.path.join(snapshot_directory, directory))
+
+    except Exception as e:
+        raise e
+
+
+def run(
+    input_directory,
+    etl_job_id,
+    database_name,
+    batch_size=1000,
+    host="localhost",
+    port=5432,
+    user="your_username",
+    password="your_password",
+    load_method="insert",
+    workers=1,
+    read_chunk_size=None,
+    conflict_key="columns",
+    snapshot_directory=None,
+    previous_etl_job_id=None,
+    raw_storage="snapshot",
+    atomic=False,
+    batch_retries=0,
+    target_batch_seconds=None,
+    target_batch_bytes=None,
+    rebuild_indexes_after_load=False,
+    unlogged_load=False,
+    active_pin_load="append",
+    shadow_swap=False,
+    dataframes=None,
+    input_format="csv",
+):
+    """
+    Process files in a directory and write them to a PostgreSQL database.
+
+    Parameters:
+    - input_directory (str): The path to the directory containing input files.
+    - database_name (str): The name of the PostgreSQL database.
+    - batch_size (int, optional): Number of rows to write in each batch. Default is 1000.
+    - host (str, optional): The database host. Default is "localhost".
+    - port (int, optional): The database port. Default is 5432.
+    - user (str, optional): The database username. Default is "your_username".
+    - password (str, optional): The database password. Default is "your_password".
+    - load_method (str, optional): "insert" for literal INSERT statements or "copy" for COPY through a staging table. Default is "insert".
+    - workers (int, optional): Number of connections each table is loaded over in parallel. Cannot be combined with
+      read_chunk_size. Default is 1.
+    - read_chunk_size (int, optional): Number of rows of each file to read and load at a time. Default is None, which reads whole files.
+    - conflict_key (str, optional): "columns" or "row_hash", the key used to skip duplicate rows. With "row_hash" whole
+      CSV files are read as text, so a row hashes the same whichever way it was read. Default is "columns".
+    - snapshot_directory (str, optional): Directory to record raw table row hashes and key columns in. When set, only
+      rows added or changed since the previous snapshot are written to the raw tables. Default is None, which writes
+      every row.
+    - previous_etl_job_id (UUID, optional): Job_id of the last successful ETL job, whose snapshot is compared against.
+    - raw_storage (str, optional): "snapshot" to write raw tables in full for every job, or "history" to write them
+      to history tables that keep each distinct row once, by the hash of its text form. Default is "snapshot".
+    - atomic (bool, optional): Load every table in one transaction, so a failed load leaves nothing to undo and a
+      successful one commits once. Default is False.
+    - batch_retries (int, optional): Number of times a failed batch is retried. Default is 0.
+    - target_batch_seconds (float, optional): Adapt the batch size of each table so batches take about this long.
+      Default is None, which keeps batch_size fixed.
+    - target_batch_bytes (int, optional): Size the batches of each table to hold about this many bytes. Default is None.
+    - rebuild_indexes_after_load (bool, optional): Build secondary indexes once a table is loaded, instead of updating
+      them with every batch. Partitioned raw tables are loaded into a detached job partition that is indexed when it
+      is attached, and active_pin into a shadow table with shadow_swap; other raw tables only drop and rebuild their
+      indexes in an atomic load. Default is False.
+    - unlogged_load (bool, optional): Load raw table partitions unlogged and set them logged once they are loaded.
+      Default is False.
+    - active_pin_load (str, optional): "append" to insert active_pin rows that do not exist yet, or "merge" to insert,
+      update and delete rows so active_pin matches the file. Default is "append".
+    - shadow_swap (bool, optional): Load active_pin into a shadow copy and swap it in once it is loaded, so lookups
+      never see a half-loaded table. Default is False.
+    - dataframes (dict or iterable, optional): DataFrames to write by table name, as returned by ltsa_parser.run, or
+      an iterable of (table name, DataFrame) pairs. Default is None, which reads the files in input_directory.
+    - input_format (str, optional): "csv", "parquet" or "arrow", the format of the files in input_directory. Default is "csv".
+
+    Returns:
+    - None
+    """
+    try:
+        # Create a connection to the PostgreSQL database, with one pooled connection per worker
+        conn_str = f"postgresql://{user}:{password}@{host}:{port}/{database_name}"
+        engine = create_engine(conn_str, pool_size=max(workers, 5))
+
+        if dataframes is None:
+            # List all files in the input directory
+            file_list = [
+                f
+                for f in os.listdir(input_directory)
+                if (
+                    os.path.isfile(os.path.join(input_directory, f))
+                    and f.endswith(f".{input_format}")
+                )
+            ]
+            # Use file name without extension as table name
+            table_sources = [
+                (
+                    os.path.splitext(file_name)[0],
+                    os.path.join(input_directory, file_name),
+                )
+                for file_name in file_list
+            ]
+        elif isinstance(dataframes, dict):
+            table_sources = dataframes.items()
+        else:
+            # Tables are written in the order they arrive, while the rest are still being parsed
+            table_sources = dataframes
+
+        table_statistics = []  # List to store table-wise statistics
+
+        start_time = time.time()  # Start measuring time
+
+        if atomic and workers > 1:
+            raise ValueError(
+                "Parallel loading uses several connections and cannot be atomic"
+            )
+
+        # Each chunk is staged and inserted on its own, so a failed chunk would leave the earlier ones committed
+        if read_chunk_size and workers > 1:
+            raise ValueError(
+                "Parallel loading inserts each chunk in its own transaction and cannot load files in chunks"
+            )
+
+        if shadow_swap and workers > 1:
+            raise ValueError(
+                "Parallel loading uses several connections and cannot load a shadow table"
+            )
+
+        if active_pin_load not in ["append", "merge"]:
+            raise ValueError(f"Unknown active_pin load '{active_pin_load}'")
+
+        # In an atomic load every table shares one transaction, and each batch runs in a savepoint
+        with engine.begin() if atomic else nullcontext(engine) as connectable:
+            for table_name, table_source in table_sources:
+                tables_with_etl_log_foreign_key = [
+                    "title_raw",
+                    "parcel_raw",
+                    "titleparcel_raw",
+                    "titleowner_raw",
+                ]
+                # Columns recorded with each row hash in delta mode, to identify rows removed since the last snapshot
+                snapshot_key_columns = {
+                    "title_raw": ["title_number", "land_title_district"],
+                    "parcel_raw": ["pid"],
+                    "titleparcel_raw": ["title_number", "land_title_district", "pid"],
+                    "titleowner_raw": [
+                        "title_number",
+                        "land_title_district",
+                        "given_name",
+                        "last_name_1",
+                        "last_name_2",
+                        "incorporation_number",
+                    ],
+                }
+
+                if raw_storage == "history" and (
+                    table_name in tables_with_etl_log_foreign_key
+                ):
+                    row_counts = {
+                        "Rows Inserted": 0,
+                        "Rows Skipped": 0,
+                        "Rows Failed": 0,
+                    }
+                    # Rows are hashed in their text form, so whole files are read as text like chunks are
+                    for df in read_table_dataframes(
+                        table_source, read_chunk_size, as_text=True
+                    ):
+                        chunk_row_counts = write_dataframe_to_history(
+                            df, table_name, connectable, etl_job_id, previous_etl_job_id
+                        )
+                        for key in row_counts:
+                            row_counts[key] += chunk_row_counts[key]
+
+                    if previous_etl_job_id:
+                        versions_closed = count_closed_history_versions(
+                            table_name, connectable, previous_etl_job_id
+                        )
+                        print(
+                            f"History of '{table_name}': {versions_closed} versions closed"
+                        )
+
+                    table_statistics.append(
+                        {
+                            "Table Name": f"{table_name}_history",
+                            **row_counts,
+                            "Elapsed Time (s)": time.time() - start_time,
+                        }
+                    )
+                    continue
+
+                # active_pin can be loaded into a shadow copy that is swapped in once it is loaded
+                shadow = table_name == "active_pin" and shadow_swap
+                with (
+                    shadow_table(table_name, connectable)
+                    if shadow
+                    else nullcontext((table_name, connectable))
+                ) as (load_table_name, load_connectable):
+                    if table_name == "active_pin" and active_pin_load == "merge":
+                        merge_row_counts = merge_dataframes_to_postgres(
+                            read_table_dataframes(table_source, read_chunk_size),
+                            load_table_name,
+                            load_connectable,
+                            [
+                                "title_number",
+                                "land_title_district",
+                                "given_name",
+                                "last_name_1",
+                                "last_name_2",
+                                "incorporation_number",
+                            ],
+                        )
+                        table_statistics.append(
+                            {
+                                "Table Name": table_name,
+                                "Rows Inserted": merge_row_counts["Rows Inserted"],
+                                "Rows Skipped": merge_row_counts["Rows Unchanged"],
+                                "Rows Failed": 0,
+                                "Elapsed Time (s)": time.time() - start_time,
+                            }
+                        )
+                        continue
+
+                    # Rows of a partitioned raw table go into the partition of this job
+                    partitioned = table_name in tables_with_etl_log_foreign_key and (
+                        is_partitioned_table(table_name, connectable)
+                    )
+                    # To rebuild indexes, the job partition is loaded detached, without the secondary indexes of the
+                    # table, and attached once loaded, which builds them on the new rows only
+                    detached = partitioned and rebuild_indexes_after_load
+                    if partitioned:
+                        create_job_partition(
+                            table_name,
+                            connectable,
+                            etl_job_id,
+                            unlogged=unlogged_load,
+                            detached=detached,
+                        )
+                    etl_log_table_names = tables_with_etl_log_foreign_key
+                    if detached:
+                        load_table_name = get_job_partition_name(table_name, etl_job_id)
+                        etl_log_table_names = etl_log_table_names + [load_table_name]
+
+                    # Raw tables are compared against the previous snapshot in delta mode
+                    delta = bool(snapshot_directory) and (
+                        table_name in tables_with_etl_log_foreign_key
+                    )
+                    if delta:
+                        previous_snapshot = None
+                        if previous_etl_job_id:
+                            previous_snapshot = read_snapshot_rows(
+                                snapshot_directory, previous_etl_job_id, table_name
+                            )
+                        if previous_snapshot is None:
+                            print(
+                                f"No previous snapshot of '{table_name}', writing every row"
+                            )
+                        snapshot = []
+
+                    # Indexes of a live table are only dropped inside an atomic load, as a plain load would leave
+                    # readers without them until it is done. Dropping them locks the table until the load commits,
+                    # so the indexes of active_pin, which serves lookups, are kept unless it is loaded into a shadow
+                    # table, which is indexed once loaded regardless.
+                    indexes = []
+                    if rebuild_indexes_after_load and not (partitioned or shadow):
+                        if atomic and table_name != "active_pin":
+                            indexes = get_secondary_indexes(
+                                load_table_name, load_connectable
+                            )
+                            drop_indexes(indexes, load_connectable)
+                        else:
+                            print(
+                                f"Keeping the indexes of '{table_name}', they are only rebuilt in partitioned, shadow or atomic loads of raw tables"
+                            )
+
+                    # Load each chunk as soon as it is read so only one chunk is held in memory
+                    row_counts = {
+                        "Rows Inserted": 0,
+                        "Rows Skipped": 0,
+                        "Rows Failed": 0,
+                    }
+                    chunk_batch_size = batch_size
+                    chunk_target_batch_bytes = target_batch_bytes
+                    # Rows are hashed in their text form, so whole files are read as text like chunks are
+                    for df in read_table_dataframes(
+                        table_source,
+                        read_chunk_size,
+                        as_text=delta or conflict_key == "row_hash",
+                    ):
+                        if delta:
+                            df, chunk_snapshot = filter_changed_rows(
+                                df,
+                                previous_snapshot,
+                                snapshot_key_columns[table_name],
+                            )
+                            snapshot.append(chunk_snapshot)
+
+                        chunk_row_counts = write_dataframe_to_postgres(
+                            df,
+                            load_table_name,
+                            load_connectable,
+                            etl_job_id,
+                            etl_log_table_names,
+                            batch_size=chunk_batch_size,
+                            load_method=load_method,
+                            workers=workers,
+                            conflict_key=conflict_key,
+                            partitioned=partitioned,
+                            batch_retries=batch_retries,
+                            target_batch_seconds=target_batch_seconds,
+                            target_batch_bytes=chunk_target_batch_bytes,
+                        )
+                        for key in row_counts:
+                            row_counts[key] += chunk_row_counts[key]
+
+                        # Later chunks continue from the batch size the earlier ones adapted to
+                        if target_batch_seconds:
+                            chunk_batch_size = chunk_row_counts["Batch Size"]
+                            chunk_target_batch_bytes = None
+
+                    if partitioned and unlogged_load:
+                        set_table_logged(
+                            get_job_partition_name(table_name, etl_job_id), connectable
+                        )
+                    if detached:
+                        attach_job_partition(table_name, connectable, etl_job_id)
+                    if indexes:
+                        rebuild_indexes(indexes, load_connectable)
+
+                    if delta:
+                        snapshot = (
+                            pd.concat(snapshot, ignore_index=True)
+                            if snapshot
+                            else pd.DataFrame(
+                                columns=snapshot_key_columns[table_name] + ["row_hash"],
+                                dtype=object,
+                            )
+                        )
+                        rows_removed = record_snapshot_delta(
+                            snapshot,
+                            previous_snapshot,
+                            snapshot_directory,
+                            etl_job_id,
+                            table_name,
+                        )
+                        rows_changed = (
+                            row_counts["Rows Inserted"] + row_counts["Rows Skipped"]
+                        )
+                        print(
+                            f"Delta of '{table_name}': {rows_changed} added or changed, {len(snapshot) - rows_changed} unchanged, {rows_removed} removed"
+                        )
+
+                    elapsed_time = time.time() - start_time
+                    table_statistics.append(
+                        {
+                            "Table Name": table_name,
+                            **row_counts,
+                            "Elapsed Time (s)": elapsed_time,
+                        }
+                    )
+
+        # Only the previous and the new snapshot are needed by the next run
+        if snapshot_directory and os.path.isdir(snapshot_directory):
+            remove_old_snapshots(snapshot_directory, [etl_job_id, previous_etl_job_id])
+
         end_time = time.time()  # Stop measuring time
 
         total_rows_inserted = sum(stat["Rows Inserted"] for stat in table_statistics)
+        total_rows_skipped = sum(stat["Rows Skipped"] for stat in table_statistics)
 
         print("Table-wise Statistics:")
         for stat in table_statistics:
             print(
-                f"Table: {stat['Table Name']}, Rows Inserted: {stat['Rows Inserted']}, Elapsed Time: {stat['Elapsed Time (s)']:.2f} seconds"
+                f"Table: {stat['Table Name']}, Rows Inserted: {stat['Rows Inserted']}, Rows Skipped: {stat['Rows Skipped']}, Elapsed Time: {stat['Elapsed Time (s)']:.2f} seconds"
             )
 
         print(
-            f"All files processed. Total rows inserted: {total_rows_inserted}, Total Time elapsed: {end_time - start_time:.2f} seconds"
+            f"All files processed. Total rows inserted: {total_rows_inserted}, Total rows skipped: {total_rows_skipped}, Total Time elapsed: {end_time - start_time:.2f} seconds"
         )
 
     except Exception as e: